@@ -11,11 +11,16 @@ from sklearn import cluster
 import itertools
 import time
 import generation_utilities
+import gradient_kernels
+import search_engine
 
 
 def compute_grad(x, model, loss_func=keras.losses.binary_crossentropy):
     # compute the gradient of loss w.r.t input attributes
 
+    if loss_func is keras.losses.binary_crossentropy:
+        return compute_grad_batch([x], model)[0]
+    model = gradient_kernels.unwrap(model)
     x = tf.constant([x], dtype=tf.float32)
     y_pred = tf.cast(model(x) > 0.5, dtype=tf.float32)
     with tf.GradientTape() as tape:
@@ -25,213 +30,70 @@ def compute_grad(x, model, loss_func=keras.losses.binary_crossentropy):
     return gradient[0].numpy()
 
 
+def compute_grad_batch(X, model):
+    # compute the gradients of loss w.r.t input attributes for a batch of instances within one compiled trace
+
+    return gradient_kernels.adf_gradients(X, model)
+
+
+def engine(epsilon=1e-6):
+    # ADF on the shared search engine
+    # the global phase follows the sign of the loss gradients without momentum
+    # the local phase recomputes the saliency before every step against a random flipped pair
+
+    return search_engine.SearchEngine(search_engine.GradientSource(compute_grad_batch), search_engine.GlobalDirection(1),
+                                      search_engine.SaliencySampler(0, epsilon))
+
+
 def global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g):
     # global generation phase of ADF
 
-    g_id = np.empty(shape=(0, num_attribs))
-    all_gen_g = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    g_num = len(seeds)
-    for i in range(g_num):
-        x1 = seeds[i].copy()
-        for _ in range(max_iter):
-            try_times += 1
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                g_id = np.append(g_id, [x1], axis=0)
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model)
-            grad2 = compute_grad(x2, model)
-            direction = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction[attrib] = sign_grad1[attrib]
-            x1 = x1 + s_g * direction
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen_g = np.append(all_gen_g, [x1], axis=0)
-    g_id = np.array(list(set([tuple(id) for id in g_id])))
-    return g_id, all_gen_g, try_times
-
-   
+    return engine().global_generation(seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+
+
+def population_global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g):
+    # global generation phase of ADF that advances all the seeds together as one population
+
+    return engine().population_global_generation(seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+
+
 def local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, epsilon):
     # local generation phase of ADF
 
-    direction = [-1, 1]
-    l_id = np.empty(shape=(0, num_attribs))
-    all_gen_l = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    for x1 in g_id:
-        x0 = x1.copy()
-        for _ in range(l_num):
-            try_times += 1
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            x2 = generation_utilities.find_pair(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model)
-            grad2 = compute_grad(x2, model)
-            # calculate every NOT-P attribute normalized salience probability（the probability of P attribute is 0）
-            p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-            # randomly pick an NOT-P attribute from a probability distribution
-            a = generation_utilities.random_pick(p)
-            # randomly pick a pertubation direction, the result is -1 or 1
-            s = generation_utilities.random_pick([0.5, 0.5])
-            # pertube the selected NOT-P attibute or not
-            x1[a] = x1[a] + direction[s] * s_l
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen_l = np.append(all_gen_l, [x1], axis=0)
-            # get new simliar_set by new x1(new seed)
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                l_id = np.append(l_id, [x1], axis=0)
-            else:
-                x1 = x0.copy()
-    l_id = np.array(list(set([tuple(id) for id in l_id])))
-    return l_id, all_gen_l, try_times
-
-
-def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, l_num, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6):
+    return engine(epsilon).local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l)
+
+
+def multichain_local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, epsilon, num_chains=1):
+    # local generation phase of ADF with all the random walks advanced together as rows of one matrix
+
+    return engine(epsilon).multichain_local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, num_chains)
+
+
+def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, l_num, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6, population=False, multichain=False, num_chains=1):
     # complete implementation of ADF
     # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated and total number of search iterations
+    # set population=True to run the global generation phase on all the seeds simultaneously
+    # set multichain=True to run the local generation phase as num_chains batched chains per global discriminatory instance
 
-    num_attribs = len(X[0])
-    g_id, gen_g, g_gen_num = global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
-    l_id, gen_l, l_gen_num = local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, epsilon)
-    all_id = np.append(g_id, l_id, axis=0)
-    all_gen = np.append(gen_g, gen_l, axis=0)
-    all_id_nondup = np.array(list(set([tuple(id) for id in all_id])))
-    all_gen_nondup = np.array(list(set([tuple(gen) for gen in all_gen])))
-    return all_id_nondup, all_gen_nondup, g_gen_num + l_gen_num
+    return engine(epsilon).individual_discrimination_generation(seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l, population, multichain, num_chains)
 
 
 def seedwise_generation(X, seeds, protected_attribs, constraint, model, l_num, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6):
     # perform global generation and local generation successively on each single seed
 
-    num_seeds = len(seeds)
-    num_gen = np.array([0] * num_seeds)
-    num_ids = np.array([0] * num_seeds)
-    num_attribs = len(X[0])
-    ids = np.empty(shape=(0, num_attribs))
-    all_gen = np.empty(shape=(0, num_attribs))
-    direction_l = [-1, 1]
-    for index, instance in enumerate(seeds):
-        x1 = instance.copy()
-        flag = False
-        for _ in range(max_iter):
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                ids = np.append(ids, [x1], axis=0)
-                flag = True
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model)
-            grad2 = compute_grad(x2, model)
-            direction_g = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction_g[attrib] = sign_grad1[attrib]
-            x1 = x1 + s_g * direction_g
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen = np.append(all_gen, [x1], axis=0)
-        if flag == True:
-            x0 = x1.copy()
-            for _ in range(l_num):
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                grad1 = compute_grad(x1, model)
-                grad2 = compute_grad(x2, model)
-                p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                a = generation_utilities.random_pick(p)
-                s = generation_utilities.random_pick([0.5, 0.5])
-                x1[a] = x1[a] + direction_l[s] * s_l
-                x1 = generation_utilities.clip(x1, constraint)
-                all_gen = np.append(all_gen, [x1], axis=0)
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                    ids = np.append(ids, [x1], axis=0)
-                else:
-                    x1 = x0.copy()
-        nondup_ids = np.array(list(set([tuple(id) for id in ids])))
-        nondup_gen = np.array(list(set([tuple(gen) for gen in all_gen])))
-        num_gen[index] = len(nondup_gen)
-        num_ids[index] = len(nondup_ids)
-    return num_gen, num_ids
+    return engine(epsilon).seedwise_generation(seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l)
+
+
+def generation_stream(X, seeds, protected_attribs, constraint, model, l_num, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6, yield_all=False):
+    # perform global generation and local generation successively on each single seed, lazily
+    # yield every new individual discriminatory instance as soon as it is found, so that the consumer can stop at any moment
+    # set yield_all=True to yield (instance, is_disc) for every instance generated instead
+
+    return engine(epsilon).generation_stream(seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l, yield_all)
+
 
 def time_record(X, seeds, protected_attribs, constraint, model, l_num, record_step, record_frequency, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6):
     # record time consumption
-    
-    t1 = time.time()
-    num_attribs = len(X[0])
-    t = np.array([0.0] * record_frequency)
-    direction_l = [-1, 1]
-    threshold = record_step
-    index = 0
-    ids = np.empty(shape=(0, num_attribs))
-    num_ids = num_ids_before = 0
-    for instance in seeds:
-        if num_ids >= record_frequency * record_step:
-            break
-        x1 = instance.copy()
-        flag = False
-        for i in range(max_iter+1):
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                ids = np.append(ids, [x1], axis=0)
-                flag = True
-                break
-            if i == max_iter:
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model)
-            grad2 = compute_grad(x2, model)
-            direction_g = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction_g[attrib] = sign_grad1[attrib]
-            x1 = x1 + s_g * direction_g
-            x1 = generation_utilities.clip(x1, constraint)
-            t2 = time.time()
-        if flag == True:
-            ids = np.array(list(set([tuple(id) for id in ids])))
-            num_ids = len(ids)
-            if num_ids > num_ids_before:
-                num_ids_before = num_ids
-                if num_ids == threshold:
-                    t[index] = t2 - t1
-                    threshold += record_step
-                    index += 1
-                    if num_ids >= record_frequency * record_step:
-                        break
-            x0 = x1.copy()
-            for _ in range(l_num):
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                grad1 = compute_grad(x1, model)
-                grad2 = compute_grad(x2, model)
-                p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                a = generation_utilities.random_pick(p)
-                s = generation_utilities.random_pick([0.5, 0.5])
-                x1[a] = x1[a] + direction_l[s] * s_l
-                x1 = generation_utilities.clip(x1, constraint)
-                t2 = time.time()
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                    ids = np.append(ids, [x1], axis=0)
-                    ids = np.array(list(set([tuple(id) for id in ids])))
-                    num_ids = len(ids)
-                    if num_ids > num_ids_before:
-                        num_ids_before = num_ids
-                        if num_ids == threshold:
-                            t[index] = t2 - t1
-                            threshold += record_step
-                            index += 1
-                            if num_ids >= record_frequency * record_step:
-                                break
-                else:
-                    x1 = x0.copy()
-    return t
\ No newline at end of file
+
+    stream = generation_stream(X, seeds, protected_attribs, constraint, model, l_num, max_iter, s_g, s_l, epsilon)
+    return generation_utilities.record_time(stream, record_step, record_frequency)
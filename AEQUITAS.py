@@ -12,80 +12,136 @@ import time
 import generation_utilities
 
 # initial_input as input parameter
-# let try_times = seeds
-def global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g, initial_input):
+def global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g, initial_input, chunk_size=32):
     # global generation phase of AEQUITAS
+    # try_times counts the random candidates checked, one per seed unless the query budget runs out
 
-    g_id = np.empty(shape=(0, num_attribs))
-    all_gen_g = np.empty(shape=(0, num_attribs))
-    # try_times = 0
     g_num = len(seeds)
-    try_times = g_num
-    x1 = initial_input.copy()
+    all_gen_g = np.repeat([initial_input], g_num, axis=0)
     for i in range(g_num):
-        for j in range(num_attribs):
-            # random select to make a new potential individual instance
-            # and clip the generating instance with each feature to make sure it is valid
+        all_gen_g[i] = random_candidate(initial_input, num_attribs, constraint)
+    # the random candidates are independent, so they are checked as populations of chunk_size candidates
+    # a chunk stopped by the query budget is dropped, the chunks checked before it are kept
+    g_id = generation_utilities.DedupSet(num_attribs, constraint)
+    try_times = 0
+    try:
+        for start in range(0, g_num, chunk_size):
+            chunk = all_gen_g[start:start + chunk_size]
+            is_disc, _ = generation_utilities.is_discriminatory_batch(chunk, num_attribs, protected_attribs, constraint, model)
+            g_id.extend(chunk[is_disc])
+            try_times += len(chunk)
+    except generation_utilities.QueryBudgetExceeded:
+        # the model ran out of query budget, keep what has been found so far
+        pass
+    g_id = g_id.view()
+    return g_id, all_gen_g[:try_times], try_times
+
+def random_candidate(initial_input, num_attribs, constraint, rng=None):
+    # a new potential individual instance, drawn feature by feature within the constraint so that it is valid
+    # the features are drawn from the random module, or from the numpy RandomState rng if given
+
+    x1 = np.array(initial_input)
+    for j in range(num_attribs):
+        if rng is None:
             x1[j] = random.randint(constraint[j][0], constraint[j][1])
-        similar_x = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-        if generation_utilities.is_discriminatory(x1, similar_x, model):
-            g_id = np.append(g_id, [x1], axis=0)
-        all_gen_g = np.append(all_gen_g, [x1], axis=0)
-    g_id = np.array(list(set([tuple(id) for id in g_id])))
-    return g_id, all_gen_g, try_times
+        else:
+            x1[j] = rng.randint(constraint[j][0], constraint[j][1] + 1)
+    return x1
 
-# param_probability, param_probability_change_size,direction_probability, direction_probability_change_size as input parameters
-def local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, epsilon, param_probability, param_probability_change_size,
-                 direction_probability, direction_probability_change_size):
-    # local generation phase of AEQUITAS
+
+def perturb(x1, num_attribs, constraint, s_l, probabilities, rng=np.random):
+    # perturb one feature of x1 in place, following the direction and feature probabilities
+    # return the feature and the direction chosen
 
     direction = [-1, 1]
-    l_id = np.empty(shape=(0, num_attribs))
-    all_gen_l = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    for x1 in g_id:
-        x0 = x1.copy()
-        for _ in range(l_num):
-            try_times += 1
-            # randomly choose the feature for perturbation
-            param_choice = np.random.choice(range(num_attribs), p=param_probability)
+    direction_probability = probabilities['direction']
+    # randomly choose the feature for perturbation
+    param_choice = rng.choice(range(num_attribs), p=probabilities['param'])
 
-            # randomly choose the direction for perturbation
-            direction_choice = np.random.choice(direction, p=[direction_probability[param_choice], (1 - direction_probability[param_choice])])
-            if (x1[param_choice] == constraint[param_choice][0]) or (
-                    x1[param_choice] == constraint[param_choice][1]):
-                direction_choice = np.random.choice(direction)
+    # randomly choose the direction for perturbation
+    direction_choice = rng.choice(direction, p=[direction_probability[param_choice], (1 - direction_probability[param_choice])])
+    if (x1[param_choice] == constraint[param_choice][0]) or (
+            x1[param_choice] == constraint[param_choice][1]):
+        direction_choice = rng.choice(direction)
 
-            # perturbation
-            x1[param_choice] = x1[param_choice] + (direction_choice * s_l)
+    # perturbation
+    x1[param_choice] = x1[param_choice] + (direction_choice * s_l)
+    return param_choice, direction_choice
 
-            # clip the generating instance with each feature to make sure it is valid
-            x1 = generation_utilities.clip(x1, constraint)
 
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            is_discriminatory = generation_utilities.is_discriminatory(x1, similar_x1, model)
-            if is_discriminatory:
-                l_id = np.append(l_id, [x1], axis=0)
-            else:
-                x1 = x0.copy()
-            all_gen_l = np.append(all_gen_l, [x1], axis=0)
-
-            # update the probabilities of directions
-            if (is_discriminatory and direction_choice == -1) or (not is_discriminatory and direction_choice == 1):
-                direction_probability[param_choice] = min(direction_probability[param_choice] + (direction_probability_change_size * s_l), 1)
-            elif (not is_discriminatory and direction_choice == -1) or (is_discriminatory and direction_choice == 1):
-                direction_probability[param_choice] = max(direction_probability[param_choice] - (direction_probability_change_size * s_l), 0)
-
-            # update the probabilities of features
-            if is_discriminatory:
-                param_probability[param_choice] = param_probability[param_choice] + param_probability_change_size
-            else:
-                param_probability[param_choice] = max(param_probability[param_choice] - param_probability_change_size, 0)
-            # normalize the probabilities of features
-            param_probability = param_probability / np.sum(param_probability)
-
-    l_id = np.array(list(set([tuple(id) for id in l_id])))
-    return l_id, all_gen_l, try_times
+def update_probabilities(probabilities, param_choice, direction_choice, is_discriminatory, s_l):
+    # learn the direction and feature probabilities from the outcome of one perturbation, in place
+
+    direction_probability = probabilities['direction']
+    change_size = probabilities['direction_change_size'] * s_l
+    # update the probabilities of directions
+    if (is_discriminatory and direction_choice == -1) or (not is_discriminatory and direction_choice == 1):
+        direction_probability[param_choice] = min(direction_probability[param_choice] + change_size, 1)
+    elif (not is_discriminatory and direction_choice == -1) or (is_discriminatory and direction_choice == 1):
+        direction_probability[param_choice] = max(direction_probability[param_choice] - change_size, 0)
+
+    # update the probabilities of features
+    param_probability = probabilities['param']
+    if is_discriminatory:
+        param_probability[param_choice] = param_probability[param_choice] + probabilities['param_change_size']
+    else:
+        param_probability[param_choice] = max(param_probability[param_choice] - probabilities['param_change_size'], 0)
+    # normalize the probabilities of features
+    probabilities['param'] = param_probability / np.sum(param_probability)
+
+
+def local_walk(x0, l_num, num_attribs, protected_attribs, constraint, model, s_l, probabilities):
+    # local search of AEQUITAS around one discriminatory instance, run lazily
+    # yield (instance, is_disc) for every perturbed instance tested, the walk restarts from x0 after every non-discriminatory one
+    # the probabilities are updated in place, so that they are learnt across all the walks sharing them
+
+    return generation_utilities.serve(local_steps(x0, l_num, num_attribs, protected_attribs, constraint, s_l, probabilities), model)
+
+
+def local_steps(x0, l_num, num_attribs, protected_attribs, constraint, s_l, probabilities, rng=np.random):
+    # the steps of local_walk, querying the model through the requests of generation_utilities.serve and drawing from rng
+
+    x1 = np.array(x0)
+    for _ in range(l_num):
+        param_choice, direction_choice = perturb(x1, num_attribs, constraint, s_l, probabilities, rng)
+
+        # clip the generating instance with each feature to make sure it is valid
+        x1 = generation_utilities.clip(x1, constraint)
+
+        similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
+        is_discriminatory = yield 'disc', x1, similar_x1
+        yield 'instance', x1.copy(), is_discriminatory
+        if not is_discriminatory:
+            x1 = np.array(x0)
+        update_probabilities(probabilities, param_choice, direction_choice, is_discriminatory, s_l)
+
+
+# param_probability, param_probability_change_size,direction_probability, direction_probability_change_size as input parameters
+def local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, epsilon, param_probability, param_probability_change_size,
+                 direction_probability, direction_probability_change_size):
+    # local generation phase of AEQUITAS
+
+    probabilities = {'direction': direction_probability, 'direction_change_size': direction_probability_change_size,
+                     'param': param_probability, 'param_change_size': param_probability_change_size}
+    l_id = generation_utilities.DedupSet(num_attribs, constraint)
+    all_gen_l = generation_utilities.RowBuffer(num_attribs, generation_utilities.domain_dtype(constraint))
+    try_times = 0
+    try:
+        for x0 in g_id:
+            for x1, is_discriminatory in local_walk(x0, l_num, num_attribs, protected_attribs, constraint, model, s_l, probabilities):
+                try_times += 1
+                if is_discriminatory:
+                    l_id.append(x1)
+                    all_gen_l.append(x1)
+                else:
+                    # the walk is back at x0
+                    all_gen_l.append(x0)
+    except generation_utilities.QueryBudgetExceeded:
+        # the model ran out of query budget, keep what has been found so far
+        pass
+
+    l_id = l_id.view()
+    return l_id, all_gen_l.view(), try_times
 
 
 # initial_input as input parameter
@@ -114,8 +170,43 @@ def individual_discrimination_generation(X, seeds, protected_attribs, constraint
     l_id, gen_l, l_gen_num = local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l,
                                               epsilon, param_probability, param_probability_change_size,
                  direction_probability, direction_probability_change_size)
-    all_id = np.append(g_id, l_id, axis=0)
-    all_gen = np.append(gen_g, gen_l, axis=0)
-    all_id_nondup = np.array(list(set([tuple(id) for id in all_id])))
-    all_gen_nondup = np.array(list(set([tuple(gen) for gen in all_gen])))
-    return all_id_nondup, all_gen_nondup, g_gen_num + l_gen_num
\ No newline at end of file
+    all_id_nondup = generation_utilities.DedupSet(num_attribs, constraint)
+    all_id_nondup.extend(g_id)
+    all_id_nondup.extend(l_id)
+    all_gen_nondup = generation_utilities.DedupSet(num_attribs, constraint)
+    all_gen_nondup.extend(gen_g)
+    all_gen_nondup.extend(gen_l)
+    return all_id_nondup.view(), all_gen_nondup.view(), g_gen_num + l_gen_num
+
+def generation_stream(X, seeds, protected_attribs, constraint, model, l_num, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6,
+                      initial_input=None, yield_all=False):
+    # perform global generation and local generation successively on each random candidate, lazily
+    # one random candidate is drawn per seed as in global_generation, and its local search is the local_walk of local_generation
+    # yield every new individual discriminatory instance as soon as it is found, so that the consumer can stop at any moment
+    # set yield_all=True to yield (instance, is_disc) for every instance generated instead
+    # only the keys of the instances found are kept in memory to tell the new ones
+
+    num_attribs = len(X[0])
+    probabilities = {'direction': [0.5] * num_attribs, 'direction_change_size': 0.001,
+                     'param': [1.0 / num_attribs] * num_attribs, 'param_change_size': 0.001}
+    if initial_input is None:
+        initial_input = np.zeros_like(X[0])
+
+    ids = generation_utilities.DedupSet(num_attribs, constraint, keep_rows=False)
+    try:
+        for _ in range(len(seeds)):
+            x1 = random_candidate(initial_input, num_attribs, constraint)
+            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
+            is_discriminatory = generation_utilities.is_discriminatory(x1, similar_x1, model)
+            candidates = itertools.chain([(x1, is_discriminatory)],
+                                         local_walk(x1, l_num, num_attribs, protected_attribs, constraint, model, s_l, probabilities)
+                                         if is_discriminatory else [])
+            for x, is_discriminatory in candidates:
+                is_new = is_discriminatory and ids.append(x)
+                if yield_all:
+                    yield x.copy(), is_discriminatory
+                elif is_new:
+                    yield x.copy()
+    except generation_utilities.QueryBudgetExceeded:
+        # the model ran out of query budget, end the stream
+        pass
@@ -10,270 +10,84 @@ from sklearn import cluster
 import itertools
 import time
 import generation_utilities
+import gradient_kernels
+import search_engine
 
 
 def compute_grad(x, model):
     # compute the gradient of model perdictions w.r.t input attributes
+    # change 1: switch gradient from gradient(loss/x) to gradient(y/x)
 
-    x = tf.constant([x], dtype=tf.float32)
-    with tf.GradientTape() as tape:
-        tape.watch(x)
-        # change 1: switch gradient from gradient(loss/x) to gradient(y/x)
-        y_pred = model(x)
-    gradient = tape.gradient(y_pred, x)
-    return gradient[0].numpy() if model(x) > 0.5 else -gradient[0].numpy()
+    return compute_grad_batch([x], model)[0]
+
+
+def compute_grad_batch(X, model):
+    # compute the gradients of model predictions w.r.t input attributes for a batch of instances within one compiled trace
+
+    return gradient_kernels.eidig_gradients(X, model)
+
+
+def engine(decay=0.5, update_interval=5, epsilon=1e-6):
+    # EIDIG on the shared search engine
+    # change 2 use momentum to boost global generation
+    # change 3 use update_interval to reduce the frequency of gradient calculation during local generation
+
+    return search_engine.SearchEngine(search_engine.GradientSource(compute_grad_batch), search_engine.GlobalDirection(-1, decay),
+                                      search_engine.SaliencySampler(update_interval, epsilon))
 
 
 def global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, decay, max_iter, s_g):
     # global generation phase of EIDIG
 
-    g_id = np.empty(shape=(0, num_attribs))
-    all_gen_g = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    g_num = len(seeds)
-    for i in range(g_num):
-        x1 = seeds[i].copy()
-        grad1 = np.zeros_like(X[0]).astype(float)
-        grad2 = np.zeros_like(X[0]).astype(float)
-        for _ in range(max_iter):
-            try_times += 1
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                g_id = np.append(g_id, [x1], axis=0)
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            # change 2 use momentum to boost global generation
-            grad1 = decay * grad1 + compute_grad(x1, model)
-            grad2 = decay * grad2 + compute_grad(x2, model)
-            direction = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction[attrib] = (-1) * sign_grad1[attrib]
-            x1 = x1 + s_g * direction
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen_g = np.append(all_gen_g, [x1], axis=0)
-    g_id = np.array(list(set([tuple(id) for id in g_id])))
-    return g_id, all_gen_g, try_times
+    return engine(decay).global_generation(seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+
+
+def population_global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, decay, max_iter, s_g):
+    # global generation phase of EIDIG that advances all the seeds together as one population
+
+    return engine(decay).population_global_generation(seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
 
 
 def local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, update_interval, s_l, epsilon):
     # local generation phase of EIDIG
 
-    direction = [-1, 1]
-    l_id = np.empty(shape=(0, num_attribs))
-    all_gen_l = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    for x1 in g_id:
-        x0 = x1.copy()
-        similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-        x2 = generation_utilities.max_diff(x1, similar_x1, model)
-        grad1 = compute_grad(x1, model)
-        grad2 = compute_grad(x2, model)
-        p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-        p0 = p.copy()
-        suc_iter = 0
-        for _ in range(l_num):
-            try_times += 1
-            # change 3 use update_interval to reduce the frequency of gradient calculation during local generation
-            if suc_iter >= update_interval:
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                grad1 = compute_grad(x1, model)
-                grad2 = compute_grad(x2, model)
-                p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                suc_iter = 0
-            suc_iter += 1
-            a = generation_utilities.random_pick(p)
-            s = generation_utilities.random_pick([0.5, 0.5])
-            x1[a] = x1[a] + direction[s] * s_l
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen_l = np.append(all_gen_l, [x1], axis=0)
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                l_id = np.append(l_id, [x1], axis=0)
-            else:
-                x1 = x0.copy()
-                p = p0.copy()
-                suc_iter = 0
-    l_id = np.array(list(set([tuple(id) for id in l_id])))
-    return l_id, all_gen_l, try_times
-    
-
-def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6):
+    return engine(update_interval=update_interval, epsilon=epsilon).local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l)
+
+
+def multichain_local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, update_interval, s_l, epsilon, num_chains=1):
+    # local generation phase of EIDIG with all the random walks advanced together as rows of one matrix
+
+    return engine(update_interval=update_interval, epsilon=epsilon).multichain_local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, num_chains)
+
+
+def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, population=False, multichain=False, num_chains=1):
     # complete implementation of EIDIG
     # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated and total number of search iterations
+    # set population=True to run the global generation phase on all the seeds simultaneously
+    # set multichain=True to run the local generation phase as num_chains batched chains per global discriminatory instance
 
-    num_attribs = len(X[0])
-    g_id, gen_g, g_gen_num = global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, decay, max_iter, s_g)
-    l_id, gen_l, l_gen_num = local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, update_interval, s_l, epsilon_l)
-    all_id = np.append(g_id, l_id, axis=0)
-    all_gen = np.append(gen_g, gen_l, axis=0)
-    all_id_nondup = np.array(list(set([tuple(id) for id in all_id])))
-    all_gen_nondup = np.array(list(set([tuple(gen) for gen in all_gen])))
-    return all_id_nondup, all_gen_nondup, g_gen_num + l_gen_num
+    return engine(decay, update_interval, epsilon_l).individual_discrimination_generation(seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l, population, multichain, num_chains)
 
 
 def seedwise_generation(X, seeds, protected_attribs, constraint, model, l_num, decay, update_interval, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6):
     # perform global generation and local generation successively on each single seed
 
-    num_seeds = len(seeds)
-    num_gen = np.array([0] * num_seeds)
-    num_ids = np.array([0] * num_seeds)
-    num_attribs = len(X[0])
-    ids = np.empty(shape=(0, num_attribs))
-    all_gen = np.empty(shape=(0, num_attribs))
-    direction = [-1, 1]
-    for index, instance in enumerate(seeds):
-        x1 = instance.copy()
-        flag = False
-        grad1 = np.zeros_like(X[0]).astype(float)
-        grad2 = np.zeros_like(X[0]).astype(float)
-        for j in range(max_iter):
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                ids = np.append(ids, [x1], axis=0)
-                flag = True
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = decay * grad1 + compute_grad(x1, model)
-            grad2 = decay * grad2 + compute_grad(x2, model)
-            direction_g = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction_g[attrib] = (-1) * sign_grad1[attrib]
-            x1 = x1 + s_g * direction_g
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen = np.append(all_gen, [x1], axis=0)
-        if flag == True:
-            x0 = x1.copy()
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model)
-            grad2 = compute_grad(x2, model)
-            p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-            p0 = p.copy()
-            suc_iter = 0
-            for _ in range(l_num):
-                if suc_iter >= update_interval:
-                    similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                    x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                    grad1 = compute_grad(x1, model)
-                    grad2 = compute_grad(x2, model)
-                    p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                    suc_iter = 0
-                suc_iter += 1
-                a = generation_utilities.random_pick(p)
-                s = generation_utilities.random_pick([0.5, 0.5])
-                x1[a] = x1[a] + direction[s] * s_l
-                x1 = generation_utilities.clip(x1, constraint)
-                all_gen = np.append(all_gen, [x1], axis=0)
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                    ids = np.append(ids, [x1], axis=0)
-                else:
-                    x1 = x0.copy()
-                    p = p0.copy()
-                    suc_iter = 0
-        nondup_ids = np.array(list(set([tuple(id) for id in ids])))
-        nondup_gen = np.array(list(set([tuple(gen) for gen in all_gen])))
-        num_gen[index] = len(nondup_gen)
-        num_ids[index] = len(nondup_ids)
-    return num_gen, num_ids
+    return engine(decay, update_interval, epsilon).seedwise_generation(seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l)
+
+
+def generation_stream(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6, yield_all=False):
+    # perform global generation and local generation successively on each single seed, lazily
+    # yield every new individual discriminatory instance as soon as it is found, so that the consumer can stop at any moment
+    # set yield_all=True to yield (instance, is_disc) for every instance generated instead
+
+    return engine(decay, update_interval, epsilon).generation_stream(seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l, yield_all)
 
 
 def time_record(X, seeds, protected_attribs, constraint, model, decay, l_num, record_step, record_frequency, update_interval, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6):
     # record time consumption
-    
-    num_attribs = len(X[0])
-    t = np.array([0.0] * record_frequency)
-    direction_l = [-1, 1]
-    threshold = record_step
-    index = 0
-    t1 = time.time()
-    ids = np.empty(shape=(0, num_attribs))
-    num_ids = num_ids_before = 0
-    for instance in seeds:
-        if num_ids >= record_frequency * record_step:
-            break
-        x1 = instance.copy()
-        flag = False
-        grad1 = np.zeros_like(X[0]).astype(float)
-        grad2 = np.zeros_like(X[0]).astype(float)
-        for i in range(max_iter+1):
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                ids = np.append(ids, [x1], axis=0)
-                flag = True
-                break
-            if i == max_iter:
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = decay * grad1 + compute_grad(x1, model)
-            grad2 = decay * grad2 + compute_grad(x2, model)
-            direction_g = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction_g[attrib] = (-1) * sign_grad1[attrib]
-            x1 = x1 + s_g * direction_g
-            x1 = generation_utilities.clip(x1, constraint)
-            t2 = time.time()
-        if flag == True:
-            ids = np.array(list(set([tuple(id) for id in ids])))
-            num_ids = len(ids)
-            if num_ids > num_ids_before:
-                num_ids_before = num_ids
-                if num_ids == threshold:
-                    t[index] = t2 - t1
-                    threshold += record_step
-                    index += 1
-                    if num_ids >= record_frequency * record_step:
-                        break
-            x0 = x1.copy()
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model)
-            grad2 = compute_grad(x2, model)
-            p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-            p0 = p.copy()
-            suc_iter = 0
-            for _ in range(l_num):
-                if suc_iter >= update_interval:
-                    similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                    x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                    grad1 = compute_grad(x1, model)
-                    grad2 = compute_grad(x2, model)
-                    p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                    suc_iter = 0
-                suc_iter += 1
-                a = generation_utilities.random_pick(p)
-                s = generation_utilities.random_pick([0.5, 0.5])
-                x1[a] = x1[a] + direction_l[s] * s_l
-                x1 = generation_utilities.clip(x1, constraint)
-                t2 = time.time()
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                    ids = np.append(ids, [x1], axis=0)
-                    ids = np.array(list(set([tuple(id) for id in ids])))
-                    num_ids = len(ids)
-                    if num_ids > num_ids_before:
-                        num_ids_before = num_ids
-                        if num_ids == threshold:
-                            t[index] = t2 - t1
-                            threshold += record_step
-                            index += 1
-                            if num_ids >= record_frequency * record_step:
-                                break
-                else:
-                    x1 = x0.copy()
-                    p = p0.copy()
-                    suc_iter = 0
-    return t
+
+    stream = generation_stream(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval, max_iter, s_g, s_l, epsilon)
+    return generation_utilities.record_time(stream, record_step, record_frequency)
 
 '''
 根据梯度计算全局生成阶段的direction信息
@@ -290,7 +104,7 @@ def global_direction_comparison(X, seeds, num_attribs, protected_attribs, constr
     # g_id = np.empty(shape=(0, num_attribs))
     # all_gen_g = np.empty(shape=(0, num_attribs))
     # try_times = 0
-    directions = np.empty(shape=(0, num_attribs))
+    directions = generation_utilities.RowBuffer(num_attribs)
     max_iter = 1 # 令max_iter=1，只进行一次迭代 原因：我们只比较用于指导全局生成的第一次的direction信息的一致性
     g_num = len(seeds)
     for i in range(g_num):
@@ -300,10 +114,10 @@ def global_direction_comparison(X, seeds, num_attribs, protected_attribs, constr
         for _ in range(max_iter):
             # try_times += 1
             similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
+            is_disc, x2, _ = generation_utilities.pair_selection(x1, similar_x1, model)
+            if is_disc:
                 # g_id = np.append(g_id, [x1], axis=0)
                 break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
             # change 2 use momentum to boost global generation
             grad1 = decay * grad1 + compute_grad(x1, model)
             grad2 = decay * grad2 + compute_grad(x2, model)
@@ -313,13 +127,13 @@ def global_direction_comparison(X, seeds, num_attribs, protected_attribs, constr
             for attrib in range(num_attribs):
                 if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
                     direction[attrib] = (-1) * sign_grad1[attrib]
-            directions = np.append(directions, [direction], axis=0)
+            directions.append(direction)
             # x1 = x1 + s_g * direction
             # x1 = generation_utilities.clip(x1, constraint)
             # all_gen_g = np.append(all_gen_g, [x1], axis=0)
     # g_id = np.array(list(set([tuple(id) for id in g_id])))
     # return g_id, all_gen_g, try_times
-    return directions
+    return directions.view()
 
 '''
 根据梯度计算局部生成阶段的归一化probability信息
@@ -334,7 +148,7 @@ def local_probability_comparision(seeds, num_attribs, protected_attribs, constra
     # l_id = np.empty(shape=(0, num_attribs))
     # all_gen_l = np.empty(shape=(0, num_attribs))
     # try_times = 0
-    probabilities = np.empty(shape=(0, num_attribs))
+    probabilities = generation_utilities.RowBuffer(num_attribs)
     # for x1 in g_id:
     for x1 in seeds:
         # x0 = x1.copy()
@@ -343,5 +157,5 @@ def local_probability_comparision(seeds, num_attribs, protected_attribs, constra
         grad1 = compute_grad(x1, model)
         grad2 = compute_grad(x2, model)
         p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-        probabilities = np.append(probabilities, [p], axis=0)
-    return probabilities
+        probabilities.append(p)
+    return probabilities.view()
@@ -6,10 +6,15 @@ Implement this for compare of ADF(original gradient), EIDIG (real gradient) and
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
+import gradient_kernels
+import MAFT
 
 def compute_grad_adf(x, model, loss_func=keras.losses.binary_crossentropy):
     # compute the gradient of loss w.r.t input attributes
 
+    if loss_func is keras.losses.binary_crossentropy:
+        return gradient_kernels.adf_gradients([x], model)[0]
+    model = gradient_kernels.unwrap(model)
     x = tf.constant([x], dtype=tf.float32)
     y_pred = tf.cast(model(x) > 0.5, dtype=tf.float32)
     with tf.GradientTape() as tape:
@@ -20,31 +25,14 @@ def compute_grad_adf(x, model, loss_func=keras.losses.binary_crossentropy):
 
 def compute_grad_eidig(x, model):
     # compute the gradient of model perdictions w.r.t input attributes
+    # change 1: switch gradient from gradient(loss/x) to gradient(y/x)
 
-    x = tf.constant([x], dtype=tf.float32)
-    with tf.GradientTape() as tape:
-        tape.watch(x)
-        # change 1: switch gradient from gradient(loss/x) to gradient(y/x)
-        y_pred = model(x)
-    gradient = tape.gradient(y_pred, x)
-    return gradient[0].numpy() if model(x) > 0.5 else -gradient[0].numpy()
+    return gradient_kernels.eidig_gradients([x], model)[0]
 
 def compute_grad_maft(x, model, perturbation_size=1e-4):
     # compute the gradient of model perdictions w.r.t input attributes
-    h = perturbation_size
-    n = len(x)
-    e = np.empty(n)
-    e.fill(h)
-    E = np.diag(e)
-    X = np.repeat([x], n, axis=0)
-    X = X + E
-    X = tf.constant(X, dtype=tf.float32)
-    Y = model(X)
-    x = tf.constant([x], dtype=tf.float32)
-    y_pred = model(x)
-    gradient = (Y - y_pred) / h
-    gradient = tf.reshape(gradient, [1, -1])
-    return gradient[0].numpy() if model(x) > 0.5 else -gradient[0].numpy()
+
+    return MAFT.compute_grad(x, model, perturbation_size)
 
 def compute_grad_maft_non_vectorized(x, model, perturbation_size=1e-4):
     h = perturbation_size
@@ -59,7 +47,7 @@ def compute_grad_maft_non_vectorized(x, model, perturbation_size=1e-4):
         x_perturbed = tf.constant([x_perturbed], dtype=tf.float32)
         y_perturbed = model(x_perturbed)
         # calculate the gradient on the i_th attribute
-        gradient[i] = (y_perturbed - y_pred) / h
+        gradient[i] = (y_perturbed - y_pred)[0, 0] / h
 
     return gradient if model(tf.constant([x])) > 0.5 else -gradient
 
@@ -8,283 +8,143 @@ from tensorflow import keras
 from sklearn import cluster
 import itertools
 import time
+import functools
 import generation_utilities
+import search_engine
 
 
-def compute_grad(x, model, perturbation_size=1e-4):
+def compute_grad(x, model, perturbation_size=1e-4, scheme='forward', num_directions=None):
     # compute the gradient of model perdictions w.r.t input attributes
+
+    return compute_grad_batch([x], model, perturbation_size, scheme, num_directions)[0]
+
+
+def probe_directions(num_attribs, scheme='forward', num_directions=None):
+    # perturbation directions of a finite-difference scheme, the first row of zeros probes the instance itself
+    # 'forward' probes every unit vector, 'central' every unit vector both ways,
+    # 'spsa' num_directions random Rademacher vectors and 'subspace' num_directions random orthonormal vectors (num_attribs by default)
+
+    zeros = np.zeros((1, num_attribs))
+    if scheme == 'forward':
+        return np.vstack((zeros, np.eye(num_attribs)))
+    elif scheme == 'central':
+        return np.vstack((zeros, np.eye(num_attribs), -np.eye(num_attribs)))
+    elif scheme == 'spsa':
+        k = num_directions if num_directions is not None else num_attribs
+        return np.vstack((zeros, np.where(np.random.rand(k, num_attribs) < 0.5, -1.0, 1.0)))
+    elif scheme == 'subspace':
+        k = min(num_directions if num_directions is not None else num_attribs, num_attribs)
+        q, _ = np.linalg.qr(np.random.randn(num_attribs, k))
+        return np.vstack((zeros, q.T))
+    else:
+        raise ValueError("Invalid scheme")
+
+
+def compute_grad_batch(X, model, perturbation_size=1e-4, scheme='forward', num_directions=None):
+    # estimate the gradients of a batch of instances, the instances and all their perturbed copies are scored in one forward pass
+    # a gradient costs num_attribs+1 rows with forward differences, 2*num_attribs+1 with central ones and num_directions+1 with SPSA
+    # or random subspaces, whose random directions are shared by the whole batch so that the gradients of a pair stay comparable
+    # the randomized estimates are dense and rescaled to be unbiased, as global search needs their signs and local search their magnitudes
+    # the rows are scored through generation_utilities.predict, the compiled forward pass for Keras models, so that a wrapped model
+    # (cache, meter, adapter) sees the same rows and every path divides by the same nominal step h
+
     h = perturbation_size
-    n = len(x)
-    e = np.empty(n)
-    e.fill(h)
-    E = np.diag(e)
-    X = np.repeat([x], n, axis=0)
-    X = X + E
-    X = tf.constant(X, dtype=tf.float32)
-    Y = model(X)
-    x = tf.constant([x], dtype=tf.float32)
-    y_pred = model(x)
-    gradient = (Y - y_pred) / h
-    gradient = tf.reshape(gradient, [1, -1])
-    return gradient[0].numpy() if model(x) > 0.5 else -gradient[0].numpy()
+    X = np.asarray(X, dtype=float)
+    n = X.shape[1]
+    E = probe_directions(n, scheme, num_directions)
+    perturbed = X[:, np.newaxis, :] + h * E
+    Y = generation_utilities.predict(model, perturbed.reshape(-1, n)).reshape(len(X), len(E))
+    y_pred = Y[:, :1]
+    if scheme == 'forward':
+        gradient = (Y[:, 1:] - y_pred) / h
+    elif scheme == 'central':
+        gradient = (Y[:, 1:n+1] - Y[:, n+1:]) / (2 * h)
+    elif scheme == 'spsa':
+        gradient = ((Y[:, 1:] - y_pred) / h) @ E[1:] / (len(E) - 1)
+    else:
+        gradient = ((Y[:, 1:] - y_pred) / h) @ E[1:] * n / (len(E) - 1)
+    return np.where(y_pred > 0.5, gradient, -gradient)
+
+
+def engine(decay=0.5, update_interval=5, epsilon=1e-6, perturbation_size=1e-4, scheme='forward', num_directions=None):
+    # MAFT on the shared search engine, EIDIG with gradients estimated by finite differences
+
+    grad_fn = functools.partial(compute_grad_batch, perturbation_size=perturbation_size, scheme=scheme, num_directions=num_directions)
+    return search_engine.SearchEngine(search_engine.GradientSource(grad_fn), search_engine.GlobalDirection(-1, decay),
+                                      search_engine.SaliencySampler(update_interval, epsilon))
 
 
 def global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, decay, max_iter, s_g,
                       perturbation_size):
     # global generation phase of EIDIG
 
-    g_id = np.empty(shape=(0, num_attribs))
-    all_gen_g = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    g_num = len(seeds)
-    for i in range(g_num):
-        x1 = seeds[i].copy()
-        grad1 = np.zeros_like(X[0]).astype(float)
-        grad2 = np.zeros_like(X[0]).astype(float)
-        for _ in range(max_iter):
-            try_times += 1
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                g_id = np.append(g_id, [x1], axis=0)
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            # 3.2 use momentum
-            grad1 = decay * grad1 + compute_grad(x1, model, perturbation_size)
-            grad2 = decay * grad2 + compute_grad(x2, model, perturbation_size)
-            direction = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction[attrib] = (-1) * sign_grad1[attrib]
-            x1 = x1 + s_g * direction
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen_g = np.append(all_gen_g, [x1], axis=0)
-    g_id = np.array(list(set([tuple(id) for id in g_id])))
-    return g_id, all_gen_g, try_times
+    return engine(decay, perturbation_size=perturbation_size).global_generation(seeds, num_attribs, protected_attribs, constraint,
+                                                                                model, max_iter, s_g)
+
+
+def population_global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, decay, max_iter, s_g,
+                                 perturbation_size):
+    # global generation phase of MAFT that advances all the seeds together as one population
+
+    return engine(decay, perturbation_size=perturbation_size).population_global_generation(seeds, num_attribs, protected_attribs,
+                                                                                           constraint, model, max_iter, s_g)
 
 
 def local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, update_interval, s_l, epsilon,
                      perturbation_size):
     # local generation phase of EIDIG
 
-    direction = [-1, 1]
-    l_id = np.empty(shape=(0, num_attribs))
-    all_gen_l = np.empty(shape=(0, num_attribs))
-    try_times = 0
-    for x1 in g_id:
-        x0 = x1.copy()
-        similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-        x2 = generation_utilities.max_diff(x1, similar_x1, model)
-        grad1 = compute_grad(x1, model, perturbation_size)
-        grad2 = compute_grad(x2, model, perturbation_size)
-        p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-        p0 = p.copy()
-        suc_iter = 0
-        for _ in range(l_num):
-            try_times += 1
-            if suc_iter >= update_interval:
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                grad1 = compute_grad(x1, model, perturbation_size)
-                grad2 = compute_grad(x2, model, perturbation_size)
-                p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                suc_iter = 0
-            suc_iter += 1
-            a = generation_utilities.random_pick(p)
-            s = generation_utilities.random_pick([0.5, 0.5])
-            x1[a] = x1[a] + direction[s] * s_l
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen_l = np.append(all_gen_l, [x1], axis=0)
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                l_id = np.append(l_id, [x1], axis=0)
-            else:
-                x1 = x0.copy()
-                p = p0.copy()
-                suc_iter = 0
-    l_id = np.array(list(set([tuple(id) for id in l_id])))
-    return l_id, all_gen_l, try_times
+    return engine(update_interval=update_interval, epsilon=epsilon, perturbation_size=perturbation_size).local_generation(
+        num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l)
+
+
+def multichain_local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, update_interval, s_l, epsilon,
+                                perturbation_size, num_chains=1):
+    # local generation phase of MAFT with all the random walks advanced together as rows of one matrix
+
+    return engine(update_interval=update_interval, epsilon=epsilon, perturbation_size=perturbation_size).multichain_local_generation(
+        num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, num_chains)
 
 
 def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval,
-                                         max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, perturbation_size=1e-4):
+                                         max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, perturbation_size=1e-4,
+                                         population=False, multichain=False, num_chains=1, scheme='forward', num_directions=None):
     # complete implementation of EIDIG
     # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated and total number of search iterations
+    # set population=True to run the global generation phase on all the seeds simultaneously
+    # set multichain=True to run the local generation phase as num_chains batched chains per global discriminatory instance
+    # set scheme='spsa' or 'subspace' to estimate every gradient with a budget of num_directions+1 queries instead of num_attribs+1
 
-    num_attribs = len(X[0])
-    g_id, gen_g, g_gen_num = global_generation(X, seeds, num_attribs, protected_attribs, constraint, model, decay,
-                                               max_iter, s_g, perturbation_size)
-    l_id, gen_l, l_gen_num = local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model,
-                                              update_interval, s_l, epsilon_l, perturbation_size)
-    all_id = np.append(g_id, l_id, axis=0)
-    all_gen = np.append(gen_g, gen_l, axis=0)
-    all_id_nondup = np.array(list(set([tuple(id) for id in all_id])))
-    all_gen_nondup = np.array(list(set([tuple(gen) for gen in all_gen])))
-    return all_id_nondup, all_gen_nondup, g_gen_num + l_gen_num
+    return engine(decay, update_interval, epsilon_l, perturbation_size, scheme, num_directions).individual_discrimination_generation(
+        seeds, len(X[0]), protected_attribs, constraint, model, max_iter, s_g, l_num, s_l, population, multichain, num_chains)
 
 
 def seedwise_generation(X, seeds, protected_attribs, constraint, model, l_num, decay, update_interval, max_iter=10,
                         s_g=1.0, s_l=1.0, epsilon=1e-6, perturbation_size=1e-4):
     # perform global generation and local generation successively on each single seed
 
-    num_seeds = len(seeds)
-    num_gen = np.array([0] * num_seeds)
-    num_ids = np.array([0] * num_seeds)
-    num_attribs = len(X[0])
-    ids = np.empty(shape=(0, num_attribs))
-    all_gen = np.empty(shape=(0, num_attribs))
-    direction = [-1, 1]
-    for index, instance in enumerate(seeds):
-        x1 = instance.copy()
-        flag = False
-        grad1 = np.zeros_like(X[0]).astype(float)
-        grad2 = np.zeros_like(X[0]).astype(float)
-        for j in range(max_iter):
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                ids = np.append(ids, [x1], axis=0)
-                flag = True
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = decay * grad1 + compute_grad(x1, model, perturbation_size)
-            grad2 = decay * grad2 + compute_grad(x2, model, perturbation_size)
-            direction_g = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction_g[attrib] = (-1) * sign_grad1[attrib]
-            x1 = x1 + s_g * direction_g
-            x1 = generation_utilities.clip(x1, constraint)
-            all_gen = np.append(all_gen, [x1], axis=0)
-        if flag == True:
-            x0 = x1.copy()
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model, perturbation_size)
-            grad2 = compute_grad(x2, model, perturbation_size)
-            p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-            p0 = p.copy()
-            suc_iter = 0
-            for _ in range(l_num):
-                if suc_iter >= update_interval:
-                    similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                    x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                    grad1 = compute_grad(x1, model, perturbation_size)
-                    grad2 = compute_grad(x2, model, perturbation_size)
-                    p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                    suc_iter = 0
-                suc_iter += 1
-                a = generation_utilities.random_pick(p)
-                s = generation_utilities.random_pick([0.5, 0.5])
-                x1[a] = x1[a] + direction[s] * s_l
-                x1 = generation_utilities.clip(x1, constraint)
-                all_gen = np.append(all_gen, [x1], axis=0)
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                    ids = np.append(ids, [x1], axis=0)
-                else:
-                    x1 = x0.copy()
-                    p = p0.copy()
-                    suc_iter = 0
-        nondup_ids = np.array(list(set([tuple(id) for id in ids])))
-        nondup_gen = np.array(list(set([tuple(gen) for gen in all_gen])))
-        num_gen[index] = len(nondup_gen)
-        num_ids[index] = len(nondup_ids)
-    return num_gen, num_ids
+    return engine(decay, update_interval, epsilon, perturbation_size).seedwise_generation(seeds, len(X[0]), protected_attribs,
+                                                                                          constraint, model, max_iter, s_g, l_num, s_l)
+
+
+def generation_stream(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval, max_iter=10,
+                      s_g=1.0, s_l=1.0, epsilon=1e-6, perturbation_size=1e-4, yield_all=False, scheme='forward', num_directions=None):
+    # perform global generation and local generation successively on each single seed, lazily
+    # yield every new individual discriminatory instance as soon as it is found, so that the consumer can stop at any moment
+    # set yield_all=True to yield (instance, is_disc) for every instance generated instead
+
+    return engine(decay, update_interval, epsilon, perturbation_size, scheme, num_directions).generation_stream(seeds, len(X[0]), protected_attribs,
+                                                                                        constraint, model, max_iter, s_g, l_num,
+                                                                                        s_l, yield_all)
 
 
 def time_record(X, seeds, protected_attribs, constraint, model, decay, l_num, record_step, record_frequency,
                 update_interval, max_iter=10, s_g=1.0, s_l=1.0, epsilon=1e-6, perturbation_size=1e-4):
     # record time consumption
 
-    num_attribs = len(X[0])
-    t = np.array([0.0] * record_frequency)
-    direction_l = [-1, 1]
-    threshold = record_step
-    index = 0
-    t1 = time.time()
-    ids = np.empty(shape=(0, num_attribs))
-    num_ids = num_ids_before = 0
-    for instance in seeds:
-        if num_ids >= record_frequency * record_step:
-            break
-        x1 = instance.copy()
-        flag = False
-        grad1 = np.zeros_like(X[0]).astype(float)
-        grad2 = np.zeros_like(X[0]).astype(float)
-        for i in range(max_iter + 1):
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                ids = np.append(ids, [x1], axis=0)
-                flag = True
-                break
-            if i == max_iter:
-                break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = decay * grad1 + compute_grad(x1, model, perturbation_size)
-            grad2 = decay * grad2 + compute_grad(x2, model, perturbation_size)
-            direction_g = np.zeros_like(X[0])
-            sign_grad1 = np.sign(grad1)
-            sign_grad2 = np.sign(grad2)
-            for attrib in range(num_attribs):
-                if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
-                    direction_g[attrib] = (-1) * sign_grad1[attrib]
-            x1 = x1 + s_g * direction_g
-            x1 = generation_utilities.clip(x1, constraint)
-            t2 = time.time()
-        if flag == True:
-            ids = np.array(list(set([tuple(id) for id in ids])))
-            num_ids = len(ids)
-            if num_ids > num_ids_before:
-                num_ids_before = num_ids
-                if num_ids == threshold:
-                    t[index] = t2 - t1
-                    threshold += record_step
-                    index += 1
-                    if num_ids >= record_frequency * record_step:
-                        break
-            x0 = x1.copy()
-            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
-            grad1 = compute_grad(x1, model, perturbation_size)
-            grad2 = compute_grad(x2, model, perturbation_size)
-            p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-            p0 = p.copy()
-            suc_iter = 0
-            for _ in range(l_num):
-                if suc_iter >= update_interval:
-                    similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                    x2 = generation_utilities.find_pair(x1, similar_x1, model)
-                    grad1 = compute_grad(x1, model, perturbation_size)
-                    grad2 = compute_grad(x2, model, perturbation_size)
-                    p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-                    suc_iter = 0
-                suc_iter += 1
-                a = generation_utilities.random_pick(p)
-                s = generation_utilities.random_pick([0.5, 0.5])
-                x1[a] = x1[a] + direction_l[s] * s_l
-                x1 = generation_utilities.clip(x1, constraint)
-                t2 = time.time()
-                similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-                if generation_utilities.is_discriminatory(x1, similar_x1, model):
-                    ids = np.append(ids, [x1], axis=0)
-                    ids = np.array(list(set([tuple(id) for id in ids])))
-                    num_ids = len(ids)
-                    if num_ids > num_ids_before:
-                        num_ids_before = num_ids
-                        if num_ids == threshold:
-                            t[index] = t2 - t1
-                            threshold += record_step
-                            index += 1
-                            if num_ids >= record_frequency * record_step:
-                                break
-                else:
-                    x1 = x0.copy()
-                    p = p0.copy()
-                    suc_iter = 0
-    return t
+    stream = generation_stream(X, seeds, protected_attribs, constraint, model, decay, l_num, update_interval, max_iter, s_g,
+                               s_l, epsilon, perturbation_size)
+    return generation_utilities.record_time(stream, record_step, record_frequency)
 
 '''
 根据梯度计算全局生成阶段的direction信息
@@ -301,7 +161,7 @@ def global_direction_comparison(X, seeds, num_attribs, protected_attribs, constr
     # g_id = np.empty(shape=(0, num_attribs))
     # all_gen_g = np.empty(shape=(0, num_attribs))
     # try_times = 0
-    directions = np.empty(shape=(0, num_attribs))
+    directions = generation_utilities.RowBuffer(num_attribs)
     max_iter = 1 # 令max_iter=1，只进行一次迭代 原因：我们只比较用于指导全局生成的第一次的direction信息的一致性
     g_num = len(seeds)
     for i in range(g_num):
@@ -311,10 +171,10 @@ def global_direction_comparison(X, seeds, num_attribs, protected_attribs, constr
         for _ in range(max_iter):
             # try_times += 1
             similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
-            if generation_utilities.is_discriminatory(x1, similar_x1, model):
+            is_disc, x2, _ = generation_utilities.pair_selection(x1, similar_x1, model)
+            if is_disc:
                 # g_id = np.append(g_id, [x1], axis=0)
                 break
-            x2 = generation_utilities.max_diff(x1, similar_x1, model)
             # change 2 use momentum to boost global generation
             grad1 = decay * grad1 + compute_grad(x1, model, perturbation_size)
             grad2 = decay * grad2 + compute_grad(x2, model, perturbation_size)
@@ -324,13 +184,13 @@ def global_direction_comparison(X, seeds, num_attribs, protected_attribs, constr
             for attrib in range(num_attribs):
                 if attrib not in protected_attribs and sign_grad1[attrib] == sign_grad2[attrib]:
                     direction[attrib] = (-1) * sign_grad1[attrib]
-            directions = np.append(directions, [direction], axis=0)
+            directions.append(direction)
             # x1 = x1 + s_g * direction
             # x1 = generation_utilities.clip(x1, constraint)
             # all_gen_g = np.append(all_gen_g, [x1], axis=0)
     # g_id = np.array(list(set([tuple(id) for id in g_id])))
     # return g_id, all_gen_g, try_times
-    return directions
+    return directions.view()
 
 '''
 根据梯度计算局部生成阶段的归一化probability信息
@@ -345,7 +205,7 @@ def local_probability_comparision(seeds, num_attribs, protected_attribs, constra
     # l_id = np.empty(shape=(0, num_attribs))
     # all_gen_l = np.empty(shape=(0, num_attribs))
     # try_times = 0
-    probabilities = np.empty(shape=(0, num_attribs))
+    probabilities = generation_utilities.RowBuffer(num_attribs)
     # for x1 in g_id:
     for x1 in seeds:
         # x0 = x1.copy()
@@ -354,5 +214,5 @@ def local_probability_comparision(seeds, num_attribs, protected_attribs, constra
         grad1 = compute_grad(x1, model, perturbation_size)
         grad2 = compute_grad(x2, model, perturbation_size)
         p = generation_utilities.normalization(grad1, grad2, protected_attribs, epsilon)
-        probabilities = np.append(probabilities, [p], axis=0)
-    return probabilities
\ No newline at end of file
+        probabilities.append(p)
+    return probabilities.view()
\ No newline at end of file
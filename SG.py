@@ -10,7 +10,8 @@ from adf_baseline.lime import lime_tabular
 from sklearn.tree import DecisionTreeClassifier
 from z3 import Solver, sat, Int
 import copy
-from queue import PriorityQueue
+import heapq
+from collections import OrderedDict
 
 def model_argmax(model, samples):
     """
@@ -22,27 +23,70 @@ def model_argmax(model, samples):
     preds = model(samples)
     return (preds > 0.5).numpy().astype(int)
 
-def getPath(X, model, input, conf):
+# least-recently-used LIME explainers already built, by the identity of their dataset and the configuration fields they use
+# each is kept with its dataset so that the identity is not reused while it is cached
+_explainers = OrderedDict()
+explainer_capacity = 8
+
+def get_explainer(X, conf):
     """
-    Get the path from Local Interpretable Model-agnostic Explanation Tree
+    Build the LIME explainer of a dataset and configuration once and reuse it for every instance to interpret
     :param X: the whole inputs
-    :param model: TensorFlow 2 model
+    :param conf: the configuration of dataset
+    :return: the explainer fitted on X
+    """
+    key = (id(X), tuple(conf['feature_name']), tuple(conf['class_name']), tuple(conf['categorical_features']))
+    if key in _explainers:
+        _explainers.move_to_end(key)
+    else:
+        explainer = lime_tabular.LimeTabularExplainer(X,
+                                                      feature_names=conf['feature_name'],
+                                                      class_names=conf['class_name'],
+                                                      categorical_features=conf['categorical_features'],
+                                                      discretize_continuous=True)
+        _explainers[key] = (X, explainer)
+        while len(_explainers) > explainer_capacity:
+            _explainers.popitem(last=False)
+    return _explainers[key][1]
+
+def generate_neighbors(explainer, inputs, num_samples=5000, random_state=None):
+    """
+    Sample the neighborhoods of several instances in one call, as explainer.generate_instance does for each of them in turn
+    :param explainer: LIME explainer
+    :param inputs: instances to interpret
+    :param num_samples: the size of each neighborhood
+    :param random_state: numpy RandomState the columns are drawn from, the random state of the explainer by default (continuous
+    features are still sampled back from their bins by the discretizer of the explainer)
+    :return: array of shape (len(inputs), num_samples, num_attributes), the first neighbor of every instance is the instance itself
+    """
+    random_state = random_state if random_state is not None else explainer.random_state
+    inputs = np.asarray(inputs, dtype=float)
+    columns = explainer.categorical_features
+    # every column is drawn from its training frequencies by inverting its cdf
+    cdfs = [np.cumsum(explainer.feature_frequencies[column]) for column in columns]
+    cdfs = [cdf / cdf[-1] for cdf in cdfs]
+    values = [np.asarray(explainer.feature_values[column], dtype=float) for column in columns]
+    undiscretize = explainer.discretizer is not None and len(explainer.discretizer.means) > 0
+    neighbors = np.zeros((len(inputs), num_samples, inputs.shape[1]))
+    for neighborhood in neighbors:
+        # the uniform samples are drawn in the order generate_instance consumes them, column by column, and the continuous
+        # features of each instance are sampled back from their bins before the next instance is drawn, as undiscretize
+        # shares the random state of the explainer, so the random stream is unchanged
+        uniform = random_state.random_sample((len(columns), num_samples))
+        for j, column in enumerate(columns):
+            neighborhood[:, column] = values[j][cdfs[j].searchsorted(uniform[j], side='right')]
+        if undiscretize:
+            neighborhood[1:] = explainer.discretizer.undiscretize(neighborhood[1:])
+    neighbors[:, 0] = inputs
+    return neighbors
+
+def tree_path(tree, input):
+    """
+    Get the path of an instance in a decision tree
+    :param tree: fitted decision tree
     :param input: instance to interpret
     :return: the path for the decision of given instance
     """
-    explainer = lime_tabular.LimeTabularExplainer(X,
-                                                  feature_names=conf['feature_name'],
-                                                  class_names=conf['class_name'],
-                                                  categorical_features=conf['categorical_features'],
-                                                  discretize_continuous=True)
-    g_data = explainer.generate_instance(input, num_samples=5000)
-    g_labels = model_argmax(model, g_data)
-
-    # build the interpretable tree
-    tree = DecisionTreeClassifier(random_state=2019) #min_samples_split=0.05, min_samples_leaf =0.01
-    tree.fit(g_data, g_labels)
-
-    # get the path for decision
     path_index = tree.decision_path(np.array([input])).indices
     path = []
     for i in range(len(path_index)):
@@ -60,70 +104,357 @@ def getPath(X, model, input, conf):
                 path.append([f, ">", tree.tree_.threshold[node], right_confidence])
     return path
 
-def global_solve(path_constraint, arguments, t, constraint):
+def fit_trees(X, model, inputs, conf, num_samples=5000):
+    """
+    Fit the Local Interpretable Model-agnostic Explanation Trees of several instances
+    :param X: the whole inputs
+    :param model: TensorFlow 2 model
+    :param inputs: instances to interpret, their neighborhoods are sampled in one call and labeled with one model query
+    :param num_samples: the size of each neighborhood
+    :return: the interpretable tree of every given instance
+    """
+    neighbors = generate_neighbors(get_explainer(X, conf), inputs, num_samples)
+    labels = model_argmax(model, neighbors.reshape(-1, neighbors.shape[2])).reshape(len(neighbors), num_samples, -1)
+    trees = []
+    for g_data, g_labels in zip(neighbors, labels):
+        # build the interpretable tree
+        tree = DecisionTreeClassifier(random_state=2019) #min_samples_split=0.05, min_samples_leaf =0.01
+        tree.fit(g_data, g_labels)
+        trees.append(tree)
+    return trees
+
+def getPaths(X, model, inputs, conf, num_samples=5000):
+    """
+    Get the paths of several instances from Local Interpretable Model-agnostic Explanation Trees
+    :param X: the whole inputs
+    :param model: TensorFlow 2 model
+    :param inputs: instances to interpret, their neighborhoods are sampled in one call and labeled with one model query
+    :param num_samples: the size of each neighborhood
+    :return: the path for the decision of every given instance
+    """
+    trees = fit_trees(X, model, inputs, conf, num_samples)
+    # get the path for decision
+    return [tree_path(tree, input) for tree, input in zip(trees, inputs)]
+
+def getPath(X, model, input, conf):
+    """
+    Get the path from Local Interpretable Model-agnostic Explanation Tree
+    :param X: the whole inputs
+    :param model: TensorFlow 2 model
+    :param input: instance to interpret
+    :return: the path for the decision of given instance
+    """
+    return getPaths(X, model, [input], conf)[0]
+
+class SurrogateCache:
+    """
+    Cache of the interpretable trees fitted for the latest instances, reused to explain the nearby instances
+    An instance falling in a leaf holding at least min_leaf_samples neighbors of the latest such tree is explained by it if
+    the tree agrees with the model on at least min_fidelity of fidelity_samples instances differing from the instance in
+    one feature, otherwise a tree is fitted for the instance and replaces the oldest of the max_trees cached.
+    A reuse costs fidelity_samples model rows and no fitting, against num_samples rows and a fit for a new tree.
+    The fidelity samples are drawn from a private random state seeded with seed, so that checking a tree leaves the global
+    random stream of the search untouched.
+    """
+    def __init__(self, X, model, conf, max_trees=8, fidelity_samples=100, min_fidelity=0.9, min_leaf_samples=5, num_samples=5000,
+                 seed=0):
+        self.X = X
+        self.model = model
+        self.conf = conf
+        self.max_trees = max_trees
+        self.fidelity_samples = fidelity_samples
+        self.min_fidelity = min_fidelity
+        self.min_leaf_samples = min_leaf_samples
+        self.num_samples = num_samples
+        self.random_state = np.random.RandomState(seed)
+        self.trees = []
+        self.num_reused = 0
+        self.num_refit = 0
+        self.num_rejected = 0
+        self.num_rows = 0
+
+    def getPath(self, input):
+        """
+        Get the path of an instance from a cached tree or from a tree fitted for it
+        :param input: instance to interpret
+        :return: the path for the decision of given instance
+        """
+        sample = np.array([input], dtype=float)
+        for tree in reversed(self.trees):
+            leaf = tree.apply(sample)[0]
+            if tree.tree_.n_node_samples[leaf] < self.min_leaf_samples:
+                continue
+            if self.fidelity(tree, input) >= self.min_fidelity:
+                self.num_reused += 1
+                return tree_path(tree, input)
+            # the region has drifted away from the model, refit
+            self.num_rejected += 1
+            break
+        tree = fit_trees(self.X, self.model, [input], self.conf, self.num_samples)[0]
+        self.num_refit += 1
+        self.num_rows += self.num_samples
+        self.trees.append(tree)
+        if len(self.trees) > self.max_trees:
+            self.trees.pop(0)
+        return tree_path(tree, input)
+
+    def fidelity(self, tree, input):
+        """
+        The agreement of a tree with the model on instances differing from input in one feature, drawn as in its neighborhood
+        """
+        neighbors = generate_neighbors(get_explainer(self.X, self.conf), [input], self.fidelity_samples + 1, self.random_state)[0][1:]
+        rows = np.arange(self.fidelity_samples)
+        features = self.random_state.randint(len(input), size=self.fidelity_samples)
+        samples = np.tile(np.asarray(input, dtype=float), (self.fidelity_samples, 1))
+        samples[rows, features] = neighbors[rows, features]
+        self.num_rows += self.fidelity_samples
+        return np.mean(tree.predict(samples).reshape(-1) == model_argmax(self.model, samples).reshape(-1))
+
+    def stats(self):
+        """
+        The counters of the cache, reuse_rate is the fraction of the paths taken from cached trees
+        """
+        num_paths = self.num_reused + self.num_refit
+        return {'reused': self.num_reused, 'refit': self.num_refit, 'rejected': self.num_rejected, 'model_rows': self.num_rows,
+                'reuse_rate': self.num_reused / num_paths if num_paths > 0 else 0.0}
+
+class PathSolver:
+    """
+    Solver of the path constraints of a whole search, with the variables and domain bounds of all the features set up once
+    Paths are asserted on one incremental z3 solver with a push per constraint, so consecutive paths sharing a prefix only
+    assert their new constraints, and solutions are memoized by the canonical set of (feature, op, threshold) of the path.
+    The interval backend solves the paths in closed form instead, as they are conjunctions of bounds on single features,
+    taking the lowest feasible value of every feature.
+    """
+    def __init__(self, arguments, constraint, backend='z3'):
+        if backend not in ('z3', 'interval'):
+            raise ValueError("Invalid backend")
+        self.arguments = arguments
+        self.bounds = constraint.tolist()
+        self.backend = backend
+        self.solutions = {}
+        self.num_solves = 0
+        self.num_hits = 0
+        if backend == 'z3':
+            self.solver = Solver()
+            for i in range(len(arguments)):
+                self.solver.add(arguments[i] >= self.bounds[i][0])
+                self.solver.add(arguments[i] <= self.bounds[i][1])
+            # the constraints currently asserted, one solver scope each
+            self.asserted = []
+
+    def solve(self, path_constraint):
+        """
+        Solve a path constraint
+        :param path_constraint: the constraint of path, the confidences are ignored
+        :return: the values of the features of path_constraint satisfying it, None if there is none
+        """
+        self.num_solves += 1
+        constraints = [(int(c[0]), c[1], float(c[2])) for c in path_constraint]
+        key = frozenset(constraints)
+        if key in self.solutions:
+            self.num_hits += 1
+            return self.solutions[key]
+        if self.backend == 'z3':
+            solution = self.z3_solve(constraints)
+        else:
+            solution = self.interval_solve(constraints)
+        self.solutions[key] = solution
+        return solution
+
+    def z3_solve(self, constraints):
+        # keep the scopes of the common prefix with the constraints asserted, pop the others and push the new ones
+        common = 0
+        while common < min(len(self.asserted), len(constraints)) and self.asserted[common] == constraints[common]:
+            common += 1
+        if len(self.asserted) > common:
+            self.solver.pop(len(self.asserted) - common)
+            del self.asserted[common:]
+        for f, op, threshold in constraints[common:]:
+            self.solver.push()
+            if op == "<=":
+                self.solver.add(self.arguments[f] <= threshold)
+            else:
+                self.solver.add(self.arguments[f] > threshold)
+            self.asserted.append((f, op, threshold))
+        if self.solver.check() != sat:
+            return None
+        m = self.solver.model()
+        return {f: m.eval(self.arguments[f], model_completion=True).as_long() for f, _, _ in constraints}
+
+    def interval_solve(self, constraints):
+        lower = {}
+        upper = {}
+        for f, op, threshold in constraints:
+            if op == "<=":
+                upper[f] = min(upper.get(f, self.bounds[f][1]), int(np.floor(threshold)))
+            else:
+                lower[f] = max(lower.get(f, self.bounds[f][0]), int(np.floor(threshold)) + 1)
+        solution = {}
+        for f, _, _ in constraints:
+            solution[f] = int(lower.get(f, self.bounds[f][0]))
+            if solution[f] > upper.get(f, self.bounds[f][1]):
+                return None
+        return solution
+
+    def stats(self):
+        """
+        The counters of the solver, hit_rate is the fraction of the path constraints answered from memory
+        """
+        return {'solves': self.num_solves, 'hits': self.num_hits,
+                'hit_rate': self.num_hits / self.num_solves if self.num_solves > 0 else 0.0}
+
+class PathIndex:
+    """
+    Index of the path constraints already visited, a trie over their (feature, op, quantized threshold) steps
+    The confidences are left out and the thresholds rounded, so that equal paths are found in time linear in their length.
+    Global candidates extend one prefix a step at a time, so they are looked up from the node of their prefix.
+    """
+    def __init__(self, decimals=6):
+        self.root = {}
+        self.decimals = decimals
+        self.size = 0
+
+    def child(self, node, c):
+        """
+        The node of the path of node extended by the constraint c, created if needed
+        """
+        return node.setdefault((int(c[0]), c[1], round(float(c[2]), self.decimals)), {})
+
+    def add(self, path_constraint, node=None):
+        """
+        Mark a path constraint as visited
+        :param path_constraint: the constraint of path, or its steps after the prefix of node
+        :param node: the node of a prefix to descend from, the root if None
+        :return: True if the path was not visited before
+        """
+        node = self.root if node is None else node
+        for c in path_constraint:
+            node = self.child(node, c)
+        # the steps are tuples, so None marks the end of a visited path
+        if None in node:
+            return False
+        node[None] = True
+        self.size += 1
+        return True
+
+class Frontier:
+    """
+    Priority frontier of the candidates of symbolic generation, the lowest rank first and the earliest pushed among equal ranks
+    The candidates are stored in a preallocated integer matrix whose rows are reused once popped, and the heap only holds
+    (rank, order, row) entries. A candidate pushed again while pending keeps the better of its ranks instead of being queued twice.
+    """
+    def __init__(self, num_attribs, constraint, capacity=64):
+        self.rows = np.empty((capacity, num_attribs), dtype=generation_utilities.domain_dtype(constraint))
+        # the order and rank of the live heap entry of every row, order -1 for the free rows
+        self.live = np.full(capacity, -1, dtype=np.int64)
+        self.ranks = np.zeros(capacity)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.heap = []
+        self.pending = {}
+        self.order = 0
+        self.num_merged = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def grow(self):
+        capacity = len(self.rows)
+        rows = np.empty((2 * capacity, self.rows.shape[1]), dtype=self.rows.dtype)
+        rows[:capacity] = self.rows
+        self.rows = rows
+        self.live = np.concatenate((self.live, np.full(capacity, -1, dtype=np.int64)))
+        self.ranks = np.concatenate((self.ranks, np.zeros(capacity)))
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def push(self, rank, candidate):
+        """
+        Push a candidate
+        :param rank: the priority of the candidate, lower is popped first
+        :param candidate: the instance
+        :return: whether the candidate was queued or re-ranked, False if it was already pending with a better rank
+        """
+        candidate = np.asarray(candidate).astype(self.rows.dtype)
+        key = candidate.tobytes()
+        row = self.pending.get(key)
+        if row is not None:
+            self.num_merged += 1
+            if rank >= self.ranks[row]:
+                return False
+        else:
+            if len(self.free) == 0:
+                self.grow()
+            row = self.free.pop()
+            self.rows[row] = candidate
+            self.pending[key] = row
+        # any older entry of the row becomes stale
+        self.live[row] = self.order
+        self.ranks[row] = rank
+        heapq.heappush(self.heap, (rank, self.order, row))
+        self.order += 1
+        return True
+
+    def pop(self, k=1):
+        """
+        Pop the best pending candidates
+        :param k: the maximum number of candidates to pop
+        :return: their ranks and a copy of their rows, best first
+        """
+        ranks = []
+        rows = []
+        while len(self.heap) > 0 and len(rows) < k:
+            rank, order, row = heapq.heappop(self.heap)
+            if self.live[row] != order:
+                continue
+            self.live[row] = -1
+            ranks.append(rank)
+            rows.append(row)
+            del self.pending[self.rows[row].tobytes()]
+            self.free.append(row)
+        return np.array(ranks), self.rows[rows]
+
+def global_solve(path_constraint, arguments, t, constraint, solver=None):
     """
     Solve the constraint for global generation
     :param path_constraint: the constraint of path
     :param arguments: the name of features in path_constraint
     :param t: test case
-    :param conf: the configuration of dataset
+    :param constraint: the domain of the features
+    :param solver: PathSolver shared by the search, a fresh one is used if None
     :return: new instance through global generation
     """
-    s = Solver()
-    for c in path_constraint:
-        # s.add(arguments[c[0]] >= conf.input_bounds[c[0]][0])
-        # s.add(arguments[c[0]] <= conf.input_bounds[c[0]][1])
-        s.add(arguments[c[0]] >= constraint.tolist()[c[0]][0])
-        s.add(arguments[c[0]] <= constraint.tolist()[c[0]][1])
-        if c[1] == "<=":
-            s.add(arguments[c[0]] <= c[2])
-        else:
-            s.add(arguments[c[0]] > c[2])
-
-    if s.check() == sat:
-        m = s.model()
-    else:
+    if solver is None:
+        solver = PathSolver(arguments, constraint)
+    solution = solver.solve(path_constraint)
+    if solution is None:
         return None
 
     tnew = copy.deepcopy(t)
-    # tnew = np.array(copy.deepcopy(t)) if isinstance(t, list) else np.copy(t.numpy())
-    for i in range(len(arguments)):
-        if m[arguments[i]] == None:
-            continue
-        else:
-            tnew[i] = int(m[arguments[i]].as_long())
+    for i, value in solution.items():
+        tnew[i] = value
     return tnew.astype('int').tolist()
 
-def local_solve(path_constraint, arguments, t, index, constraint):
+def local_solve(path_constraint, arguments, t, index, constraint, solver=None):
     """
     Solve the constraint for local generation
     :param path_constraint: the constraint of path
     :param arguments: the name of features in path_constraint
     :param t: test case
     :param index: the index of constraint for local generation
-    :param conf: the configuration of dataset
+    :param constraint: the domain of the features
+    :param solver: PathSolver shared by the search, a fresh one is used if None
     :return: new instance through global generation
     """
     c = path_constraint[index]
-    s = Solver()
-    # s.add(arguments[c[0]] >= conf.input_bounds[c[0]][0])
-    # s.add(arguments[c[0]] <= conf.input_bounds[c[0]][1])
-    s.add(arguments[c[0]] >= constraint.tolist()[c[0]][0])
-    s.add(arguments[c[0]] <= constraint.tolist()[c[0]][1])
-    for i in range(len(path_constraint)):
-        if path_constraint[i][0] == c[0]:
-            if path_constraint[i][1] == "<=":
-                s.add(arguments[path_constraint[i][0]] <= path_constraint[i][2])
-            else:
-                s.add(arguments[path_constraint[i][0]] > path_constraint[i][2])
-
-    if s.check() == sat:
-        m = s.model()
-    else:
+    if solver is None:
+        solver = PathSolver(arguments, constraint)
+    # only the constraints on the feature of c matter
+    solution = solver.solve([p for p in path_constraint if p[0] == c[0]])
+    if solution is None:
         return None
 
     tnew = copy.deepcopy(t)
-    tnew[c[0]] = int(m[arguments[c[0]]].as_long())
+    tnew[c[0]] = solution[c[0]]
     return tnew.astype('int').tolist()
 
 def average_confidence(path_constraint):
@@ -148,9 +479,13 @@ def gen_arguments(conf):
 
 # add aditioninal 'l_num' parameter, change the termination condition from 'len(tot_inputs) < limit' to 'try_times < limit * l_num',
 # which is convenient for comparison with the two-stage method (used to set the approximate number of search)
-def symbolic_generation(X, seeds, protected_attribs, constraint, model, limit, conf, l_num=1):
+def symbolic_search(X, seeds, protected_attribs, constraint, model, limit, conf, l_num=1, solver_backend='z3', surrogates=None, batch_size=1):
     """
-    The implementation of symbolic generation
+    The search loop of symbolic generation, run lazily
+    :param solver_backend: 'z3' or 'interval', the backend of the PathSolver shared by all the path constraints of the search
+    :param surrogates: SurrogateCache explaining the instances, a tree is fitted for every instance if None
+    :param batch_size: the number of best candidates popped at once, tested with one model query and explained together
+    :return: a generator yielding (instance, found, global) for every instance tested, returning the number of search iterations
     """
     # the rank for priority queue, rank1 is for seed inputs, rank2 for local, rank3 for global
     rank1 = 5
@@ -160,133 +495,173 @@ def symbolic_generation(X, seeds, protected_attribs, constraint, model, limit, c
 
     num_attribs = len(X[0])
     arguments = gen_arguments(conf)
-
-    g_id = np.empty(shape=(0, num_attribs))
-    # all_gen_g = np.empty(shape=(0, num_attribs))
-
-    l_id = np.empty(shape=(0, num_attribs))
-    # all_gen_l = np.empty(shape=(0, num_attribs))
+    solver = PathSolver(arguments, constraint, solver_backend)
 
     try_times = 0
-    all_gen_g_l = np.empty(shape=(0, num_attribs))
-
-    tot_inputs = set()
 
     # select the seed input for fairness testing
     # inputs = seed_test_input(dataset, cluster_num, limit)
     inputs = seeds
-    q = PriorityQueue() # low push first
-    for inp in inputs[::-1]: # reverse order
-        # q.put((rank1,X[inp].tolist()))
-        q.put((rank1, inp.tolist()))
+    q = Frontier(num_attribs, constraint) # low push first
+    for inp in inputs: # equal ranks are popped in push order
+        q.push(rank1, inp)
 
-    visited_path = []
+    visited_path = PathIndex()
     l_count = 0
     g_count = 0
+    num_processed = 0
     # while len(tot_inputs) < limit and q.qsize() != 0:
-    while try_times < limit * l_num and q.qsize() != 0:
-        t = q.get()
-        t_rank = t[0]
-        t = np.array(t[1])
-
-        # found = check_for_error_condition(data_config[dataset], sess, x, preds, t, sensitive_param)
-        similar_t = generation_utilities.similar_set(t, num_attribs, protected_attribs, constraint)
-        found = generation_utilities.is_discriminatory(t, similar_t, model)
-
-        # p = getPath(X, sess, x, preds, t, data_config[dataset])
-        p = getPath(X, model, t, conf)
-        temp = copy.deepcopy(t.tolist())
-        # temp = temp[:sensitive_param - 1] + temp[sensitive_param:]
-
-        tot_inputs.add(tuple(temp))
-        all_gen_g_l = np.append(all_gen_g_l, [temp], axis=0)
-        if found:
-            if t_rank > 2:
-                g_id = np.append(g_id, [temp], axis=0)
-                # all_gen_g = np.append(all_gen_g, [temp], axis=0)
-            else:
-                l_id = np.append(l_id, [temp], axis=0)
-                # all_gen_l = np.append(all_gen_l, [temp], axis=0)
-            # if len(tot_inputs) == limit:
-            #     break
-
-            # local search
-            for i in range(len(p)):
-                try_times += 1
-                path_constraint = copy.deepcopy(p)
-                c = path_constraint[i]
-                # if c[0] == sensitive_param - 1:
-                #     continue
-                if c[0] in protected_attribs:
-                    continue
-
-                if c[1] == "<=":
-                    c[1] = ">"
-                    c[3] = 1.0 - c[3]
-                else:
-                    c[1] = "<="
-                    c[3] = 1.0 - c[3]
-
-                if path_constraint not in visited_path:
-                    visited_path.append(path_constraint)
-                    # input = local_solve(path_constraint, arguments, t, i, data_config[dataset])
-                    input = local_solve(path_constraint, arguments, t, i, constraint)
-                    l_count += 1
-                    if input != None:
-                        r = average_confidence(path_constraint)
-                        q.put((rank2 + r, input))
-
-                if try_times == limit * l_num:
+    try:
+        while try_times < limit * l_num and len(q) != 0:
+            # the best batch_size candidates are tested and explained together
+            # a candidate popped after the tries run out is tested and explained for nothing, so no more candidates are popped
+            # than the remaining tries are expected to cover at the mean tries spent by the candidates processed so far
+            remaining = limit * l_num - try_times
+            k = min(batch_size, remaining)
+            if num_processed > 0 and try_times > 0:
+                k = min(k, int(np.ceil(remaining * num_processed / try_times)))
+            t_ranks, batch = q.pop(k)
+            found_batch, _ = generation_utilities.is_discriminatory_batch(batch, num_attribs, protected_attribs, constraint, model)
+            paths = [surrogates.getPath(t) for t in batch] if surrogates is not None else getPaths(X, model, batch, conf)
+            for t_rank, t, found, p in zip(t_ranks, batch, found_batch, paths):
+                if try_times >= limit * l_num:
                     break
+                temp = t.tolist()
+                found = bool(found)
+                num_processed += 1
+
+                yield temp, found, t_rank > 2
+                if found:
+                    # if len(tot_inputs) == limit:
+                    #     break
+
+                    # local search
+                    for i in range(len(p)):
+                        try_times += 1
+                        path_constraint = copy.deepcopy(p)
+                        c = path_constraint[i]
+                        # if c[0] == sensitive_param - 1:
+                        #     continue
+                        if c[0] in protected_attribs:
+                            continue
+
+                        if c[1] == "<=":
+                            c[1] = ">"
+                            c[3] = 1.0 - c[3]
+                        else:
+                            c[1] = "<="
+                            c[3] = 1.0 - c[3]
+
+                        if visited_path.add(path_constraint):
+                            # input = local_solve(path_constraint, arguments, t, i, data_config[dataset])
+                            input = local_solve(path_constraint, arguments, t, i, constraint, solver)
+                            l_count += 1
+                            if input != None:
+                                r = average_confidence(path_constraint)
+                                q.push(rank2 + r, input)
+
+                        if try_times == limit * l_num:
+                            break
+
+                # global search
+                prefix_pred = []
+                prefix_node = visited_path.root
+                for c in p:
+                    try_times += 1
+                    # if c[0] == sensitive_param - 1:
+                    #         continue
+                    if c[0] in protected_attribs:
+                        continue
+                    if c[3] < T1:
+                        break
+
+                    n_c = copy.deepcopy(c)
+                    if n_c[1] == "<=":
+                        n_c[1] = ">"
+                        n_c[3] = 1.0 - c[3]
+                    else:
+                        n_c[1] = "<="
+                        n_c[3] = 1.0 - c[3]
+                    path_constraint = prefix_pred + [n_c]
+
+                    # filter out the path_constraint already solved before
+                    if visited_path.add([n_c], prefix_node):
+                        input = global_solve(path_constraint, arguments, t, constraint, solver)
+                        g_count += 1
+                        if input != None:
+                            r = average_confidence(path_constraint)
+                            q.push(rank3-r, input)
+
+                    if try_times == limit * l_num:
+                        break
+                    prefix_pred = prefix_pred + [c]
+                    prefix_node = visited_path.child(prefix_node, c)
+    except generation_utilities.QueryBudgetExceeded:
+        # the model ran out of query budget, keep what has been found so far
+        pass
+    return try_times
+
+def symbolic_generation(X, seeds, protected_attribs, constraint, model, limit, conf, l_num=1, solver_backend='z3', surrogates=None, batch_size=1):
+    """
+    The implementation of symbolic generation
+    """
+    num_attribs = len(X[0])
 
-        # global search
-        prefix_pred = []
-        for c in p:
-            try_times += 1
-            # if c[0] == sensitive_param - 1:
-            #         continue
-            if c[0] in protected_attribs:
-                continue
-            if c[3] < T1:
-                break
+    g_id = generation_utilities.DedupSet(num_attribs, constraint)
+    # all_gen_g = np.empty(shape=(0, num_attribs))
+
+    l_id = generation_utilities.DedupSet(num_attribs, constraint)
+    # all_gen_l = np.empty(shape=(0, num_attribs))
 
-            n_c = copy.deepcopy(c)
-            if n_c[1] == "<=":
-                n_c[1] = ">"
-                n_c[3] = 1.0 - c[3]
+    all_gen_g_l = generation_utilities.RowBuffer(num_attribs, generation_utilities.domain_dtype(constraint))
+
+    search = symbolic_search(X, seeds, protected_attribs, constraint, model, limit, conf, l_num, solver_backend, surrogates, batch_size)
+    while True:
+        try:
+            temp, found, is_global = next(search)
+        except StopIteration as stop:
+            try_times = stop.value
+            break
+        all_gen_g_l.append(temp)
+        if found:
+            if is_global:
+                g_id.append(temp)
+                # all_gen_g = np.append(all_gen_g, [temp], axis=0)
             else:
-                n_c[1] = "<="
-                n_c[3] = 1.0 - c[3]
-            path_constraint = prefix_pred + [n_c]
-
-            # filter out the path_constraint already solved before
-            if path_constraint not in visited_path:
-                visited_path.append(path_constraint)
-                input = global_solve(path_constraint, arguments, t, constraint)
-                g_count += 1
-                if input != None:
-                    r = average_confidence(path_constraint)
-                    q.put((rank3-r, input))
-
-            if try_times == limit * l_num:
-                break
-            prefix_pred = prefix_pred + [c]
+                l_id.append(temp)
+                # all_gen_l = np.append(all_gen_l, [temp], axis=0)
     # l_id = np.array(list(set([tuple(id) for id in l_id])))
     # g_id = np.array(list(set([tuple(id) for id in g_id])))
     # g_l_id = np.vstack((g_id, l_id))
-    l_id = np.unique(l_id, axis=0)
-    g_id = np.unique(g_id, axis=0)
+    l_id = l_id.view()
+    g_id = g_id.view()
     if len(g_id) == 0:
         g_l_id = l_id
     elif len(l_id) == 0:
         g_l_id = g_id
     else:
         g_l_id = np.vstack((g_id, l_id))
-    return g_l_id, all_gen_g_l, try_times
+    return g_l_id, all_gen_g_l.view(), try_times
 
 # add 'l_num' to limit the number of search
-def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, dataset_configuration, l_num):
-    all_id, all_gen, all_gen_num = symbolic_generation(X, seeds, protected_attribs, constraint, model, limit=len(seeds), conf=dataset_configuration, l_num=l_num)
-    all_id_nondup = np.array(list(set([tuple(id) for id in all_id])))
-    all_gen_nondup = np.array(list(set([tuple(gen) for gen in all_gen])))
-    return all_id_nondup, all_gen_nondup, all_gen_num
\ No newline at end of file
+def individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, dataset_configuration, l_num, solver_backend='z3', surrogates=None, batch_size=1):
+    all_id, all_gen, all_gen_num = symbolic_generation(X, seeds, protected_attribs, constraint, model, limit=len(seeds), conf=dataset_configuration, l_num=l_num, solver_backend=solver_backend, surrogates=surrogates, batch_size=batch_size)
+    all_id_nondup = generation_utilities.DedupSet(len(X[0]), constraint)
+    all_id_nondup.extend(all_id)
+    all_gen_nondup = generation_utilities.DedupSet(len(X[0]), constraint)
+    all_gen_nondup.extend(all_gen)
+    return all_id_nondup.view(), all_gen_nondup.view(), all_gen_num
+
+def generation_stream(X, seeds, protected_attribs, constraint, model, dataset_configuration, l_num, yield_all=False, solver_backend='z3', surrogates=None, batch_size=1):
+    """
+    Lazy variant of individual_discrimination_generation
+    :return: a generator yielding every new individual discriminatory instance as soon as it is found,
+             or (instance, is_disc) for every instance tested if yield_all is True
+    """
+    ids = generation_utilities.DedupSet(len(X[0]), constraint, keep_rows=False)
+    for temp, found, _ in symbolic_search(X, seeds, protected_attribs, constraint, model, limit=len(seeds), conf=dataset_configuration, l_num=l_num, solver_backend=solver_backend, surrogates=surrogates, batch_size=batch_size):
+        is_new = found and ids.append(temp)
+        if yield_all:
+            yield np.array(temp), found
+        elif is_new:
+            yield np.array(temp)
@@ -0,0 +1,260 @@
+"""
+This python file provides an asyncio driver running the searches of many seeds concurrently, one coroutine per seed.
+A central batcher coalesces the forward and gradient requests pending across all the coroutines into one model call of each kind,
+so a latency-bound model (a remote scorer, a GPU behind a queue) answers every seed in one round trip instead of one per seed.
+The coroutines run the same search steps as the sequential methods, only their model requests are answered by the batcher.
+"""
+
+
+import asyncio
+import numpy as np
+import generation_utilities
+import parallel_generation
+import ADF
+import AEQUITAS
+import EIDIG
+import MAFT
+
+
+class Batcher:
+    # central batcher of the forward and gradient requests of the coroutines
+    # the first pending request schedules a flush max_delay seconds later, with max_delay=0 the flush runs as soon as every
+    # coroutine ready to run has issued its next request, so each flush gathers all the seeds waiting on the model
+    # every request is answered with its own rows of the batched outputs, failures such as QueryBudgetExceeded are raised in every coroutine
+    # the model calls run one at a time in the default executor of the loop, so the coroutines keep running while the model works
+
+    def __init__(self, model, compute_grad_batch=None, max_delay=0.0):
+        self.model = model
+        self.compute_grad_batch = compute_grad_batch
+        self.max_delay = max_delay
+        self.pending = {'forward': [], 'gradient': []}
+        self.flush_scheduled = False
+        self.dispatching = asyncio.Lock()
+        # flush tasks alive, referenced until they are done
+        self.flushes = set()
+        self.num_flushes = 0
+        self.num_requests = 0
+        self.num_model_calls = 0
+
+    def predict(self, X):
+        # awaitable outputs of a batch of instances
+
+        return self.submit('forward', X)
+
+    def gradient(self, X):
+        # awaitable gradients of a batch of instances
+
+        return self.submit('gradient', X)
+
+    async def pair_selection(self, x, similar_x):
+        # coroutine counterpart of generation_utilities.pair_selection
+
+        y_pred = await self.predict(np.vstack(([x], similar_x)))
+        return generation_utilities.select_pair(x, similar_x, y_pred)
+
+    async def is_discriminatory(self, x, similar_x):
+        # coroutine counterpart of generation_utilities.is_discriminatory
+
+        y_pred = await self.predict(np.vstack(([x], similar_x)))
+        return generation_utilities.discriminatory_outputs(y_pred)
+
+    def submit(self, kind, X):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[kind].append((np.asarray(X), future))
+        self.num_requests += 1
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            if self.max_delay > 0:
+                loop.call_later(self.max_delay, self.start_flush)
+            else:
+                loop.call_soon(self.start_flush)
+        return future
+
+    def start_flush(self):
+        self.flushes.add(asyncio.get_running_loop().create_task(self.flush()))
+
+    async def flush(self):
+        # dispatch every pending request, one model call per kind
+        # the requests submitted while the model works wait for the next flush
+
+        loop = asyncio.get_running_loop()
+        self.flush_scheduled = False
+        self.num_flushes += 1
+        pending = self.pending
+        self.pending = {'forward': [], 'gradient': []}
+        try:
+            async with self.dispatching:
+                for kind, dispatch in (('forward', self._forward), ('gradient', self._gradient)):
+                    await self.dispatch(loop, dispatch, pending[kind])
+        finally:
+            self.flushes.discard(asyncio.current_task())
+
+    async def dispatch(self, loop, dispatch, requests):
+        if len(requests) == 0:
+            return
+        self.num_model_calls += 1
+        try:
+            outputs = await loop.run_in_executor(None, dispatch, np.vstack([X for X, _ in requests]))
+        except Exception as e:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for X, future in requests:
+            if not future.done():
+                future.set_result(outputs[start:start+len(X)])
+            start += len(X)
+
+    def _forward(self, X):
+        return generation_utilities.predict(self.model, X)
+
+    def _gradient(self, X):
+        return self.compute_grad_batch(X, self.model)
+
+    def stats(self):
+        # counters of the batcher since it was created, requests per model call shows how well the requests are coalesced
+
+        return {'flushes': self.num_flushes, 'requests': self.num_requests, 'model_calls': self.num_model_calls,
+                'requests_per_call': self.num_requests / self.num_model_calls if self.num_model_calls > 0 else 0.0}
+
+
+class ConcurrentSearch:
+    # searches of the seeds of one run, which share the batcher and the instances found
+    # every seed draws from its own random stream, so what it generates does not depend on how the coroutines interleave
+
+    def __init__(self, batcher, num_attribs, protected_attribs, constraint):
+        self.batcher = batcher
+        self.num_attribs = num_attribs
+        self.protected_attribs = protected_attribs
+        self.constraint = constraint
+        self.ids = generation_utilities.DedupSet(num_attribs, constraint)
+        self.gen = generation_utilities.DedupSet(num_attribs, constraint)
+        self.try_times = 0
+
+    def similar_set(self, x):
+        return generation_utilities.similar_set(x, self.num_attribs, self.protected_attribs, self.constraint)
+
+    async def serve(self, steps, record=None):
+        # drive a generator of search steps as generation_utilities.serve does, with the requests answered by the batcher
+        # record(x, is_disc) is called on every instance the steps report, return the return value of the steps
+
+        answer = None
+        while True:
+            try:
+                request = steps.send(answer)
+            except StopIteration as stop:
+                return stop.value
+            answer = None
+            if request[0] == 'pair':
+                answer = await self.batcher.pair_selection(request[1], request[2])
+            elif request[0] == 'disc':
+                answer = await self.batcher.is_discriminatory(request[1], request[2])
+            elif request[0] == 'gradient':
+                answer = await self.batcher.gradient(request[1])
+            else:
+                record(request[1], request[2])
+
+    def record(self, x, is_disc):
+        self.try_times += 1
+        self.gen.append(x)
+        if is_disc:
+            self.ids.append(x)
+
+    async def gradient_search(self, engine, seed, max_iter, s_g, l_num, s_l, rng):
+        # global and local generation of EIDIG, MAFT or ADF on one seed, the steps of SearchEngine.global_walk and local_walk
+
+        x1, is_disc, path, num_checks = await self.serve(engine.global_steps(seed.copy(), self.num_attribs, self.protected_attribs,
+                                                                             self.constraint, max_iter, s_g))
+        self.try_times += num_checks
+        self.gen.extend(path)
+        if not is_disc:
+            return
+        self.ids.append(x1)
+        await self.serve(engine.local_steps(x1, self.num_attribs, l_num, self.protected_attribs, self.constraint, s_l, rng), self.record)
+
+    async def aequitas_search(self, initial_input, l_num, s_l, rng, probabilities):
+        # global and local generation of AEQUITAS on one random candidate, the steps of AEQUITAS.local_walk for the local one
+        # the direction and feature probabilities are learnt by all the coroutines together, as they are across seeds in AEQUITAS
+
+        x0 = AEQUITAS.random_candidate(initial_input, self.num_attribs, self.constraint, rng)
+        self.try_times += 1
+        is_discriminatory = await self.batcher.is_discriminatory(x0, self.similar_set(x0))
+        self.gen.append(x0)
+        if not is_discriminatory:
+            return
+        self.ids.append(x0)
+
+        def record(x, is_disc):
+            # a failed step leaves the walk back at x0, as in AEQUITAS.local_generation
+            self.record(x if is_disc else x0, is_disc)
+
+        await self.serve(AEQUITAS.local_steps(x0, l_num, self.num_attribs, self.protected_attribs, self.constraint, s_l,
+                                              probabilities, rng), record)
+
+    async def run(self, searches, concurrency=None):
+        # run the searches with at most concurrency of them alive at once, a search stopped by the query budget keeps what it found
+
+        semaphore = asyncio.Semaphore(concurrency if concurrency is not None else max(1, len(searches)))
+
+        async def guarded(search):
+            async with semaphore:
+                try:
+                    await search
+                except generation_utilities.QueryBudgetExceeded:
+                    pass
+
+        await asyncio.gather(*[guarded(search) for search in searches])
+
+
+def engine(method, p):
+    # search engine of a gradient-based method with the hyper-parameters of p
+
+    if method == 'EIDIG':
+        return EIDIG.engine(p['decay'], p['update_interval'], p['epsilon_l'])
+    elif method == 'MAFT':
+        return MAFT.engine(p['decay'], p['update_interval'], p['epsilon_l'], p['perturbation_size'], p['scheme'], p['num_directions'])
+    elif method == 'ADF':
+        return ADF.engine(p['epsilon_l'])
+    else:
+        raise ValueError("Invalid method")
+
+
+async def generation(method, X, seeds, protected_attribs, constraint, model, params={}, max_delay=0.0, concurrency=None):
+    # coroutine of individual_discrimination_generation, for callers already running an event loop
+    # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated, total number of
+    # search iterations and the batcher
+
+    p = dict(parallel_generation.default_params, **params)
+    num_attribs = len(X[0])
+    # one random stream per seed, drawn from the global one in seed order
+    rngs = [np.random.RandomState(seed) for seed in np.random.randint(0, 2**31 - 1, size=len(seeds))]
+    if method == 'AEQUITAS':
+        batcher = Batcher(model, max_delay=max_delay)
+        search = ConcurrentSearch(batcher, num_attribs, protected_attribs, constraint)
+        initial_input = p['initial_input'] if p['initial_input'] is not None else np.zeros_like(X[0])
+        probabilities = {'direction': [0.5] * num_attribs, 'direction_change_size': 0.001,
+                         'param': np.array([1.0 / num_attribs] * num_attribs), 'param_change_size': 0.001}
+        searches = [search.aequitas_search(initial_input, p['l_num'], p['s_l'], rng, probabilities) for rng in rngs]
+    else:
+        method_engine = engine(method, p)
+        batcher = Batcher(model, method_engine.gradient.compute_grad_batch, max_delay)
+        search = ConcurrentSearch(batcher, num_attribs, protected_attribs, constraint)
+        searches = [search.gradient_search(method_engine, np.array(seed, dtype=float), p['max_iter'], p['s_g'], p['l_num'],
+                                           p['s_l'], rng)
+                    for seed, rng in zip(seeds, rngs)]
+    await search.run(searches, concurrency)
+    return search.ids.view(), search.gen.view(), search.try_times, batcher
+
+
+def individual_discrimination_generation(method, X, seeds, protected_attribs, constraint, model, params={}, max_delay=0.0,
+                                         concurrency=None):
+    # run the searches of all the seeds of EIDIG, MAFT, ADF or AEQUITAS concurrently on their own event loop
+    # params holds the hyper-parameters as in parallel_generation.default_params
+    # set max_delay to let the batcher wait for more requests, and concurrency to bound the number of seeds searched at once
+    # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated and total number of search iterations
+
+    ids, gen, try_times, _ = asyncio.run(generation(method, X, seeds, protected_attribs, constraint, model, params, max_delay,
+                                                    concurrency))
+    return ids, gen, try_times
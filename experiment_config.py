@@ -4,8 +4,9 @@ This file contains the configuration of the experiments.
 """
 
 from tensorflow import keras
-from preprocessing import pre_census_income, pre_german_credit, pre_bank_marketing, pre_meps_15, pre_heart_heath, pre_diabetes, pre_students
+from preprocessing import preprocess_utilities
 from collections import OrderedDict
+from collections.abc import Mapping
 from enum import Enum
 
 class AllMethod(Enum):
@@ -25,38 +26,101 @@ class BlackboxMethod(Enum):
     SG = 1
     MAFT = 2
 
-# load models
-adult_model = keras.models.load_model("models/original_models/adult_model.h5")
-german_model = keras.models.load_model("models/original_models/german_model.h5")
-bank_model = keras.models.load_model("models/original_models/bank_model.h5")
-meps15_model = keras.models.load_model("models/original_models/meps15_model.h5")
-heart_model = keras.models.load_model("models/original_models/heart_model.h5")
-diabetes_model = keras.models.load_model("models/original_models/diabetes_model.h5")
-students_model = keras.models.load_model("models/original_models/students_model.h5")
-all_models = [adult_model, german_model, bank_model, meps15_model, heart_model, diabetes_model, students_model]
-
-all_benchmark_info = OrderedDict({
-    'C-a': (adult_model, pre_census_income, [0]),
-    'C-r': (adult_model, pre_census_income, [6]),
-    'C-g': (adult_model, pre_census_income, [7]),
-    'G-g': (german_model, pre_german_credit, [6]),
-    'G-a': (german_model, pre_german_credit, [9]),
-    'B-a': (bank_model, pre_bank_marketing, [0]),
-    'M-a': (meps15_model, pre_meps_15, [0]),
-    'M-r': (meps15_model, pre_meps_15, [1]),
-    'M-g': (meps15_model, pre_meps_15, [9]),
-    'H-a': (heart_model, pre_heart_heath, [0]),
-    'H-g': (heart_model, pre_heart_heath, [1]),
-    'D-a': (diabetes_model, pre_diabetes, [7]),
-    'S-a': (students_model, pre_students, [2]),
-    'S-g': (students_model, pre_students, [1]),
-    # 'C-a&r': (adult_model, pre_census_income, [0, 6]),
-    # 'C-a&g': (adult_model, pre_census_income, [0, 7]),
-    # 'C-r&g': (adult_model, pre_census_income, [6, 7]),
-    # 'G-g&a': (german_model, pre_german_credit, [6, 9]),
-    # 'M-a&r': (meps15_model, pre_meps_15, [0, 1]),
-    # 'M-a&g': (meps15_model, pre_meps_15, [0, 9]),
-    # 'M-r&g': (meps15_model, pre_meps_15, [1, 9]),
-    # 'H-a&g': (heart_model, pre_heart_heath, [0, 1]),
-    # 'S-a&g': (students_model, pre_students, [2, 1]),
-})
\ No newline at end of file
+# models and datasets are loaded on first access, so that running some benchmarks never touches the others
+all_model_paths = OrderedDict({
+    'adult': "models/original_models/adult_model.h5",
+    'german': "models/original_models/german_model.h5",
+    'bank': "models/original_models/bank_model.h5",
+    'meps15': "models/original_models/meps15_model.h5",
+    'heart': "models/original_models/heart_model.h5",
+    'diabetes': "models/original_models/diabetes_model.h5",
+    'students': "models/original_models/students_model.h5",
+})
+loaded_models = OrderedDict()
+loaded_datasets = OrderedDict()
+
+def get_model(name):
+    # the model of a dataset, loaded once on first access
+    if name not in loaded_models:
+        loaded_models[name] = keras.models.load_model(all_model_paths[name])
+    return loaded_models[name]
+
+def get_dataset(name):
+    # the preprocessed dataset of a preprocessing module, read from the on-disk cache once it has been preprocessed
+    if name not in loaded_datasets:
+        loaded_datasets[name] = preprocess_utilities.load_dataset(name)
+    return loaded_datasets[name]
+
+def get_model_path(model):
+    # path of the file a loaded model comes from, worker processes load their own copy from it
+    for name, loaded_model in loaded_models.items():
+        if loaded_model is model:
+            return all_model_paths[name]
+    raise ValueError("Unknown model")
+
+def __getattr__(attr):
+    # adult_model, german_model, ... and all_models of the eager configuration, loaded on first access
+    if attr == 'all_models':
+        return [get_model(name) for name in all_model_paths]
+    if attr.endswith('_model') and attr[:-len('_model')] in all_model_paths:
+        return get_model(attr[:-len('_model')])
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, attr))
+
+class BenchmarkRegistry(Mapping):
+    # benchmarks by name, info[benchmark] loads the model and the dataset of the benchmark on first access
+    # and returns (model, dataset, protected_attribs) as the eager configuration did
+
+    def __init__(self, specs):
+        # specs maps every benchmark name to (model name, preprocessing module name, protected_attribs)
+        self.specs = OrderedDict(specs)
+
+    def __getitem__(self, benchmark):
+        model_name, dataset_name, protected_attribs = self.specs[benchmark]
+        return get_model(model_name), get_dataset(dataset_name), protected_attribs
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+    def select(self, benchmarks=None):
+        # registry restricted to the given benchmarks in the given order, e.g. parsed from a --benchmarks option
+        if benchmarks is None:
+            return self
+        unknown = [benchmark for benchmark in benchmarks if benchmark not in self.specs]
+        if unknown:
+            raise ValueError("Unknown benchmarks {}, choose among {}".format(unknown, list(self.specs)))
+        return BenchmarkRegistry((benchmark, self.specs[benchmark]) for benchmark in benchmarks)
+
+def parse_benchmarks(option):
+    # benchmark names of a comma-separated --benchmarks option, None to keep them all
+    if option is None or option == '':
+        return None
+    return [benchmark.strip() for benchmark in option.split(',') if benchmark.strip() != '']
+
+all_benchmark_info = BenchmarkRegistry({
+    'C-a': ('adult', 'pre_census_income', [0]),
+    'C-r': ('adult', 'pre_census_income', [6]),
+    'C-g': ('adult', 'pre_census_income', [7]),
+    'G-g': ('german', 'pre_german_credit', [6]),
+    'G-a': ('german', 'pre_german_credit', [9]),
+    'B-a': ('bank', 'pre_bank_marketing', [0]),
+    'M-a': ('meps15', 'pre_meps_15', [0]),
+    'M-r': ('meps15', 'pre_meps_15', [1]),
+    'M-g': ('meps15', 'pre_meps_15', [9]),
+    'H-a': ('heart', 'pre_heart_heath', [0]),
+    'H-g': ('heart', 'pre_heart_heath', [1]),
+    'D-a': ('diabetes', 'pre_diabetes', [7]),
+    'S-a': ('students', 'pre_students', [2]),
+    'S-g': ('students', 'pre_students', [1]),
+    # 'C-a&r': ('adult', 'pre_census_income', [0, 6]),
+    # 'C-a&g': ('adult', 'pre_census_income', [0, 7]),
+    # 'C-r&g': ('adult', 'pre_census_income', [6, 7]),
+    # 'G-g&a': ('german', 'pre_german_credit', [6, 9]),
+    # 'M-a&r': ('meps15', 'pre_meps_15', [0, 1]),
+    # 'M-a&g': ('meps15', 'pre_meps_15', [0, 9]),
+    # 'M-r&g': ('meps15', 'pre_meps_15', [1, 9]),
+    # 'H-a&g': ('heart', 'pre_heart_heath', [0, 1]),
+    # 'S-a&g': ('students', 'pre_students', [2, 1]),
+})
@@ -4,6 +4,7 @@ This python file provides experimental functions backing up the claims involving
 
 
 import os
+import itertools
 
 import tensorflow as tf
 import numpy as np
@@ -15,7 +16,10 @@ import MAFT
 import AEQUITAS
 import SG
 import Gradient
-from experiment_config import Method, BlackboxMethod, AllMethod
+import prediction_cache
+import query_meter
+import parallel_generation
+from experiment_config import Method, BlackboxMethod, AllMethod, get_model_path
 
 # allocate GPU and set dynamic memory growth
 os.environ['CUDA_VISIBLE_DEVICES'] = '0'
@@ -166,8 +170,12 @@ def gradient_comparison_local_probability(benchmark, X, protected_attribs, const
 
 def hyper_comparison(round_id, benchmark, X, protected_attribs, constraint, model, perturbation_size_list, initial_input=None, dataset_configuration = {},
                      g_num=100, l_num=100, decay=0.5, c_num=4, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6,
-                     fashion='RoundRobin'):
+                     fashion='RoundRobin', scheme_list=None):
     # compare different perturbation_size in terms of effectiveness and efficiency of MAFT
+    # every perturbation_size is run with each (scheme, num_directions) gradient estimator of scheme_list, forward differences by default
+
+    if scheme_list is None:
+        scheme_list = [('forward', None)]
 
     iter = '{}x{}'.format(g_num, l_num)
     dir = 'logging_data/hyper_comparison/hyper_comparison_instances/' + iter + '/'
@@ -175,7 +183,7 @@ def hyper_comparison(round_id, benchmark, X, protected_attribs, constraint, mode
         os.makedirs(dir)
 
     base_methods_nums = len(AllMethod) - 1
-    tot_methods_num = base_methods_nums + len(perturbation_size_list)
+    tot_methods_num = base_methods_nums + len(perturbation_size_list) * len(scheme_list)
     num_ids = np.zeros(shape=(tot_methods_num))
     num_all_ids = np.zeros_like(num_ids)
     time_costs = np.zeros_like(num_ids)
@@ -192,7 +200,7 @@ def hyper_comparison(round_id, benchmark, X, protected_attribs, constraint, mode
             new_seed = generation_utilities.get_seed(clustered_data, len(X), c_num, i % c_num, fashion=fashion)
             seeds = np.append(seeds, [new_seed], axis=0)
 
-    def run_algorithm(method, perturbation_size=None):
+    def run_algorithm(method, perturbation_size=None, scheme='forward', num_directions=None):
         t1 = time.time()
         if method == AllMethod.AEQUITAS:
             ids, gen, total_iter = AEQUITAS.individual_discrimination_generation(X, seeds, protected_attribs, constraint,
@@ -213,16 +221,19 @@ def hyper_comparison(round_id, benchmark, X, protected_attribs, constraint, mode
             ids, gen, total_iter = MAFT.individual_discrimination_generation(X, seeds, protected_attribs,
                                                                              constraint, model, decay, l_num, 5,
                                                                              max_iter, s_g, s_l, epsilon_l,
-                                                                             perturbation_size)
+                                                                             perturbation_size, scheme=scheme,
+                                                                             num_directions=num_directions)
         else:
             raise ValueError("Invalid method")
 
-        np.save(dir + benchmark + '_ids_' + method.name + '_' + str(perturbation_size) + '_' + 'round' + str(round_now) + '.npy', ids)
+        # the default forward differences keep the original names
+        name = method.name if scheme == 'forward' else '{}_{}{}'.format(method.name, scheme, num_directions)
+        np.save(dir + benchmark + '_ids_' + name + '_' + str(perturbation_size) + '_' + 'round' + str(round_now) + '.npy', ids)
         t2 = time.time()
         time_cost = t2 - t1
         if method == AllMethod.MAFT:
             print('{}-{}: unique dis ins:{}, unique tot ins:{}, total iters:{}, time cost:{}, speed:{} ins/s, success rate:{}.'
-              .format(method.name, perturbation_size, len(ids), len(gen), total_iter, time_cost, len(ids)/time_cost, len(ids)/total_iter))
+              .format(name, perturbation_size, len(ids), len(gen), total_iter, time_cost, len(ids)/time_cost, len(ids)/total_iter))
         else:
             print('{}: unique dis ins:{}, unique tot ins:{}, total iters:{}, time cost:{}, speed:{} ins/s, success rate:{}.'
                 .format(method.name, len(ids), len(gen), total_iter, time_cost, len(ids) / time_cost,
@@ -231,8 +242,8 @@ def hyper_comparison(round_id, benchmark, X, protected_attribs, constraint, mode
 
     for method in AllMethod:
         if(method == AllMethod.MAFT):
-            for idx, perturbation_size_list in enumerate(perturbation_size_list):
-                ids, gen, total_iter, time_cost = run_algorithm(method, perturbation_size_list)
+            for idx, (perturbation_size, (scheme, num_directions)) in enumerate(itertools.product(perturbation_size_list, scheme_list)):
+                ids, gen, total_iter, time_cost = run_algorithm(method, perturbation_size, scheme, num_directions)
                 num_ids[method.value+idx] = len(ids)
                 num_all_ids[method.value+idx] = len(gen)
                 total_iters[method.value+idx] = total_iter
@@ -248,7 +259,7 @@ def hyper_comparison(round_id, benchmark, X, protected_attribs, constraint, mode
     return num_ids, num_all_ids, total_iters, time_costs
 
 # compare MAFT with white-box methods (ADF and EIDIG) in terms of effectiveness and efficiency
-def comparison(round_id, benchmark, X, protected_attribs, constraint, model, g_num=1000, l_num=1000, perturbation_size=1e-4, decay=0.5, c_num=4, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, fashion='RoundRobin'):
+def comparison(round_id, benchmark, X, protected_attribs, constraint, model, g_num=1000, l_num=1000, perturbation_size=1e-4, decay=0.5, c_num=4, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, fashion='RoundRobin', cache_size=0, n_jobs=1):
 
     iter = '{}x{}_H_{}'.format(g_num, l_num, perturbation_size)
     # store invividual discrimination instances
@@ -273,20 +284,31 @@ def comparison(round_id, benchmark, X, protected_attribs, constraint, model, g_n
             new_seed = generation_utilities.get_seed(clustered_data, len(X), c_num, j%c_num, fashion=fashion)
             seeds = np.append(seeds, [new_seed], axis=0)
 
+    # shard the seeds across n_jobs worker processes, each loading its own copy of the model
+    pool = parallel_generation.SeedShardPool(get_model_path(model), n_jobs) if n_jobs > 1 else None
+    params = {'l_num': l_num, 'decay': decay, 'update_interval': 5, 'max_iter': max_iter, 's_g': s_g, 's_l': s_l,
+              'epsilon_l': epsilon_l, 'perturbation_size': perturbation_size}
+
     def run_algorithm(method):
         t1 = time.time()
-
-        if method == Method.ADF:
+        # an optional prediction cache, private to each method so that time costs stay comparable
+        method_model = prediction_cache.PredictionCache(model, constraint, cache_size) if cache_size > 0 else model
+
+        if pool is not None:
+            ids, gen, total_iter = pool.individual_discrimination_generation(method.name, X, seeds, protected_attribs,
+                                                                             constraint, params, round_now,
+                                                                             cache_size=cache_size)
+        elif method == Method.ADF:
             ids, gen, total_iter = ADF.individual_discrimination_generation(X, seeds, protected_attribs, constraint,
-                                                                            model, l_num, max_iter, s_g, s_l,
+                                                                            method_model, l_num, max_iter, s_g, s_l,
                                                                             epsilon_l)
         elif method == Method.EIDIG:
             ids, gen, total_iter = EIDIG.individual_discrimination_generation(X, seeds, protected_attribs,
-                                                                              constraint, model, decay, l_num, 5,
+                                                                              constraint, method_model, decay, l_num, 5,
                                                                               max_iter, s_g, s_l, epsilon_l)
         elif method == Method.MAFT:
             ids, gen, total_iter = MAFT.individual_discrimination_generation(X, seeds, protected_attribs,
-                                                                             constraint, model, decay, l_num, 5,
+                                                                             constraint, method_model, decay, l_num, 5,
                                                                              max_iter, s_g, s_l, epsilon_l,
                                                                              perturbation_size)
         else:
@@ -299,6 +321,12 @@ def comparison(round_id, benchmark, X, protected_attribs, constraint, model, g_n
             '{}: unique dis ins:{}, unique tot ins:{}, total iters:{}, time cost:{}, speed:{} ins/s, success rate:{}.'
             .format(method.name, len(ids), len(gen), total_iter, time_cost, len(ids) / time_cost,
                     len(ids) / total_iter))
+        if pool is not None:
+            for shard_id, stats in enumerate(pool.shard_stats):
+                if 'cache' in stats:
+                    print('{}: prediction cache of shard {} {}'.format(method.name, shard_id, stats['cache']))
+        elif cache_size > 0:
+            print('{}: prediction cache {}'.format(method.name, method_model.stats()))
         return ids, gen, total_iter, time_cost
 
     for method in Method:
@@ -307,12 +335,17 @@ def comparison(round_id, benchmark, X, protected_attribs, constraint, model, g_n
         num_all_ids[method.value] = len(gen)
         total_iters[method.value] = total_iter
         time_costs[method.value] = time_cost
+    if pool is not None:
+        pool.close()
     print('\n')
     return num_ids, num_all_ids, total_iters, time_costs
 
 # parameter 'initial_input' for AEQUITAS and parameter 'dataset_configuration' for SG
 # compare MAFT with black-box methods (AEQUITAS and SG) in terms of effectiveness and efficiency
-def comparison_blackbox(round_id, benchmark, X, protected_attribs, constraint, model, g_num=1000, l_num=1000, perturbation_size=1e-4, initial_input=None, dataset_configuration = {}, decay=0.5, c_num=4, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, fashion='RoundRobin'):
+def comparison_blackbox(round_id, benchmark, X, protected_attribs, constraint, model, g_num=1000, l_num=1000, perturbation_size=1e-4, initial_input=None, dataset_configuration = {}, decay=0.5, c_num=4, max_iter=10, s_g=1.0, s_l=1.0, epsilon_l=1e-6, fashion='RoundRobin', cache_size=0, n_jobs=1, count_queries=False, query_budget=None, tree_cache_size=0):
+    # set count_queries=True to meter the queries every method makes to the model and report the instances found per 1k queries
+    # with a query_budget, every method stops once it has fed that many instances to the model
+    # with a tree_cache_size, SG reuses its interpretable trees across nearby instances and reports how often it did
 
     iter = '{}x{}_H_{}'.format(g_num, l_num, perturbation_size)
     # store invividual discrimination instances
@@ -338,20 +371,40 @@ def comparison_blackbox(round_id, benchmark, X, protected_attribs, constraint, m
             new_seed = generation_utilities.get_seed(clustered_data, len(X), c_num, j%c_num, fashion=fashion)
             seeds = np.append(seeds, [new_seed], axis=0)
 
+    # shard the seeds across n_jobs worker processes, each loading its own copy of the model
+    pool = parallel_generation.SeedShardPool(get_model_path(model), n_jobs) if n_jobs > 1 else None
+    params = {'l_num': l_num, 'decay': decay, 'update_interval': 5, 'max_iter': max_iter, 's_g': s_g, 's_l': s_l,
+              'epsilon_l': epsilon_l, 'perturbation_size': perturbation_size,
+              'initial_input': initial_input, 'dataset_configuration': dataset_configuration, 'tree_cache_size': tree_cache_size}
+
     def run_algorithm(method):
         t1 = time.time()
-
-        if method == BlackboxMethod.AEQUITAS:
+        # an optional prediction cache, private to each method so that time costs stay comparable
+        # the meter sits under the cache, so that only the queries reaching the model are counted
+        # with worker processes every shard meters its own model with a share of the budget, merged once the shards are done
+        meter = query_meter.QueryMeter(model, query_budget) if (count_queries or query_budget is not None) and pool is None else None
+        method_model = meter if meter is not None else model
+        method_model = prediction_cache.PredictionCache(method_model, constraint, cache_size) if cache_size > 0 else method_model
+
+        if pool is not None:
+            ids, gen, total_iter = pool.individual_discrimination_generation(method.name, X, seeds, protected_attribs,
+                                                                             constraint, params, round_now,
+                                                                             cache_size=cache_size, query_budget=query_budget,
+                                                                             count_queries=count_queries)
+            meter = pool.merged_meter(query_budget)
+        elif method == BlackboxMethod.AEQUITAS:
             ids, gen, total_iter = AEQUITAS.individual_discrimination_generation(X, seeds, protected_attribs, constraint,
-                                                                            model, l_num, max_iter, s_g, s_l,
+                                                                            method_model, l_num, max_iter, s_g, s_l,
                                                                             epsilon_l, initial_input)
         elif method == BlackboxMethod.MAFT:
             ids, gen, total_iter = MAFT.individual_discrimination_generation(X, seeds, protected_attribs,
-                                                                             constraint, model, decay, l_num, 5,
+                                                                             constraint, method_model, decay, l_num, 5,
                                                                              max_iter, s_g, s_l, epsilon_l,
                                                                              perturbation_size)
         elif method == BlackboxMethod.SG:
-            ids, gen, total_iter = SG.individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, dataset_configuration, l_num)
+            surrogates = SG.SurrogateCache(X, method_model, dataset_configuration, tree_cache_size) if tree_cache_size > 0 else None
+            ids, gen, total_iter = SG.individual_discrimination_generation(X, seeds, protected_attribs, constraint, method_model, dataset_configuration, l_num,
+                                                                           surrogates=surrogates)
         else:
             raise ValueError("Invalid method")
 
@@ -362,6 +415,21 @@ def comparison_blackbox(round_id, benchmark, X, protected_attribs, constraint, m
             '{}: unique dis ins:{}, unique tot ins:{}, total iters:{}, time cost:{}, speed:{} ins/s, success rate:{}.'
             .format(method.name, len(ids), len(gen), total_iter, time_cost, len(ids) / time_cost,
                     len(ids) / total_iter))
+        if pool is not None:
+            for shard_id, stats in enumerate(pool.shard_stats):
+                if 'cache' in stats:
+                    print('{}: prediction cache of shard {} {}'.format(method.name, shard_id, stats['cache']))
+                if 'surrogate_trees' in stats:
+                    print('{}: surrogate trees of shard {} {}'.format(method.name, shard_id, stats['surrogate_trees']))
+        elif cache_size > 0:
+            print('{}: prediction cache {}'.format(method.name, method_model.stats()))
+        if method == BlackboxMethod.SG and tree_cache_size > 0 and pool is None:
+            print('{}: surrogate trees {}'.format(method.name, surrogates.stats()))
+        if meter is not None:
+            print('{}: model queries:{}, ids per 1k queries:{}, budget exhausted:{}.'
+                  .format(method.name, meter.num_queries, meter.ids_per_kquery(len(ids)), meter.exhausted))
+            for site, counters in meter.sites.items():
+                print('    {}: {}'.format(site, counters))
         return ids, gen, total_iter, time_cost
 
     for method in BlackboxMethod:
@@ -370,5 +438,7 @@ def comparison_blackbox(round_id, benchmark, X, protected_attribs, constraint, m
         num_all_ids[method.value] = len(gen)
         total_iters[method.value] = total_iter
         time_costs[method.value] = time_cost
+    if pool is not None:
+        pool.close()
     print('\n')
     return num_ids, num_all_ids, total_iters, time_costs
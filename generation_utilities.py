@@ -9,6 +9,7 @@ from tensorflow import keras
 from sklearn import cluster
 import itertools
 import time
+import gradient_kernels
 
 
 def clustering(data, c_num):
@@ -25,10 +26,10 @@ def clip(instance, constraint):
     return np.minimum(constraint[:, 1], np.maximum(constraint[:, 0], instance))
 
 
-def random_pick(probability):
+def random_pick(probability, rng=np.random):
     # randomly pick an element from a probability distribution
 
-    random_number = np.random.rand()
+    random_number = rng.rand()
     current_proba = 0
     for i in range(len(probability)):
         current_proba += probability[i]
@@ -50,56 +51,350 @@ def get_seed(clustered_data, X_len, c_num, cluster_i, fashion='RoundRobin'):
         return x[index]
 
 
+def domain_dtype(constraint):
+    # the smallest signed integer type that holds every value allowed by the constraint
+
+    constraint = np.asarray(constraint)
+    return np.result_type(np.int8, np.min_scalar_type(int(constraint.min())), np.min_scalar_type(int(constraint.max())))
+
+
+class RowBuffer:
+    # growable buffer of instances whose capacity doubles when full, so appending a row costs amortized O(1)
+    # it replaces the accumulation with np.append, which copies the whole array on every call
+    # an integer buffer is promoted to float the first time a row holds a value it cannot represent exactly, e.g. after a
+    # non-integral step, so that rows are never truncated
+
+    def __init__(self, num_attribs, dtype=float, capacity=64):
+        self.data = np.empty((capacity, num_attribs), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        # make room for at least capacity rows
+
+        if capacity > len(self.data):
+            data = np.empty((max(capacity, 2 * len(self.data)), self.data.shape[1]), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def promote(self, rows):
+        # switch the storage to float if the rows do not fit the integer dtype
+
+        if self.data.dtype.kind in 'iu' and not np.array_equal(rows, np.asarray(rows).astype(self.data.dtype)):
+            self.data = self.data.astype(float)
+
+    def append(self, row):
+        self.promote(row)
+        self.reserve(self.size + 1)
+        self.data[self.size] = row
+        self.size += 1
+
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return
+        self.promote(rows)
+        self.reserve(self.size + len(rows))
+        self.data[self.size:self.size+len(rows)] = rows
+        self.size += len(rows)
+
+    def view(self):
+        # zero-copy view of the rows appended so far
+
+        return self.data[:self.size]
+
+
+class InstanceEncoder:
+    # pack integer instances that satisfy the constraint into single keys with a mixed-radix encoding
+    # the keys are 64-bit integers whenever the input space is small enough, and raw bytes otherwise
+
+    def __init__(self, constraint):
+        constraint = np.asarray(constraint)
+        self.lower = constraint[:, 0].astype(np.int64)
+        self.upper = constraint[:, 1].astype(np.int64)
+        radix = [int(r) for r in self.upper - self.lower + 1]
+        space_size = 1
+        place = []
+        for r in reversed(radix):
+            place.insert(0, space_size)
+            space_size *= r
+        self.fits_int64 = space_size <= np.iinfo(np.int64).max
+        self.place = np.array(place, dtype=np.int64) if self.fits_int64 else None
+
+    def valid(self, X):
+        # mask of the rows that are integral and lie within the constraint, only those rows can be encoded
+
+        X = np.asarray(X)
+        return np.all((X == np.round(X)) & (X >= self.lower) & (X <= self.upper), axis=1)
+
+    def encode(self, X):
+        # keys of a batch of valid rows, as a list of python ints or bytes
+
+        offsets = np.asarray(X).astype(np.int64) - self.lower
+        if self.fits_int64:
+            return (offsets @ self.place).tolist()
+        return [row.tobytes() for row in offsets]
+
+
+class DedupSet:
+    # incremental set of unique instances keyed by their packed encoding, with O(1) insert and membership test
+    # the unique rows are kept in insertion order, so the live unique count and the rows are available at any moment
+    # it exposes the same append/extend/view interface as RowBuffer
+    # set keep_rows=False to keep only the keys, e.g. when the instances are streamed to the caller instead
+
+    def __init__(self, num_attribs, constraint, keep_rows=True):
+        self.encoder = InstanceEncoder(constraint)
+        self.keys = set()
+        self.rows = RowBuffer(num_attribs, domain_dtype(constraint)) if keep_rows else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, row):
+        return self.encode([row])[0] in self.keys
+
+    def encode(self, X):
+        # keys of a batch of rows, rows that cannot be packed fall back to tuples of their values
+
+        X = np.asarray(X)
+        valid = self.encoder.valid(X)
+        if np.all(valid):
+            return self.encoder.encode(X)
+        keys = [tuple(x) for x in X.tolist()]
+        for i, key in zip(np.flatnonzero(valid), self.encoder.encode(X[valid])):
+            keys[i] = key
+        return keys
+
+    def append(self, row):
+        # insert one instance and return whether it was new
+
+        key = self.encode([row])[0]
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        if self.rows is not None:
+            self.rows.append(row)
+        return True
+
+    def extend(self, rows):
+        # insert a batch of instances and return the number of new ones
+
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return 0
+        new = []
+        for i, key in enumerate(self.encode(rows)):
+            if key not in self.keys:
+                self.keys.add(key)
+                new.append(i)
+        if self.rows is not None:
+            self.rows.extend(rows[new])
+        return len(new)
+
+    def view(self):
+        # zero-copy view of the unique instances
+
+        return self.rows.view()
+
+
+class SimilarSetBuilder:
+    # build similar sets from the Cartesian product of the protected domains, which is computed only once
+    # the product is cached as an int array with one row per combination of protected values
+
+    def __init__(self, num_attribs, protected_attribs, constraint):
+        self.num_attribs = num_attribs
+        self.protected_attribs = list(protected_attribs)
+        protected_domain = [np.arange(constraint[i][0], constraint[i][1]+1) for i in self.protected_attribs]
+        # meshgrid with 'ij' indexing enumerates the combinations in the same order as itertools.product
+        all_combs = np.meshgrid(*protected_domain, indexing='ij')
+        self.all_combs = np.stack([comb.reshape(-1) for comb in all_combs], axis=1).astype(int)
+
+    def __len__(self):
+        return len(self.all_combs)
+
+    def __call__(self, x):
+        # similar set of a single instance, shape (|protected domain|, num_attribs)
+
+        return self.batch(np.asarray(x)[np.newaxis])[0]
+
+    def batch(self, X):
+        # similar sets of a batch of instances, shape (N, |protected domain|, num_attribs)
+
+        X = np.asarray(X)
+        similar_X = np.empty((len(X), len(self.all_combs), self.num_attribs), dtype=np.result_type(X, self.all_combs))
+        similar_X[:] = X[:, np.newaxis, :]
+        similar_X[:, :, self.protected_attribs] = self.all_combs
+        return similar_X
+
+
+_similar_set_builders = {}
+
+
+def get_similar_set_builder(num_attribs, protected_attribs, constraint):
+    # return the builder shared by all calls with the same (constraint, protected_attribs)
+
+    key = (num_attribs, tuple(protected_attribs), np.asarray(constraint).tobytes())
+    if key not in _similar_set_builders:
+        _similar_set_builders[key] = SimilarSetBuilder(num_attribs, protected_attribs, constraint)
+    return _similar_set_builders[key]
+
+
 def similar_set(x, num_attribs, protected_attribs, constraint):
     # find all similar inputs corresponding to different combinations of protected attributes with non-protected attributes unchanged
 
-    similar_x = np.empty(shape=(0, num_attribs))
-    protected_domain = []
-    for i in protected_attribs:
-        protected_domain = protected_domain + [list(range(constraint[i][0], constraint[i][1]+1))]
-    all_combs = np.array(list(itertools.product(*protected_domain)))
-    for comb in all_combs:
-        x_new = x.copy()
-        for a, c in zip(protected_attribs, comb):
-            x_new[a] = c
-        similar_x = np.append(similar_x, [x_new], axis=0)
-    return similar_x
+    builder = get_similar_set_builder(num_attribs, protected_attribs, constraint)
+    return builder(x).astype(float, copy=False)
+
+
+def similar_set_batch(X, num_attribs, protected_attribs, constraint):
+    # find the similar sets of a batch of inputs at once, the result has shape (N, |protected domain|, num_attribs)
+
+    builder = get_similar_set_builder(num_attribs, protected_attribs, constraint)
+    return builder.batch(X)
+
+
+class QueryBudgetExceeded(Exception):
+    # raised by a metered model such as query_meter.QueryMeter once its query budget is spent
+    # the generation methods catch it and stop with the instances found so far
+
+    pass
+
+
+def predict(model, X):
+    # feed a batch of instances to the model in a single forward pass and return the flattened outputs
+    # wrappers such as PredictionCache answer through their own predict_outputs method
+
+    if hasattr(model, 'predict_outputs'):
+        return model.predict_outputs(X)
+    if gradient_kernels.is_compilable(model):
+        return gradient_kernels.forward(X, model).reshape(-1)
+    return np.asarray(model(tf.constant(X, dtype=tf.float32))).reshape(-1)
 
 
 def is_discriminatory(x, similar_x, model):
     # identify whether the instance is discriminatory w.r.t. the model
-    y_pred = (model(tf.constant([x])) > 0.5)
-    for x_new in similar_x:
-        if (model(tf.constant([x_new])) > 0.5) != y_pred:
-            return True
-    return False
+
+    return discriminatory_outputs(predict(model, np.vstack(([x], similar_x))))
+
+
+def discriminatory_outputs(y_pred):
+    # check of is_discriminatory given the outputs on the instance followed by its similar set
+
+    y_pred = np.asarray(y_pred) > 0.5
+    return bool(np.any(y_pred[1:] != y_pred[0]))
+
+
+def predict_similar_sets(X, num_attribs, protected_attribs, constraint, model, max_rows=65536):
+    # score a population together with the similar sets of its instances in as few forward passes as max_rows allows
+    # return the similar sets with shape (N, |protected domain|, num_attribs) and the outputs with shape (N, 1 + |protected domain|),
+    # where column 0 holds the output on the instance itself
+
+    X = np.asarray(X)
+    similar_X = similar_set_batch(X, num_attribs, protected_attribs, constraint)
+    num_similar = similar_X.shape[1]
+    rows = np.concatenate((X[:, np.newaxis, :], similar_X), axis=1).reshape(-1, num_attribs)
+    chunk = max(1, max_rows // (num_similar + 1)) * (num_similar + 1)
+    y_pred = np.concatenate([predict(model, rows[i:i+chunk]) for i in range(0, len(rows), chunk)] or [np.empty(0)])
+    return similar_X, y_pred.reshape(len(X), num_similar + 1)
+
+
+def is_discriminatory_batch(X, num_attribs, protected_attribs, constraint, model, max_rows=65536):
+    # identify which instances of a population are discriminatory w.r.t. the model
+    # return a boolean vector and the maximum output gap between each instance and its similar instances
+
+    _, y_pred = predict_similar_sets(X, num_attribs, protected_attribs, constraint, model, max_rows)
+    is_disc = np.any((y_pred[:, 1:] > 0.5) != (y_pred[:, :1] > 0.5), axis=1)
+    max_gap = np.max(np.abs(y_pred[:, 1:] - y_pred[:, :1]), axis=1)
+    return is_disc, max_gap
+
+
+def pair_selection(x, similar_x, model):
+    # score the instance and its similar set in a single forward pass and select partners from the same predictions
+    # return whether the instance is discriminatory, the similar instance with maximally different output
+    # and all similar instances whose predicted label differs from the instance
+
+    return select_pair(x, similar_x, predict(model, np.vstack(([x], similar_x))))
+
+
+def select_pair(x, similar_x, y_pred):
+    # selection of pair_selection given the outputs on the instance followed by its similar set
+
+    distance = np.square(y_pred[1:] - y_pred[0])
+    flipped = (y_pred[1:] > 0.5) != (y_pred[0] > 0.5)
+    if len(distance) > 0 and np.max(distance) > 0.0:
+        x_potential_pair = similar_x[np.argmax(distance)].copy()
+    else:
+        x_potential_pair = np.array(x, copy=True)
+    return bool(np.any(flipped)), x_potential_pair, similar_x[flipped]
+
+
+def pair_selection_batch(X, num_attribs, protected_attribs, constraint, model, max_rows=65536):
+    # batched counterpart of pair_selection for a population of instances
+    # return the discrimination flags, the max-diff partners, the similar sets and a mask of their flipped instances
+
+    X = np.asarray(X)
+    similar_X, y_pred = predict_similar_sets(X, num_attribs, protected_attribs, constraint, model, max_rows)
+    distance = np.square(y_pred[:, 1:] - y_pred[:, :1])
+    flipped = (y_pred[:, 1:] > 0.5) != (y_pred[:, :1] > 0.5)
+    x_potential_pairs = np.array(X, dtype=np.result_type(X, similar_X), copy=True)
+    has_pair = np.max(distance, axis=1) > 0.0
+    x_potential_pairs[has_pair] = similar_X[has_pair, np.argmax(distance, axis=1)[has_pair]]
+    return np.any(flipped, axis=1), x_potential_pairs, similar_X, flipped
 
 
 def max_diff(x, similar_x, model):
     # select a similar instance such that the DNN outputs on them are maximally different
 
-    y_pred_proba = model(tf.constant([x]))
-    def distance(x_new):
-        return np.sum(np.square(y_pred_proba - model(tf.constant([x_new]))))
-    max_dist = 0.0
-    x_potential_pair = x.copy()
-    for x_new in similar_x:
-        if distance(x_new) > max_dist:
-            max_dist = distance(x_new)
-            x_potential_pair = x_new.copy()
-    return x_potential_pair
+    return pair_selection(x, similar_x, model)[1]
+
+
+def pick_pair(pairs, rng=np.random):
+    # randomly pick a discriminatory pair among the flipped similar instances returned by pair_selection
+
+    selected_p = random_pick([1.0 / pairs.shape[0]] * pairs.shape[0], rng)
+    return pairs[selected_p]
 
 
 def find_pair(x, similar_x, model):
     # find a discriminatory pair given an individual discriminatory instance
 
-    pairs = np.empty(shape=(0, len(x)))
-    y_pred = (model(tf.constant([x])) > 0.5)
-    for x_pair in similar_x:
-        if (model(tf.constant([x_pair])) > 0.5) != y_pred:
-            pairs = np.append(pairs, [x_pair], axis=0)
-    selected_p = random_pick([1.0 / pairs.shape[0]] * pairs.shape[0])
-    return pairs[selected_p]
+    return pick_pair(pair_selection(x, similar_x, model)[2])
+
+
+def serve(steps, model, compute_grad_batch=None):
+    # drive a generator of search steps with the model, so that the same steps can be driven by other means (see async_generation)
+    # the steps query the model by yielding ('pair', x, similar_x), ('disc', x, similar_x) or ('gradient', X) and are sent back
+    # the result of pair_selection, is_discriminatory or compute_grad_batch, and report instances by yielding ('instance', x, is_disc)
+    # yield (x, is_disc) for every instance reported and return the return value of the steps
+
+    answer = None
+    while True:
+        try:
+            request = steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
+        answer = None
+        if request[0] == 'pair':
+            answer = pair_selection(request[1], request[2], model)
+        elif request[0] == 'disc':
+            answer = is_discriminatory(request[1], request[2], model)
+        elif request[0] == 'gradient':
+            answer = compute_grad_batch(request[1], model)
+        else:
+            yield request[1], request[2]
+
+
+def run_steps(steps, model, compute_grad_batch=None):
+    # drive a generator of search steps that reports no instances to its end and return its return value
+
+    stream = serve(steps, model, compute_grad_batch)
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
 
 
 def normalization(grad1, grad2, protected_attribs, epsilon):
@@ -118,14 +413,66 @@ def normalization(grad1, grad2, protected_attribs, epsilon):
     return probability
     
 
+def normalization_batch(grad1, grad2, protected_attribs, epsilon):
+    # gradient normalization for a batch of local searches, one probability distribution per row
+
+    gradient = 1.0 / (np.abs(grad1) + np.abs(grad2) + epsilon)
+    gradient[:, protected_attribs] = 0.0
+    return gradient / np.sum(gradient, axis=1, keepdims=True)
+
+
+def random_pick_batch(probability):
+    # randomly pick an element from each row of a batch of probability distributions
+
+    random_number = np.random.rand(len(probability))
+    picked = np.sum(np.cumsum(probability, axis=1) <= random_number[:, np.newaxis], axis=1)
+    return np.minimum(picked, probability.shape[1] - 1)
+
+
+def pick_pairs_batch(similar_X, flipped):
+    # randomly pick one flipped similar instance per row, each flipped instance being equally likely
+
+    num_flipped = np.sum(flipped, axis=1)
+    target = np.minimum((np.random.rand(len(flipped)) * num_flipped).astype(int), num_flipped - 1)
+    picked = np.argmax(np.cumsum(flipped, axis=1) > target[:, np.newaxis], axis=1)
+    return similar_X[np.arange(len(similar_X)), picked]
+
+
+def take_ids(stream, num_attribs, max_ids=None, time_budget=None):
+    # collect the instances yielded by a generation stream until max_ids instances are collected or time_budget seconds have passed
+    # the stream is closed afterwards, so the search stops right after the last instance collected
+
+    ids = RowBuffer(num_attribs)
+    t1 = time.time()
+    for x in stream:
+        ids.append(x)
+        if (max_ids is not None and len(ids) >= max_ids) or (time_budget is not None and time.time() - t1 >= time_budget):
+            break
+    stream.close()
+    return ids.view()
+
+
+def record_time(stream, record_step, record_frequency):
+    # record the time consumed by a generation stream to find every record_step unique individual discriminatory instances
+    # the search stops once record_frequency records are taken
+
+    t = np.array([0.0] * record_frequency)
+    t1 = time.time()
+    for num_ids, _ in enumerate(stream, 1):
+        if num_ids % record_step == 0:
+            t[num_ids // record_step - 1] = time.time() - t1
+            if num_ids >= record_frequency * record_step:
+                break
+    stream.close()
+    return t
+
+
 def purely_random(num_attribs, protected_attribs, constraint, model, gen_num):
     # generate instances in a purely random fashion
     
-    gen_id = np.empty(shape=(0, num_attribs))
+    x_picked = np.empty(shape=(gen_num, num_attribs))
     for i in range(gen_num):
-        x_picked = [0] * num_attribs
         for a in range(num_attribs):
-            x_picked[a] = np.random.randint(constraint[a][0], constraint[a][1]+1)
-        if is_discriminatory(x_picked, similar_set(x_picked, num_attribs, protected_attribs, constraint), model):
-            gen_id = np.append(gen_id, [x_picked], axis=0)
-    return gen_id
\ No newline at end of file
+            x_picked[i][a] = np.random.randint(constraint[a][0], constraint[a][1]+1)
+    is_disc, _ = is_discriminatory_batch(x_picked, num_attribs, protected_attribs, constraint, model)
+    return x_picked[is_disc]
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+This python file provides compiled gradient kernels for EIDIG and ADF, and the compiled forward pass MAFT scores its finite differences with.
+Kernels are compiled with tf.function once per loaded model and reused by every gradient computation on that model.
+"""
+
+
+import weakref
+import tensorflow as tf
+from tensorflow import keras
+
+
+class GradientKernels:
+    # tf.function-compiled kernels bound to one model
+    # the input_signature leaves the batch size open, so each kernel is traced only once whatever the batch size is
+    # every gradient kernel returns the sign-corrected gradients and the predictions computed in the same trace
+
+    def __init__(self, model):
+        self.model = model
+        input_shape = getattr(model, 'input_shape', None)
+        num_attribs = input_shape[-1] if isinstance(input_shape, tuple) and isinstance(input_shape[-1], int) else None
+        batch_spec = tf.TensorSpec(shape=[None, num_attribs], dtype=tf.float32)
+        self.forward = tf.function(self._forward, input_signature=[batch_spec])
+        self.eidig = tf.function(self._eidig, input_signature=[batch_spec])
+        self.adf = tf.function(self._adf, input_signature=[batch_spec])
+
+    def _forward(self, X):
+        # predictions on a batch of instances
+
+        return self.model(X)
+
+    def _eidig(self, X):
+        # gradient(y/x), with the sign flipped for instances predicted as negative
+
+        with tf.GradientTape() as tape:
+            tape.watch(X)
+            y_pred = self.model(X)
+        gradient = tape.gradient(y_pred, X)
+        return tf.where(y_pred > 0.5, gradient, -gradient), y_pred
+
+    def _adf(self, X):
+        # gradient(loss/x) w.r.t. the labels predicted by the model
+
+        with tf.GradientTape() as tape:
+            tape.watch(X)
+            y_pred = self.model(X)
+            loss = keras.losses.binary_crossentropy(tf.cast(y_pred > 0.5, dtype=tf.float32), y_pred)
+        gradient = tape.gradient(loss, X)
+        return gradient, y_pred
+
+
+_kernels = weakref.WeakKeyDictionary()
+
+
+def is_compilable(model):
+    # only Keras models can be traced into the compiled kernels, other callables have to be queried as black boxes
+
+    return isinstance(model, keras.Model)
+
+
+def unwrap(model):
+    # strip prediction wrappers such as PredictionCache to reach the underlying model, gradients are always taken on it
+
+    while not is_compilable(model) and hasattr(model, 'model'):
+        model = model.model
+    return model
+
+
+def get_kernels(model):
+    # return the kernels of the model, building them on first use
+
+    model = unwrap(model)
+    if not is_compilable(model):
+        raise TypeError('{} can only be queried as a black box, gradients have to be estimated by MAFT'.format(type(model).__name__))
+    if model not in _kernels:
+        _kernels[model] = GradientKernels(model)
+    return _kernels[model]
+
+
+def eidig_gradients(X, model):
+    # sign-corrected gradient(y/x) of a batch of instances
+
+    gradient, _ = get_kernels(model).eidig(tf.constant(X, dtype=tf.float32))
+    return gradient.numpy()
+
+
+def adf_gradients(X, model):
+    # gradient(loss/x) of a batch of instances
+
+    gradient, _ = get_kernels(model).adf(tf.constant(X, dtype=tf.float32))
+    return gradient.numpy()
+
+
+def forward(X, model):
+    # compiled forward pass of a batch of instances
+
+    return get_kernels(model).forward(tf.constant(X, dtype=tf.float32)).numpy()
@@ -0,0 +1,215 @@
+"""
+This python file provides model adapters that every generation method can call like a Keras model.
+KerasModel serves an in-process Keras model and RemoteModel a model behind an HTTP scoring endpoint,
+such as the stand-in served by scoring_server.py or a TensorFlow Serving REST endpoint.
+"""
+
+
+import abc
+import json
+import queue
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+import generation_utilities
+
+
+class ModelAdapter(abc.ABC):
+    # common interface of the adapters, subclasses implement predict_outputs
+    # generation_utilities.predict dispatches to predict_outputs, and calling the adapter returns outputs shaped like a Keras model's
+
+    def __call__(self, X):
+        return tf.constant(self.predict_outputs(np.asarray(X)).reshape(-1, 1))
+
+    @abc.abstractmethod
+    def predict_outputs(self, X):
+        # the flattened outputs of a batch of instances, safe to call from several threads at once
+        pass
+
+
+class KerasModel(ModelAdapter):
+    # in-process Keras model, safe to share between threads
+    # the model stays reachable through the model attribute, so white-box gradients are still taken on it
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def predict_outputs(self, X):
+        with self.lock:
+            return generation_utilities.predict(self.model, np.asarray(X))
+
+
+class _Request:
+    # rows of one caller waiting for their outputs
+
+    def __init__(self, X):
+        self.X = X
+        self.done = threading.Event()
+        self.outputs = None
+        self.error = None
+
+
+class RemoteModel(ModelAdapter):
+    # client of an HTTP scoring endpoint speaking the TensorFlow Serving REST protocol,
+    # POST {"instances": [[...], ...]} answered with {"predictions": [[...], ...]}
+    # concurrent calls are coalesced into micro-batches: while other callers are inside predict_outputs, the batcher thread
+    # waits up to max_delay seconds after the first pending call for them to join it, up to max_batch_rows rows, and sends
+    # them as one request, so a lone caller is never delayed
+    # requests are sent by pool_size sender threads, each keeping its own persistent connection
+    # a single call larger than max_batch_rows is sent alone rather than split
+
+    def __init__(self, url, max_batch_rows=4096, max_delay=0.002, pool_size=4, timeout=60.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError("Invalid url")
+        self.url = url
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.path = parts.path + ('?' + parts.query if parts.query else '')
+        self.max_batch_rows = max_batch_rows
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.connections = queue.LifoQueue()
+        self.pending = queue.Queue()
+        self.senders = ThreadPoolExecutor(max_workers=pool_size)
+        self.lock = threading.Lock()
+        self.num_callers = 0
+        self.num_calls = 0
+        self.num_batches = 0
+        self.num_rows = 0
+        self.closed = False
+        self.batcher = threading.Thread(target=self._batch_loop, daemon=True)
+        self.batcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # the calls already pending are still answered, later ones raise RuntimeError
+
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.pending.put(None)
+        self.batcher.join()
+        self.senders.shutdown()
+        while not self.connections.empty():
+            self.connections.get().close()
+
+    def predict_outputs(self, X):
+        # block until the outputs of the rows are back from the endpoint
+
+        request = _Request(np.asarray(X, dtype=float).reshape(len(X), -1))
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('RemoteModel of {} is used after close()'.format(self.url))
+            if len(request.X) == 0:
+                return np.empty(0, dtype=np.float32)
+            self.num_callers += 1
+            self.pending.put(request)
+        request.done.wait()
+        with self.lock:
+            self.num_callers -= 1
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def _batch_loop(self):
+        # coalesce the pending calls into micro-batches until close() is called
+
+        while True:
+            request = self.pending.get()
+            if request is None:
+                return
+            batch = [request]
+            num_rows = len(request.X)
+            while num_rows < self.max_batch_rows and len(batch) < self.num_callers:
+                try:
+                    request = self.pending.get(timeout=self.max_delay)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.senders.submit(self._send, batch)
+                    return
+                if num_rows + len(request.X) > self.max_batch_rows:
+                    # the request opens the next batch
+                    self.senders.submit(self._send, batch)
+                    batch = [request]
+                    num_rows = len(request.X)
+                    continue
+                batch.append(request)
+                num_rows += len(request.X)
+            self.senders.submit(self._send, batch)
+
+    def _send(self, batch):
+        # score one micro-batch and hand every caller its own outputs
+
+        try:
+            outputs = self.score(np.vstack([request.X for request in batch]))
+            with self.lock:
+                self.num_batches += 1
+                self.num_calls += len(batch)
+                self.num_rows += len(outputs)
+            start = 0
+            for request in batch:
+                request.outputs = outputs[start:start + len(request.X)]
+                start += len(request.X)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
+
+    def score(self, X):
+        # one round trip to the endpoint on a pooled connection, a connection broken by the server is retried once afresh
+        # the retry always opens a new connection, since the other pooled ones may have been dropped by the server too
+
+        # the body is sent as bytes, which http.client writes together with the headers to avoid delayed acknowledgements
+        body = json.dumps({'instances': X.tolist()}).encode()
+        for attempt in range(2):
+            connection = None
+            if attempt == 0:
+                try:
+                    connection = self.connections.get_nowait()
+                except queue.Empty:
+                    pass
+            if connection is None:
+                connection = self.connection_class(self.host, timeout=self.timeout)
+            try:
+                connection.request('POST', self.path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                payload = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if attempt == 1:
+                    raise
+                continue
+            if response.status != 200:
+                connection.close()
+                raise RuntimeError('scoring endpoint {} answered {}: {}'.format(self.url, response.status, payload[:200]))
+            self.connections.put(connection)
+            return np.asarray(json.loads(payload)['predictions'], dtype=np.float32).reshape(-1)
+
+    def stats(self):
+        # counters of the client since it was created, calls per batch shows how well the calls are coalesced
+
+        return {'calls': self.num_calls, 'batches': self.num_batches, 'rows': self.num_rows,
+                'calls_per_batch': self.num_calls / self.num_batches if self.num_batches > 0 else 0.0}
+
+
+def load_model(spec):
+    # load a model from a .h5 path or connect to it from an http(s) URL
+    # a Keras model is returned as it is, so that the generation methods keep using its compiled kernels
+
+    if spec.startswith('http://') or spec.startswith('https://'):
+        return RemoteModel(spec)
+    return keras.models.load_model(spec)
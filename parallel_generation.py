@@ -0,0 +1,204 @@
+"""
+This python file provides a multi-process driver running individual_discrimination_generation of any method on shards of seeds.
+Each worker process loads the model once and carries its own deterministic random stream derived from the round seed.
+The dataset, seeds and constraint are written once per pool into shared memory-mapped arrays that the workers attach read-only.
+"""
+
+
+import os
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import tensorflow as tf
+import generation_utilities
+import prediction_cache
+import query_meter
+import model_adapters
+import shared_arrays
+import ADF
+import EIDIG
+import MAFT
+import AEQUITAS
+import SG
+
+
+# hyper-parameters shared by all the methods, each method only reads the ones it uses
+default_params = {'l_num': 1000, 'decay': 0.5, 'update_interval': 5, 'max_iter': 10, 's_g': 1.0, 's_l': 1.0,
+                  'epsilon_l': 1e-6, 'perturbation_size': 1e-4, 'scheme': 'forward', 'num_directions': None,
+                  'initial_input': None, 'dataset_configuration': {}, 'solver_backend': 'z3',
+                  'tree_cache_size': 0, 'batch_size': 1}
+
+
+def run_method(method, X, seeds, protected_attribs, constraint, model, params, stats=None):
+    # common interface of individual_discrimination_generation for AEQUITAS, SG, ADF, EIDIG and MAFT
+    # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated and total number of search iterations
+    # stats, if given, receives the counters of the surrogate trees SG reused under 'surrogate_trees'
+
+    p = dict(default_params, **params)
+    if method == 'AEQUITAS':
+        return AEQUITAS.individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, p['l_num'],
+                                                             p['max_iter'], p['s_g'], p['s_l'], p['epsilon_l'], p['initial_input'])
+    elif method == 'SG':
+        surrogates = SG.SurrogateCache(X, model, p['dataset_configuration'], p['tree_cache_size']) if p['tree_cache_size'] > 0 else None
+        result = SG.individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, p['dataset_configuration'], p['l_num'],
+                                                       p['solver_backend'], surrogates, p['batch_size'])
+        if stats is not None and surrogates is not None:
+            stats['surrogate_trees'] = surrogates.stats()
+        return result
+    elif method == 'ADF':
+        return ADF.individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, p['l_num'],
+                                                        p['max_iter'], p['s_g'], p['s_l'], p['epsilon_l'])
+    elif method == 'EIDIG':
+        return EIDIG.individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, p['decay'], p['l_num'],
+                                                          p['update_interval'], p['max_iter'], p['s_g'], p['s_l'], p['epsilon_l'])
+    elif method == 'MAFT':
+        return MAFT.individual_discrimination_generation(X, seeds, protected_attribs, constraint, model, p['decay'], p['l_num'],
+                                                         p['update_interval'], p['max_iter'], p['s_g'], p['s_l'], p['epsilon_l'],
+                                                         p['perturbation_size'], scheme=p['scheme'], num_directions=p['num_directions'])
+    else:
+        raise ValueError("Invalid method")
+
+
+def shard_seed(round_seed, shard_id):
+    # deterministic seed of one shard, independent of which worker process happens to run it
+
+    return int(np.random.SeedSequence([round_seed, shard_id]).generate_state(1)[0])
+
+
+def budget_shares(budget, sizes):
+    # split a query budget across shards in proportion to their numbers of seeds, the shares sum to the budget
+    # the queries left over by the rounding go to the first shards, like the seeds left over by the split
+
+    if budget is None:
+        return [None] * len(sizes)
+    shares = np.asarray(sizes) * budget // int(np.sum(sizes))
+    shares[:budget - int(np.sum(shares))] += 1
+    return [int(share) for share in shares]
+
+
+# the model loaded by the current worker process
+_worker_model = None
+
+
+def _init_worker(model_path, num_threads):
+    # load the model once per worker process and keep the workers from oversubscribing the cores
+    # model_path may also be the URL of a scoring endpoint, then every worker keeps its own client
+
+    global _worker_model
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(num_threads)
+    except RuntimeError:
+        # the runtime was already initialized while importing the main module
+        pass
+    _worker_model = model_adapters.load_model(model_path)
+
+
+def _run_shard(method, round_seed, shard_id, X, seeds, bounds, protected_attribs, constraint, params, cache_size,
+               query_budget=None, count_queries=False):
+    # run one method on the seeds between bounds with the random stream of the shard
+    # X, seeds and constraint may be shared_arrays.ArrayHandle, the shard is then a view of the shared seeds rather than a copy
+    # return the result of the method and the counters of the shard's meter, prediction cache and surrogate trees
+    # the meter sits under the cache as in the single-process runs, and stops the shard once it has spent query_budget
+
+    X = shared_arrays.resolve(X)
+    seeds = shared_arrays.resolve(seeds)[bounds[0]:bounds[1]]
+    constraint = shared_arrays.resolve(constraint)
+    seed = shard_seed(round_seed, shard_id)
+    np.random.seed(seed)
+    random.seed(seed)
+    tf.random.set_seed(seed)
+    meter = query_meter.QueryMeter(_worker_model, query_budget) if count_queries or query_budget is not None else None
+    model = meter if meter is not None else _worker_model
+    model = prediction_cache.PredictionCache(model, constraint, cache_size) if cache_size > 0 else model
+    stats = {}
+    result = run_method(method, X, seeds, protected_attribs, constraint, model, params, stats)
+    if meter is not None:
+        stats['queries'] = meter.stats()
+    if cache_size > 0:
+        stats['cache'] = model.stats()
+    return result, stats
+
+
+class SeedShardPool:
+    # pool of worker processes sharing one model, reusable for every method run on the same benchmark
+    # workers are spawned rather than forked since TensorFlow is not fork-safe
+    # the arrays given to the pool are shared with the workers through memory-mapped files, set share_arrays=False to
+    # pickle them to every shard instead
+
+    def __init__(self, model_path, n_jobs=None, share_arrays=True):
+        self.n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        # counters of every shard of the last run, in shard order
+        self.shard_stats = []
+        self.store = shared_arrays.SharedArrayStore() if share_arrays else None
+        num_threads = max(1, (os.cpu_count() or 1) // self.n_jobs)
+        self.executor = ProcessPoolExecutor(max_workers=self.n_jobs, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(model_path, num_threads))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        if self.store is not None:
+            self.store.close()
+
+    def share(self, array):
+        # handle of an array for the workers, the same array object is only written once per pool
+
+        return self.store.share(array) if self.store is not None else array
+
+    def individual_discrimination_generation(self, method, X, seeds, protected_attribs, constraint, params, round_seed=0,
+                                             num_shards=None, cache_size=0, query_budget=None, count_queries=False):
+        # split the seeds into contiguous shards, run them on the workers and merge the results of all shards
+        # the merged instances are deduplicated in shard order and the search iterations of all shards are summed
+        # results are deterministic for a given round_seed and number of shards
+        # set count_queries=True to meter the queries of every shard, a query_budget is split across the shards in proportion
+        # to their seeds, and the counters of the shards are left in shard_stats, see merged_meter
+
+        num_shards = max(1, min(num_shards if num_shards is not None else self.n_jobs, len(seeds)))
+        # contiguous shards of the same sizes as np.array_split
+        sizes = np.full(num_shards, len(seeds) // num_shards)
+        sizes[:len(seeds) % num_shards] += 1
+        ends = np.cumsum(sizes)
+        budgets = budget_shares(query_budget, sizes)
+        X_shared, seeds_shared, constraint_shared = self.share(X), self.share(seeds), self.share(constraint)
+        futures = [self.executor.submit(_run_shard, method, round_seed, shard_id, X_shared, seeds_shared,
+                                        (int(end - size), int(end)), protected_attribs, constraint_shared, params, cache_size,
+                                        budget, count_queries)
+                   for shard_id, (size, end, budget) in enumerate(zip(sizes, ends, budgets))]
+        num_attribs = len(X[0])
+        all_id_nondup = generation_utilities.DedupSet(num_attribs, constraint)
+        all_gen_nondup = generation_utilities.DedupSet(num_attribs, constraint)
+        total_iter = 0
+        self.shard_stats = []
+        for future in futures:
+            (ids, gen, try_times), stats = future.result()
+            all_id_nondup.extend(ids)
+            all_gen_nondup.extend(gen)
+            total_iter += try_times
+            self.shard_stats.append(stats)
+        return all_id_nondup.view(), all_gen_nondup.view(), total_iter
+
+    def merged_meter(self, query_budget=None):
+        # a QueryMeter holding the queries of all the shards of the last run, None if they were not metered
+
+        if not any('queries' in stats for stats in self.shard_stats):
+            return None
+        meter = query_meter.QueryMeter(None, query_budget)
+        for stats in self.shard_stats:
+            meter.merge(stats['queries'])
+        return meter
+
+
+def individual_discrimination_generation(method, X, seeds, protected_attribs, constraint, model_path, params, n_jobs=None,
+                                         round_seed=0, cache_size=0, query_budget=None):
+    # one-off run of a method on a fresh pool, prefer SeedShardPool to run several methods on the same model
+
+    with SeedShardPool(model_path, n_jobs) as pool:
+        return pool.individual_discrimination_generation(method, X, seeds, protected_attribs, constraint, params,
+                                                         round_seed, cache_size=cache_size, query_budget=query_budget)
@@ -0,0 +1,68 @@
+"""
+This python file provides an opt-in cache of model predictions keyed by discrete instances.
+Wrap a model with PredictionCache and pass the wrapper to any generation method in place of the model.
+"""
+
+
+from collections import OrderedDict
+import numpy as np
+import tensorflow as tf
+import generation_utilities
+
+
+class PredictionCache:
+    # least-recently-used cache in front of a model, it can be called like the model itself
+    # rows that are not integral or fall outside the constraint (e.g. finite-difference probes) bypass the cache
+
+    def __init__(self, model, constraint, capacity=1 << 20):
+        self.model = model
+        self.encoder = generation_utilities.InstanceEncoder(constraint)
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def __call__(self, X):
+        return tf.constant(self.predict_outputs(np.asarray(X)).reshape(-1, 1))
+
+    def predict_outputs(self, X):
+        # flattened outputs of a batch of instances, querying the model only for the rows not cached yet
+
+        X = np.asarray(X)
+        outputs = np.empty(len(X), dtype=np.float32)
+        valid = self.encoder.valid(X)
+        pending = OrderedDict()
+        for i, key in zip(np.flatnonzero(valid), self.encoder.encode(X[valid])):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                outputs[i] = self.entries[key]
+                self.hits += 1
+            else:
+                pending.setdefault(key, []).append(i)
+                self.misses += 1
+        bypassed = np.flatnonzero(~valid)
+        self.bypasses += len(bypassed)
+        # each missing key is queried once even if it occurs several times in the batch
+        queried = np.concatenate((bypassed, [rows[0] for rows in pending.values()])).astype(int)
+        if len(queried) > 0:
+            outputs_queried = generation_utilities.predict(self.model, X[queried])
+            outputs[bypassed] = outputs_queried[:len(bypassed)]
+            for (key, rows), output in zip(pending.items(), outputs_queried[len(bypassed):]):
+                outputs[rows] = output
+                self.entries[key] = output
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return outputs
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        # counters of the cache since it was created
+
+        return {'hits': self.hits, 'misses': self.misses, 'bypasses': self.bypasses, 'evictions': self.evictions,
+                'size': len(self.entries), 'hit_rate': self.hit_rate()}
@@ -20,8 +20,10 @@ import preprocess_utilities
 """
 
 # make outputs stable across runs
+# tf_seed is kept by the dataset cache, which sets it again when the cached dataset is loaded
+tf_seed = 42
 np.random.seed(42)
-tf.random.set_seed(42)
+tf.random.set_seed(tf_seed)
 
 
 def set_table(vocab):
@@ -1,3 +1,9 @@
+import os
+import json
+import types
+import hashlib
+import importlib
+import importlib.util
 import numpy as np
 
 # generate initial input for AEQUITAS
@@ -13,4 +19,109 @@ def generate_instance(constraints):
              for the corresponding attribute within the specified constraints.
     """
     np.random.seed(0)  # 设置随机种子以保证结果的可复现性
-    return np.array([np.random.randint(low, high + 1) for low, high in constraints])
\ No newline at end of file
+    return np.array([np.random.randint(low, high + 1) for low, high in constraints])
+
+# on-disk cache of the preprocessed datasets
+# bump CACHE_VERSION whenever the layout of the cached files changes
+CACHE_VERSION = 2
+package_dir = os.path.dirname(os.path.abspath(__file__))
+datasets_dir = os.path.join(os.path.dirname(package_dir), 'datasets')
+cache_dir = os.environ.get('DATASET_CACHE_DIR', os.path.join(datasets_dir, 'cache'))
+# the arrays a preprocessing module publishes, the modules that keep no validation split have no X_val and y_val
+published_arrays = ['X', 'y', 'X_train', 'X_val', 'X_test', 'y_train', 'y_val', 'y_test', 'constraint', 'initial_input']
+
+
+def raw_data_paths(name):
+    """
+    Locate the raw data files a preprocessing module reads.
+
+    :param name: name of the preprocessing module, e.g. 'pre_german_credit'.
+    :return: a list of file paths, which may not exist.
+    """
+    if name == 'pre_meps_15':
+        # MEPS is read by aif360 from its own data directory
+        spec = importlib.util.find_spec('aif360')
+        if spec is None or not spec.submodule_search_locations:
+            return []
+        return [os.path.join(spec.submodule_search_locations[0], 'data', 'raw', 'meps', 'h181.csv')]
+    files = {
+        'pre_census_income': ['adult.csv'],
+        'pre_german_credit': ['proc_german_num_02 withheader-2.csv'],
+        'pre_bank_marketing': ['bank-full.csv'],
+        'pre_diabetes': ['diabetes'],
+        'pre_heart_heath': ['heart_disease'],
+        'pre_students': ['students'],
+    }
+    return [os.path.join(datasets_dir, file) for file in files.get(name, [])]
+
+
+def cache_key(name):
+    """
+    Hash the raw data and the code of a preprocessing module, so that the cache is invalidated whenever either changes.
+
+    :param name: name of the preprocessing module.
+    :return: a hex digest, or None if a raw data file is missing.
+    """
+    digest = hashlib.sha256('v{}'.format(CACHE_VERSION).encode())
+    for path in [os.path.join(package_dir, name + '.py'), os.path.abspath(__file__)] + raw_data_paths(name):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def cache_path(name, key):
+    return os.path.join(cache_dir, '{}-{}.npz'.format(name, key))
+
+
+def save_dataset(name, dataset):
+    """
+    Publish the arrays, protected attributes and configurations of a preprocessed dataset into the cache.
+
+    :param name: name of the preprocessing module.
+    :param dataset: the imported preprocessing module or any object with the same attributes.
+    """
+    key = cache_key(name)
+    if key is None:
+        return
+    arrays = {attr: np.asarray(getattr(dataset, attr)) for attr in published_arrays if hasattr(dataset, attr)}
+    arrays['protected_attribs'] = np.asarray(dataset.protected_attribs)
+    arrays['configurations'] = np.array(json.dumps(dataset.configurations))
+    # the TensorFlow seed the module sets, None for the modules that set none
+    arrays['tf_seed'] = np.array(json.dumps(getattr(dataset, 'tf_seed', None)))
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, so that concurrent processes never read a partial cache file
+    temp_path = cache_path(name, key) + '.{}.tmp'.format(os.getpid())
+    with open(temp_path, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(temp_path, cache_path(name, key))
+
+
+def load_dataset(name):
+    """
+    Load a preprocessed dataset, from the cache when it is up to date and by importing its preprocessing module otherwise.
+    A cache hit reproduces the side effects of the import on the global random state: the TensorFlow seed cached with
+    the dataset and the NumPy state left by generate_instance, which also recomputes initial_input.
+
+    :param name: name of the preprocessing module, e.g. 'pre_german_credit'.
+    :return: an object exposing X_train, X_test, y_train, y_test, constraint, protected_attribs, initial_input,
+             configurations and, when the module keeps one, the validation split, as the module itself does.
+    """
+    key = cache_key(name)
+    if key is not None and os.path.exists(cache_path(name, key)):
+        with np.load(cache_path(name, key)) as cached:
+            dataset = types.SimpleNamespace(**{attr: cached[attr] for attr in cached.files
+                                               if attr not in ('protected_attribs', 'configurations', 'tf_seed')})
+            dataset.protected_attribs = cached['protected_attribs'].tolist()
+            dataset.configurations = json.loads(str(cached['configurations']))
+            dataset.tf_seed = json.loads(str(cached['tf_seed']))
+        if dataset.tf_seed is not None:
+            import tensorflow as tf
+            tf.random.set_seed(dataset.tf_seed)
+        dataset.initial_input = generate_instance(dataset.constraint)
+        return dataset
+    dataset = importlib.import_module('preprocessing.' + name)
+    save_dataset(name, dataset)
+    return dataset
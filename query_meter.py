@@ -0,0 +1,93 @@
+"""
+This python file provides an opt-in meter of the queries a generation method makes to the model.
+Wrap a model with QueryMeter and pass the wrapper to any generation method in place of the model.
+"""
+
+
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+import tensorflow as tf
+import generation_utilities
+
+
+# functions that only forward a query, the call site is the first caller outside of them and of comprehensions
+_forwarding_functions = {'predict', 'predict_outputs', '__call__'}
+
+
+def call_site(depth=1):
+    # name of the function that issued the current query, e.g. 'generation_utilities.pair_selection' or 'SG.model_argmax'
+
+    frame = sys._getframe(depth + 1)
+    while frame is not None and (frame.f_code.co_name in _forwarding_functions or frame.f_code.co_name.startswith('<')):
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return '{}.{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+
+class QueryMeter:
+    # counter of the calls, rows and wall time spent on the model per call site, it can be called like the model itself
+    # every row fed to the model counts as one query, finite-difference probes included
+    # with a budget, the query that would exceed it raises QueryBudgetExceeded instead of reaching the model, and so does
+    # every later query, which the generation methods catch to stop cleanly with what they have found so far
+    # gradients of white-box methods are taken on the underlying model and are not metered
+    # wrap the model itself rather than a PredictionCache to count only the queries the cache lets through
+
+    def __init__(self, model, budget=None):
+        self.model = model
+        self.budget = budget
+        self.num_calls = 0
+        self.num_queries = 0
+        self.elapsed = 0.0
+        self.exhausted = False
+        self.sites = OrderedDict()
+
+    def __call__(self, X):
+        return tf.constant(self.predict_outputs(np.asarray(X)).reshape(-1, 1))
+
+    def predict_outputs(self, X):
+        # flattened outputs of a batch of instances, charged to the budget before the model is queried
+
+        X = np.asarray(X)
+        if self.exhausted or (self.budget is not None and self.num_queries + len(X) > self.budget):
+            self.exhausted = True
+            raise generation_utilities.QueryBudgetExceeded(self.budget)
+        t1 = time.time()
+        outputs = generation_utilities.predict(self.model, X)
+        elapsed = time.time() - t1
+        site = self.sites.setdefault(call_site(), {'calls': 0, 'queries': 0, 'time': 0.0})
+        site['calls'] += 1
+        site['queries'] += len(X)
+        site['time'] += elapsed
+        self.num_calls += 1
+        self.num_queries += len(X)
+        self.elapsed += elapsed
+        return outputs
+
+    def merge(self, stats):
+        # add the counters of another meter, e.g. the one of a worker process, given as its stats()
+
+        self.num_calls += stats['calls']
+        self.num_queries += stats['queries']
+        self.elapsed += stats['time']
+        self.exhausted = self.exhausted or stats['exhausted']
+        for name, counters in stats['sites'].items():
+            site = self.sites.setdefault(name, {'calls': 0, 'queries': 0, 'time': 0.0})
+            for key in site:
+                site[key] += counters[key]
+
+    def remaining(self):
+        return None if self.budget is None else self.budget - self.num_queries
+
+    def ids_per_kquery(self, num_ids):
+        # individual discriminatory instances found per 1000 queries
+
+        return 1000.0 * num_ids / self.num_queries if self.num_queries > 0 else 0.0
+
+    def stats(self):
+        # counters of the meter since it was created
+
+        return {'calls': self.num_calls, 'queries': self.num_queries, 'time': self.elapsed, 'budget': self.budget,
+                'exhausted': self.exhausted, 'sites': {name: dict(site) for name, site in self.sites.items()}}
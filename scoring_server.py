@@ -0,0 +1,116 @@
+"""
+This python file provides a local stand-in of the HTTP scoring service, serving the .h5 models offline.
+It speaks the TensorFlow Serving REST protocol, so model_adapters.RemoteModel can query it like the production endpoint:
+run `python scoring_server.py --port 8501` and connect to http://localhost:8501/v1/models/german:predict.
+"""
+
+
+import os
+import re
+import json
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from tensorflow import keras
+import model_adapters
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    # POST /v1/models/<name>:predict with {"instances": [[...], ...]} is answered with {"predictions": [[...], ...]}
+    # HTTP/1.1 keeps the connections alive, so that clients can pool them
+
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body of a reply are written separately, so Nagle's algorithm would hold the body back
+    disable_nagle_algorithm = True
+    route = re.compile(r'^/v1/models/([^/:]+)(:predict)?$')
+
+    def do_GET(self):
+        match = self.route.match(self.path)
+        if match is None or match.group(2) is not None or match.group(1) not in self.server.model_specs:
+            return self.reply(404, {'error': 'unknown model'})
+        self.reply(200, {'model_version_status': [{'version': '1', 'state': 'AVAILABLE'}]})
+
+    def do_POST(self):
+        match = self.route.match(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if match is None or match.group(2) is None or match.group(1) not in self.server.model_specs:
+            return self.reply(404, {'error': 'unknown model'})
+        try:
+            X = np.asarray(json.loads(body)['instances'], dtype=np.float32)
+        except (ValueError, KeyError, TypeError):
+            return self.reply(400, {'error': 'malformed instances'})
+        outputs = self.server.get_model(match.group(1)).predict_outputs(X)
+        self.server.num_requests += 1
+        self.server.num_rows += len(X)
+        self.reply(200, {'predictions': outputs.reshape(-1, 1).tolist()})
+
+    def reply(self, status, content):
+        payload = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # keep the console quiet, every request would be logged otherwise
+        pass
+
+
+class ScoringServer(ThreadingHTTPServer):
+    # threaded HTTP server scoring several models, model_specs maps every model name to a .h5 path or a loaded Keras model
+    # models given by path are loaded on their first request
+
+    daemon_threads = True
+
+    def __init__(self, model_specs, host='localhost', port=8501):
+        super().__init__((host, port), ScoringHandler)
+        self.model_specs = model_specs
+        self.models = {}
+        self.load_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_rows = 0
+
+    def get_model(self, name):
+        with self.load_lock:
+            if name not in self.models:
+                spec = self.model_specs[name]
+                self.models[name] = model_adapters.KerasModel(keras.models.load_model(spec) if isinstance(spec, str) else spec)
+            return self.models[name]
+
+    def url(self, name):
+        return 'http://{}:{}/v1/models/{}:predict'.format(self.server_address[0], self.server_address[1], name)
+
+    def start(self):
+        # serve from a background thread, e.g. to test RemoteModel in the same process
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def model_specs_in(model_dir='models/original_models'):
+    # the models of a directory named by their benchmark, e.g. german for german_model.h5
+
+    return {file[:-len('_model.h5')]: os.path.join(model_dir, file) for file in sorted(os.listdir(model_dir))
+            if file.endswith('_model.h5')}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in of the scoring service')
+    parser.add_argument('--host', type=str, default='localhost', help='The address the server listens on')
+    parser.add_argument('--port', type=int, default=8501, help='The port the server listens on')
+    parser.add_argument('--model_dir', type=str, default='models/original_models', help='The directory of the .h5 models served')
+    args = parser.parse_args()
+
+    server = ScoringServer(model_specs_in(args.model_dir), args.host, args.port)
+    for name in server.model_specs:
+        print('Serving {} at {}'.format(name, server.url(name)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
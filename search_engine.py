@@ -0,0 +1,354 @@
+"""
+This python file provides the search engine shared by the gradient-guided methods ADF, EIDIG and MAFT.
+A method is a combination of a gradient source, a global direction rule and a local sampling distribution,
+the global and local generation loops and their batched variants are implemented only once here.
+"""
+
+
+import numpy as np
+import generation_utilities
+
+
+class GradientSource:
+    # gradients guiding the search, compute_grad_batch(X, model) returns the gradients of a batch of instances
+    # the pair of instances compared at each step is differentiated within one call
+
+    def __init__(self, compute_grad_batch):
+        self.compute_grad_batch = compute_grad_batch
+
+    def __call__(self, X, model):
+        return self.compute_grad_batch(X, model)
+
+
+class GlobalDirection:
+    # direction rule of the global generation phase
+    # an instance moves along sign * sign(gradient) on the non-protected attributes where the gradients of the pair agree
+    # gradients accumulate momentum with a decay factor as in EIDIG and MAFT, or none with decay=None as in ADF
+
+    def __init__(self, sign=1, decay=None):
+        self.sign = sign
+        self.decay = decay
+
+    def accumulate(self, grad, new_grad):
+        if self.decay is None:
+            return new_grad
+        return self.decay * grad + new_grad
+
+    def __call__(self, grad1, grad2, is_protected):
+        sign_grad1 = np.sign(grad1)
+        sign_grad2 = np.sign(grad2)
+        return np.where((sign_grad1 == sign_grad2) & ~is_protected, self.sign * sign_grad1, 0.0)
+
+
+class SaliencySampler:
+    # sampling distribution of the attribute perturbed at each step of the local generation phase
+    # the normalized saliency of an instance and its pair is refreshed after update_interval successful steps as in EIDIG and MAFT,
+    # or before every step against a random flipped pair with update_interval=0 as in ADF
+
+    def __init__(self, update_interval=0, epsilon=1e-6):
+        self.update_interval = update_interval
+        self.epsilon = epsilon
+
+    def probability(self, grad1, grad2, protected_attribs):
+        return generation_utilities.normalization(grad1, grad2, protected_attribs, self.epsilon)
+
+    def probability_batch(self, grad1, grad2, protected_attribs):
+        return generation_utilities.normalization_batch(grad1, grad2, protected_attribs, self.epsilon)
+
+
+class SearchEngine:
+    # global and local generation driven by the strategies of one method
+    # every function returns the same outputs as the loops it replaces in ADF, EIDIG and MAFT
+
+    def __init__(self, gradient, direction, sampler):
+        self.gradient = gradient
+        self.direction = direction
+        self.sampler = sampler
+
+    def global_walk(self, x1, num_attribs, protected_attribs, constraint, model, max_iter, s_g, check_last=False):
+        # move one seed along the global direction until it becomes discriminatory or max_iter moves are made
+        # return the last instance, whether it is discriminatory, the instances reached by every move and the number of checks
+        # with check_last=True the instance reached by the last move is checked as well
+
+        return generation_utilities.run_steps(self.global_steps(x1, num_attribs, protected_attribs, constraint, max_iter, s_g, check_last),
+                                              model, self.gradient)
+
+    def local_walk(self, x1, num_attribs, l_num, protected_attribs, constraint, model, s_l):
+        # random walk of the local generation phase around one global discriminatory instance
+        # yield every instance generated and whether it is discriminatory, a failed step restarts from the global instance
+
+        return generation_utilities.serve(self.local_steps(x1, num_attribs, l_num, protected_attribs, constraint, s_l), model, self.gradient)
+
+    def global_steps(self, x1, num_attribs, protected_attribs, constraint, max_iter, s_g, check_last=False):
+        # the steps of global_walk, querying the model through the requests of generation_utilities.serve
+
+        is_protected = np.isin(np.arange(num_attribs), protected_attribs)
+        grad1 = np.zeros(num_attribs)
+        grad2 = np.zeros(num_attribs)
+        path = []
+        num_checks = max_iter + 1 if check_last else max_iter
+        for i in range(num_checks):
+            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
+            is_disc, x2, _ = yield 'pair', x1, similar_x1
+            if is_disc:
+                return x1, True, path, i + 1
+            if i == max_iter:
+                break
+            grads = yield 'gradient', np.array([x1, x2], dtype=float)
+            grad1 = self.direction.accumulate(grad1, grads[0])
+            grad2 = self.direction.accumulate(grad2, grads[1])
+            x1 = x1 + s_g * self.direction(grad1, grad2, is_protected)
+            x1 = generation_utilities.clip(x1, constraint)
+            path.append(x1)
+        return x1, False, path, num_checks
+
+    def local_steps(self, x1, num_attribs, l_num, protected_attribs, constraint, s_l, rng=np.random):
+        # the steps of local_walk, querying the model through the requests of generation_utilities.serve
+        # the walk starts from a copy of x1, which may be a row of the caller's DedupSet, and draws its steps from rng
+
+        direction = [-1, 1]
+        update_interval = self.sampler.update_interval
+        x1 = x1.copy()
+        x0 = x1.copy()
+        similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
+        _, x2, pairs_x0 = yield 'pair', x1, similar_x1
+        pairs_x1 = pairs_x0
+        if update_interval > 0:
+            grads = yield 'gradient', np.array([x1, x2], dtype=float)
+            p = self.sampler.probability(grads[0], grads[1], protected_attribs)
+            p0 = p.copy()
+        suc_iter = 0
+        for _ in range(l_num):
+            if suc_iter >= update_interval:
+                # x1 has just passed the oracle, so its flipped similar instances are already known
+                x2 = generation_utilities.pick_pair(pairs_x1, rng)
+                grads = yield 'gradient', np.array([x1, x2], dtype=float)
+                p = self.sampler.probability(grads[0], grads[1], protected_attribs)
+                suc_iter = 0
+            suc_iter += 1
+            a = generation_utilities.random_pick(p, rng)
+            s = generation_utilities.random_pick([0.5, 0.5], rng)
+            x1[a] = x1[a] + direction[s] * s_l
+            x1 = generation_utilities.clip(x1, constraint)
+            similar_x1 = generation_utilities.similar_set(x1, num_attribs, protected_attribs, constraint)
+            is_disc, _, pairs_x1 = yield 'pair', x1, similar_x1
+            yield 'instance', x1, is_disc
+            if not is_disc:
+                x1 = x0.copy()
+                pairs_x1 = pairs_x0
+                if update_interval > 0:
+                    p = p0.copy()
+                suc_iter = 0
+
+    def global_generation(self, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g):
+        # global generation phase, seed by seed
+
+        g_id = generation_utilities.DedupSet(num_attribs, constraint)
+        all_gen_g = generation_utilities.RowBuffer(num_attribs, generation_utilities.domain_dtype(constraint))
+        try_times = 0
+        try:
+            for seed in seeds:
+                x1, is_disc, path, num_checks = self.global_walk(seed.copy(), num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+                try_times += num_checks
+                if is_disc:
+                    g_id.append(x1)
+                all_gen_g.extend(path)
+        except generation_utilities.QueryBudgetExceeded:
+            # the model ran out of query budget, keep what has been found so far
+            pass
+        return g_id.view(), all_gen_g.view(), try_times
+
+    def population_global_generation(self, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g):
+        # global generation phase that advances all the seeds together as one population
+        # seeds are dropped from the active mask as soon as they become discriminatory
+        # the outputs coincide with those of global_generation, all_gen_g is ordered seed by seed as well
+
+        x1 = np.array(seeds, dtype=float)
+        grad1 = np.zeros_like(x1)
+        grad2 = np.zeros_like(x1)
+        is_protected = np.isin(np.arange(num_attribs), protected_attribs)
+        active = np.ones(len(x1), dtype=bool)
+        found = np.zeros(len(x1), dtype=bool)
+        all_gen_g = []
+        gen_owner = []
+        try_times = 0
+        try:
+            for _ in range(max_iter):
+                index = np.flatnonzero(active)
+                try_times += len(index)
+                is_disc, x2, _, _ = generation_utilities.pair_selection_batch(x1[index], num_attribs, protected_attribs, constraint, model)
+                found[index[is_disc]] = True
+                active[index[is_disc]] = False
+                index = index[~is_disc]
+                if len(index) == 0:
+                    break
+                # gradients of the instances and their partners come from a single call
+                grads = self.gradient(np.vstack((x1[index], x2[~is_disc])), model)
+                grad1[index] = self.direction.accumulate(grad1[index], grads[:len(index)])
+                grad2[index] = self.direction.accumulate(grad2[index], grads[len(index):])
+                direction = self.direction(grad1[index], grad2[index], is_protected)
+                x1[index] = generation_utilities.clip(x1[index] + s_g * direction, constraint)
+                all_gen_g.append(x1[index])
+                gen_owner.append(index)
+        except generation_utilities.QueryBudgetExceeded:
+            # the model ran out of query budget, keep what has been found so far
+            pass
+        if len(all_gen_g) > 0:
+            order = np.argsort(np.concatenate(gen_owner), kind='stable')
+            all_gen_g = np.concatenate(all_gen_g)[order]
+        else:
+            all_gen_g = np.empty(shape=(0, num_attribs))
+        g_id = generation_utilities.DedupSet(num_attribs, constraint)
+        g_id.extend(x1[found])
+        return g_id.view(), all_gen_g, try_times
+
+    def local_generation(self, num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l):
+        # local generation phase, one random walk per global discriminatory instance
+
+        l_id = generation_utilities.DedupSet(num_attribs, constraint)
+        all_gen_l = generation_utilities.RowBuffer(num_attribs, generation_utilities.domain_dtype(constraint))
+        try_times = 0
+        try:
+            for x1 in g_id:
+                for x, is_disc in self.local_walk(x1, num_attribs, l_num, protected_attribs, constraint, model, s_l):
+                    try_times += 1
+                    all_gen_l.append(x)
+                    if is_disc:
+                        l_id.append(x)
+        except generation_utilities.QueryBudgetExceeded:
+            # the model ran out of query budget, keep what has been found so far
+            pass
+        return l_id.view(), all_gen_l.view(), try_times
+
+    def multichain_local_generation(self, num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, num_chains=1):
+        # local generation phase that runs the random walks of all the chains as rows of one matrix
+        # every global discriminatory instance starts num_chains independent chains, which share its budget of l_num steps
+
+        direction = np.array([-1, 1])
+        update_interval = self.sampler.update_interval
+        if len(g_id) == 0 or l_num == 0:
+            return np.empty(shape=(0, num_attribs)), np.empty(shape=(0, num_attribs)), 0
+        num_steps = int(np.ceil(l_num / num_chains))
+        x0 = np.repeat(np.array(g_id, dtype=float), num_chains, axis=0)
+        # with update_interval=0 the distribution is refreshed before every step, so the initial one is never used
+        p0 = np.zeros_like(x0)
+        try:
+            _, x2, similar_x0, flipped_x0 = generation_utilities.pair_selection_batch(x0, num_attribs, protected_attribs, constraint, model)
+            if update_interval > 0:
+                grads = self.gradient(np.vstack((x0, x2)), model)
+                p0 = self.sampler.probability_batch(grads[:len(x0)], grads[len(x0):], protected_attribs)
+        except generation_utilities.QueryBudgetExceeded:
+            return np.empty(shape=(0, num_attribs)), np.empty(shape=(0, num_attribs)), 0
+        x1 = x0.copy()
+        p = p0.copy()
+        similar_x1 = similar_x0.copy()
+        flipped_x1 = flipped_x0.copy()
+        suc_iter = np.zeros(len(x0), dtype=int)
+        rows = np.arange(len(x0))
+        l_id = generation_utilities.DedupSet(num_attribs, constraint)
+        all_gen_l = generation_utilities.RowBuffer(num_attribs, generation_utilities.domain_dtype(constraint), capacity=len(x0) * num_steps)
+        try_times = 0
+        try:
+            for _ in range(num_steps):
+                try_times += len(x0)
+                update = suc_iter >= update_interval
+                if np.any(update):
+                    x2 = generation_utilities.pick_pairs_batch(similar_x1[update], flipped_x1[update])
+                    grads = self.gradient(np.vstack((x1[update], x2)), model)
+                    p[update] = self.sampler.probability_batch(grads[:len(x2)], grads[len(x2):], protected_attribs)
+                    suc_iter[update] = 0
+                suc_iter += 1
+                a = generation_utilities.random_pick_batch(p)
+                s = direction[(np.random.rand(len(x0)) >= 0.5).astype(int)]
+                x1[rows, a] = x1[rows, a] + s * s_l
+                x1 = generation_utilities.clip(x1, constraint)
+                all_gen_l.extend(x1)
+                is_disc, _, similar_x1, flipped_x1 = generation_utilities.pair_selection_batch(x1, num_attribs, protected_attribs, constraint, model)
+                l_id.extend(x1[is_disc])
+                # failed chains restart from their global discriminatory instance
+                failed = ~is_disc
+                x1[failed] = x0[failed]
+                p[failed] = p0[failed]
+                similar_x1[failed] = similar_x0[failed]
+                flipped_x1[failed] = flipped_x0[failed]
+                suc_iter[failed] = 0
+        except generation_utilities.QueryBudgetExceeded:
+            # the model ran out of query budget, keep what has been found so far
+            pass
+        return l_id.view(), all_gen_l.view(), try_times
+
+    def individual_discrimination_generation(self, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g, l_num, s_l,
+                                             population=False, multichain=False, num_chains=1):
+        # global generation on all the seeds followed by local generation on all the global discriminatory instances
+        # return non-duplicated individual discriminatory instances generated, non-duplicate instances generated and total number of search iterations
+
+        if population:
+            g_id, gen_g, g_gen_num = self.population_global_generation(seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+        else:
+            g_id, gen_g, g_gen_num = self.global_generation(seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+        if multichain:
+            l_id, gen_l, l_gen_num = self.multichain_local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l, num_chains)
+        else:
+            l_id, gen_l, l_gen_num = self.local_generation(num_attribs, l_num, g_id, protected_attribs, constraint, model, s_l)
+        all_id_nondup = generation_utilities.DedupSet(num_attribs, constraint)
+        all_id_nondup.extend(g_id)
+        all_id_nondup.extend(l_id)
+        all_gen_nondup = generation_utilities.DedupSet(num_attribs, constraint)
+        all_gen_nondup.extend(gen_g)
+        all_gen_nondup.extend(gen_l)
+        return all_id_nondup.view(), all_gen_nondup.view(), g_gen_num + l_gen_num
+
+    def seedwise_generation(self, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g, l_num, s_l):
+        # perform global generation and local generation successively on each single seed
+        # return the numbers of non-duplicate instances generated and of individual discriminatory instances found after each seed
+
+        num_seeds = len(seeds)
+        num_gen = np.array([0] * num_seeds)
+        num_ids = np.array([0] * num_seeds)
+        ids = generation_utilities.DedupSet(num_attribs, constraint)
+        all_gen = generation_utilities.DedupSet(num_attribs, constraint)
+        try:
+            for index, instance in enumerate(seeds):
+                x1, is_disc, path, _ = self.global_walk(instance.copy(), num_attribs, protected_attribs, constraint, model, max_iter, s_g)
+                all_gen.extend(path)
+                if is_disc:
+                    ids.append(x1)
+                    for x, is_disc in self.local_walk(x1, num_attribs, l_num, protected_attribs, constraint, model, s_l):
+                        all_gen.append(x)
+                        if is_disc:
+                            ids.append(x)
+                num_gen[index] = len(all_gen)
+                num_ids[index] = len(ids)
+        except generation_utilities.QueryBudgetExceeded:
+            # the model ran out of query budget, keep what has been found so far
+            pass
+        return num_gen, num_ids
+
+    def generation_stream(self, seeds, num_attribs, protected_attribs, constraint, model, max_iter, s_g, l_num, s_l, yield_all=False):
+        # perform global generation and local generation successively on each single seed, lazily
+        # yield every new individual discriminatory instance as soon as it is found, so that the consumer can stop at any moment
+        # set yield_all=True to yield (instance, is_disc) for every instance generated instead
+        # only the keys of the instances found are kept in memory to tell the new ones
+
+        ids = generation_utilities.DedupSet(num_attribs, constraint, keep_rows=False)
+        try:
+            for instance in seeds:
+                x1, is_disc, path, _ = self.global_walk(instance.copy(), num_attribs, protected_attribs, constraint, model, max_iter, s_g,
+                                                        check_last=True)
+                if yield_all:
+                    yield instance.copy(), is_disc and len(path) == 0
+                    for i, x in enumerate(path):
+                        yield x.copy(), is_disc and i == len(path) - 1
+                if not is_disc:
+                    continue
+                if ids.append(x1) and not yield_all:
+                    yield x1.copy()
+                for x, is_disc in self.local_walk(x1, num_attribs, l_num, protected_attribs, constraint, model, s_l):
+                    is_new = is_disc and ids.append(x)
+                    if yield_all:
+                        yield x.copy(), is_disc
+                    elif is_new:
+                        yield x.copy()
+        except generation_utilities.QueryBudgetExceeded:
+            # the model ran out of query budget, end the stream
+            pass
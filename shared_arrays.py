@@ -0,0 +1,70 @@
+"""
+This python file provides read-only arrays shared by the processes of a pool through memory-mapped .npy files.
+The parent process writes every array once, under /dev/shm when available so that the files stay in memory,
+and the workers map them with zero copies from small picklable ArrayHandle objects passed in place of the arrays.
+"""
+
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+# arrays already mapped by the current process, by path
+_opened = {}
+
+
+class ArrayHandle:
+    # picklable reference to a shared array, open() maps it read-only once per process
+
+    def __init__(self, path, shape, dtype):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def open(self):
+        if self.path not in _opened:
+            _opened[self.path] = np.load(self.path, mmap_mode='r')
+        return _opened[self.path]
+
+
+def resolve(value):
+    # the array behind a handle, any other value is returned as it is
+
+    return value.open() if isinstance(value, ArrayHandle) else value
+
+
+class SharedArrayStore:
+    # directory of the arrays shared during one run, removed by close()
+    # sharing the same array object again returns the handle of its first copy, so the dataset and the seeds of a benchmark
+    # are written once however many methods are run on them
+
+    def __init__(self, directory=None):
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        self.directory = tempfile.mkdtemp(prefix='shared_arrays_', dir=directory)
+        self.handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def share(self, array):
+        key = id(array)
+        if key not in self.handles:
+            data = np.ascontiguousarray(array)
+            path = os.path.join(self.directory, 'array_{}.npy'.format(len(self.handles)))
+            np.save(path, data)
+            # the array is kept alive with its handle, so that its id cannot be reused by another array
+            self.handles[key] = (array, ArrayHandle(path, data.shape, data.dtype.str))
+        return self.handles[key][1]
+
+    def close(self):
+        self.handles = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
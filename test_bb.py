@@ -16,6 +16,11 @@ parser.add_argument('--g_num', type=int, default=20, help='The number of seeds u
 parser.add_argument('--l_num', type=int, default=20, help='The maximum search iteration in the local generation phase')
 parser.add_argument('--perturbation_size', type=float, default=1.0, help='The perturbation size used in the MAFT method')
 parser.add_argument('--should_restore_progress', type=lambda x: (str(x).lower() == 'true'), default=True, help='Control whether the experiment starts from scratch')
+parser.add_argument('--benchmarks', type=str, default=None, help='Comma-separated benchmarks to run, e.g. G-g,G-a, the others are never loaded')
+parser.add_argument('--n_jobs', type=int, default=1, help='The number of worker processes the seeds are sharded across')
+parser.add_argument('--count_queries', type=lambda x: (str(x).lower() == 'true'), default=False, help='Control whether the model queries of every method are counted and reported')
+parser.add_argument('--query_budget', type=int, default=None, help='The maximum number of model queries of every method')
+parser.add_argument('--tree_cache_size', type=int, default=0, help='The number of interpretable trees SG keeps to reuse across nearby instances')
 
 args = parser.parse_args()
 round_id = args.round_id
@@ -23,6 +28,11 @@ g_num = args.g_num
 l_num = args.l_num
 perturbation_size = args.perturbation_size
 should_restore_progress = args.should_restore_progress
+benchmarks = experiment_config.parse_benchmarks(args.benchmarks)
+n_jobs = args.n_jobs
+count_queries = args.count_queries
+query_budget = args.query_budget
+tree_cache_size = args.tree_cache_size
 
 # experiment results will be saved in a csv file
 iter = '{}x{}_H_{}'.format(g_num, l_num, perturbation_size)
@@ -31,7 +41,7 @@ if not os.path.exists(dir):
     os.makedirs(dir)
 filename = dir + 'comparison_info_round_{}.csv'.format(round_id)
 
-info = experiment_config.all_benchmark_info
+info = experiment_config.all_benchmark_info.select(benchmarks)
 all_benchmarks = [benchmark for benchmark in info.keys()]
 all_methods = [method.name for method in experiment_config.BlackboxMethod]
 all_columns = ['round_id', 'benchmark', 'method', 'num_id', 'num_all_id', 'total_iter', 'time_cost']
@@ -49,27 +59,31 @@ else:
     # create an empty DataFrame with columns matching the data returned by run_experiments function
     existing_data = pd.DataFrame(columns=all_columns)
 
-for benchmark in completed_benchmarks:
-    print(datetime.now())
-    print('Skipping benchmark {}'.format(benchmark))
-for benchmark in benchmarks_to_run:
-    print('\n', benchmark, ':\n')
-    print(datetime.now())
-    model, dataset, protected_attribs = info[benchmark]
-    num_ids, num_all_ids, total_iter, time_cost = experiments.comparison_blackbox(round_id, benchmark, dataset.X_train, protected_attribs, dataset.constraint, model, g_num, l_num,
-                                                                         perturbation_size, dataset.initial_input, dataset.configurations)
-    # construct a dictionary for each round/benchmark/method
-    for method_idx, method in enumerate(all_methods):
-        data_to_append = {
-            all_columns[0]: round_id,
-            all_columns[1]: benchmark,
-            all_columns[2]: method,
-            all_columns[3]: num_ids[method_idx],
-            all_columns[4]: num_all_ids[method_idx],
-            all_columns[5]: total_iter[method_idx],
-            all_columns[6]: time_cost[method_idx]
-        }
-        # append to existing data
-        existing_data = existing_data.append(data_to_append, ignore_index=True)
-    existing_data.to_csv(filename, index=False)
-print(existing_data)
\ No newline at end of file
+# worker processes re-import this script when n_jobs > 1, so the experiments only run in the main process
+if __name__ == '__main__':
+    for benchmark in completed_benchmarks:
+        print(datetime.now())
+        print('Skipping benchmark {}'.format(benchmark))
+    for benchmark in benchmarks_to_run:
+        print('\n', benchmark, ':\n')
+        print(datetime.now())
+        model, dataset, protected_attribs = info[benchmark]
+        num_ids, num_all_ids, total_iter, time_cost = experiments.comparison_blackbox(round_id, benchmark, dataset.X_train, protected_attribs, dataset.constraint, model, g_num, l_num,
+                                                                             perturbation_size, dataset.initial_input, dataset.configurations, n_jobs=n_jobs,
+                                                                             count_queries=count_queries, query_budget=query_budget,
+                                                                             tree_cache_size=tree_cache_size)
+        # construct a dictionary for each round/benchmark/method
+        for method_idx, method in enumerate(all_methods):
+            data_to_append = {
+                all_columns[0]: round_id,
+                all_columns[1]: benchmark,
+                all_columns[2]: method,
+                all_columns[3]: num_ids[method_idx],
+                all_columns[4]: num_all_ids[method_idx],
+                all_columns[5]: total_iter[method_idx],
+                all_columns[6]: time_cost[method_idx]
+            }
+            # append to existing data
+            existing_data = existing_data.append(data_to_append, ignore_index=True)
+        existing_data.to_csv(filename, index=False)
+    print(existing_data)
\ No newline at end of file
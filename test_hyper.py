@@ -11,13 +11,17 @@ parser = argparse.ArgumentParser(description='Experiment configuration')
 parser.add_argument('--round_id', type=int, default=1, help='The id of current round')
 parser.add_argument('--g_num', type=int, default=10, help='The number of seeds used in the global generation phase')
 parser.add_argument('--l_num', type=int, default=10, help='The maximum search iteration in the local generation phase')
+parser.add_argument('--maft_schemes', type=str, default='forward', help='Comma-separated MAFT gradient estimators, e.g. forward,spsa:8,subspace:8, where the number is the query budget per gradient')
 parser.add_argument('--should_restore_progress', type=lambda x: (str(x).lower() == 'true'), default=True, help='Control whether the experiment starts from scratch')
+parser.add_argument('--benchmarks', type=str, default=None, help='Comma-separated benchmarks to run, e.g. G-g,G-a, the others are never loaded')
 
 args = parser.parse_args()
 round_id = args.round_id
 g_num = args.g_num
 l_num = args.l_num
 should_restore_progress = args.should_restore_progress
+benchmarks = experiment_config.parse_benchmarks(args.benchmarks)
+scheme_list = [(scheme.split(':')[0], int(scheme.split(':')[1]) if ':' in scheme else None) for scheme in args.maft_schemes.split(',')]
 ps_from = -10
 ps_to = 1
 perturbation_size_list = np.logspace(ps_from, ps_to, num=(ps_to - ps_from)+1, base=10.0) # 创建1e-10到1e5的等比数列
@@ -29,10 +33,11 @@ if not os.path.exists(dir):
     os.makedirs(dir)
 filename = dir + 'hyper_comparison_info_round_{}.csv'.format(round_id)
 
-info = experiment_config.all_benchmark_info
+info = experiment_config.all_benchmark_info.select(benchmarks)
 
 all_benchmarks = [benchmark for benchmark in info.keys()]
-all_methods = ['AEQUITAS', 'SG', 'ADF', 'EIDIG'] + ['MAFT_{}'.format(ps) for ps in perturbation_size_list] # 和experiment_config.py中的AllMethod保持一致
+all_methods = ['AEQUITAS', 'SG', 'ADF', 'EIDIG'] + ['MAFT_{}'.format(ps) if scheme == 'forward' else 'MAFT_{}{}_{}'.format(scheme, num_directions, ps)
+                                                    for ps in perturbation_size_list for scheme, num_directions in scheme_list] # 和experiment_config.py中的AllMethod保持一致
 all_columns = ['round_id', 'benchmark', 'method', 'num_id', 'num_all_id', 'total_iter', 'time_cost']
 
 # check if the file exists to decide whether we need to skip some benchmarks
@@ -57,7 +62,7 @@ for benchmark in benchmarks_to_run:
     model, dataset, protected_attribs = info[benchmark]
     num_ids, num_all_ids, total_iter, time_cost = experiments.hyper_comparison(round_id, benchmark, dataset.X_train, protected_attribs, dataset.constraint, model,
                                                                                perturbation_size_list, dataset.initial_input, dataset.configurations,
-                                                                               g_num, l_num)
+                                                                               g_num, l_num, scheme_list=scheme_list)
     # construct a dictionary for each round/benchmark/method
     for method_idx, method in enumerate(all_methods):
         data_to_append = {
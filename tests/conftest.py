@@ -0,0 +1,28 @@
+"""
+Shared fixtures of the unit tests, the modules of the repository are imported from its root.
+"""
+
+
+import os
+import sys
+import numpy as np
+import pytest
+from tensorflow import keras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def constraint():
+    # a small categorical input space of 6 features with 4 values each
+
+    return np.array([[0, 3]] * 6)
+
+
+@pytest.fixture(scope='session')
+def model():
+    # a small fixed-weight classifier over the input space of constraint
+
+    keras.utils.set_random_seed(0)
+    return keras.Sequential([keras.Input((6,)), keras.layers.Dense(8, activation='relu'),
+                             keras.layers.Dense(1, activation='sigmoid')])
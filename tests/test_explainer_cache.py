@@ -0,0 +1,26 @@
+"""
+SG builds one LIME explainer per dataset and configuration, and keeps a bounded number of them.
+"""
+
+
+import numpy as np
+import SG
+
+
+def configuration(class_name):
+    return {'feature_name': ['a', 'b', 'c'], 'class_name': [class_name], 'categorical_features': [0, 1, 2]}
+
+
+def test_explainer_is_reused_per_dataset_and_configuration():
+    X = np.random.RandomState(0).randint(0, 4, size=(50, 3))
+    explainer = SG.get_explainer(X, configuration('y'))
+    assert SG.get_explainer(X, configuration('y')) is explainer
+    assert SG.get_explainer(X, configuration('z')) is not explainer
+    assert SG.get_explainer(X.copy(), configuration('y')) is not explainer
+
+
+def test_explainers_are_bounded():
+    X = np.random.RandomState(0).randint(0, 4, size=(50, 3))
+    for i in range(SG.explainer_capacity + 3):
+        SG.get_explainer(X, configuration(str(i)))
+    assert len(SG._explainers) == SG.explainer_capacity
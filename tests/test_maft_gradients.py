@@ -0,0 +1,38 @@
+"""
+MAFT gradients are the same whether the model is queried directly or through a wrapper.
+"""
+
+
+import numpy as np
+import MAFT
+import Gradient
+import model_adapters
+import prediction_cache
+import query_meter
+
+
+# outputs scored in another batch or eagerly may move by a few float32 ulps, which the finite differences divide by the step
+H = 1e-4
+ULP_TOLERANCE = 4 * 2.0 ** -24 / H
+
+
+def instances(constraint, num=16):
+    return np.random.RandomState(1).randint(constraint[:, 0], constraint[:, 1] + 1, size=(num, len(constraint))).astype(float)
+
+
+def test_wrappers_give_the_same_gradients(model, constraint):
+    X = instances(constraint)
+    expected = MAFT.compute_grad_batch(X, model, H)
+    for wrapped in [query_meter.QueryMeter(model), model_adapters.KerasModel(model)]:
+        np.testing.assert_array_equal(MAFT.compute_grad_batch(X, wrapped, H), expected)
+    # the cache queries the rows it lets through in its own order
+    cache = prediction_cache.PredictionCache(model, constraint)
+    np.testing.assert_allclose(MAFT.compute_grad_batch(X, cache, H), expected, rtol=0, atol=ULP_TOLERANCE)
+
+
+def test_single_gradients_match_the_batch(model, constraint):
+    X = instances(constraint, 4)
+    expected = MAFT.compute_grad_batch(X, model, H)
+    for x, gradient in zip(X, expected):
+        np.testing.assert_allclose(Gradient.compute_grad_maft(x, model, H), gradient, rtol=0, atol=ULP_TOLERANCE)
+        np.testing.assert_allclose(Gradient.compute_grad_maft_non_vectorized(x, model, H), gradient, rtol=0, atol=ULP_TOLERANCE)
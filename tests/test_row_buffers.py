@@ -0,0 +1,30 @@
+"""
+Row buffers and deduplicated sets keep the rows exactly as they were generated.
+"""
+
+
+import numpy as np
+import generation_utilities
+
+
+def test_integer_rows_keep_the_domain_dtype():
+    rows = generation_utilities.RowBuffer(2, generation_utilities.domain_dtype([[0, 3], [0, 3]]))
+    rows.extend([[1, 2], [3, 0]])
+    assert rows.view().dtype.kind == 'i'
+    np.testing.assert_array_equal(rows.view(), [[1, 2], [3, 0]])
+
+
+def test_non_integral_rows_are_not_truncated():
+    ids = generation_utilities.DedupSet(2, [[0, 3], [0, 3]])
+    assert ids.append([1, 2])
+    assert ids.append([1.5, 2])
+    assert not ids.append([1, 2])
+    assert len(ids) == 2
+    np.testing.assert_array_equal(ids.view(), [[1, 2], [1.5, 2]])
+
+
+def test_rows_out_of_the_dtype_range_are_not_wrapped():
+    rows = generation_utilities.RowBuffer(2, np.int8)
+    rows.append([1, 2])
+    rows.append([300, 1])
+    np.testing.assert_array_equal(rows.view(), [[1, 2], [300, 1]])
@@ -0,0 +1,37 @@
+"""
+A query budget split across worker shards is spent in full and the meters of the shards merge into one.
+"""
+
+
+import numpy as np
+import pytest
+import generation_utilities
+import parallel_generation
+import query_meter
+
+
+def test_budget_shares_follow_the_shard_sizes():
+    assert parallel_generation.budget_shares(10, [4, 3, 3]) == [4, 3, 3]
+    assert parallel_generation.budget_shares(7, [1, 1, 1]) == [3, 2, 2]
+    assert parallel_generation.budget_shares(None, [2, 2]) == [None, None]
+
+
+def test_shards_stop_at_their_share_and_merge(model):
+    parallel_generation._worker_model = model
+    seeds = np.array([[0, 1, 2, 3, 0, 1]] * 4, dtype=float)
+    constraint = np.array([[0, 3]] * 6)
+    X = np.zeros((1, 6))
+    shard_stats = []
+    for shard_id, (bounds, share) in enumerate(zip([(0, 2), (2, 4)], parallel_generation.budget_shares(9, [2, 2]))):
+        _, stats = parallel_generation._run_shard('ADF', 0, shard_id, X, seeds, bounds, [0], constraint, {'l_num': 5}, 0,
+                                                  share, True)
+        assert stats['queries']['budget'] == share
+        assert stats['queries']['queries'] <= share
+        shard_stats.append(stats)
+    meter = query_meter.QueryMeter(None, 9)
+    for stats in shard_stats:
+        meter.merge(stats['queries'])
+    assert meter.num_queries == sum(stats['queries']['queries'] for stats in shard_stats)
+    assert meter.exhausted
+    with pytest.raises(generation_utilities.QueryBudgetExceeded):
+        meter.predict_outputs(np.zeros((1, 6)))
@@ -0,0 +1,45 @@
+"""
+SG's surrogate tree cache reuses a tree only where it still agrees with the model, and checks it without touching the
+global random stream.
+"""
+
+
+import numpy as np
+import tensorflow as tf
+import SG
+
+
+CONF = {'feature_name': ['a', 'b', 'c'], 'class_name': ['y'], 'categorical_features': [0, 1, 2]}
+
+
+def threshold_model(samples):
+    # positive iff the first feature is at least 2, a value the training data never takes
+    return tf.constant((np.asarray(samples)[:, :1] >= 2).astype(np.float32))
+
+
+def training_data():
+    rng = np.random.RandomState(0)
+    X = rng.randint(0, 4, size=(200, 3))
+    X[:, 0] = rng.randint(0, 2, size=200)
+    return X
+
+
+def test_distant_instance_is_rejected_and_refit():
+    np.random.seed(0)
+    surrogates = SG.SurrogateCache(training_data(), threshold_model, CONF, num_samples=500)
+    surrogates.getPath([0, 1, 2])
+    surrogates.getPath([1, 1, 2])
+    assert (surrogates.num_refit, surrogates.num_reused, surrogates.num_rejected) == (1, 1, 0)
+    # the tree fitted on the training frequencies of the first feature has never seen the positive region
+    surrogates.getPath([3, 1, 2])
+    assert (surrogates.num_refit, surrogates.num_reused, surrogates.num_rejected) == (2, 1, 1)
+    assert len(surrogates.trees) == 2
+
+
+def test_fidelity_leaves_the_global_random_stream_untouched():
+    np.random.seed(0)
+    surrogates = SG.SurrogateCache(training_data(), threshold_model, CONF, num_samples=500)
+    surrogates.getPath([0, 1, 2])
+    state = np.random.get_state()
+    surrogates.fidelity(surrogates.trees[0], [1, 1, 2])
+    assert np.array_equal(np.random.get_state()[1], state[1]) and np.random.get_state()[2] == state[2]